@@ -0,0 +1,74 @@
+"""Measure the application's time to first window.
+
+Each run starts a fresh interpreter which imports src.main, builds the
+dashboard, waits until Tk has drawn it and reports when that happened; the
+time is counted from the moment the process was launched. Runs use a copy of
+the database, so the real one is never migrated or modified.
+
+    python scripts/bench_startup.py
+    python scripts/bench_startup.py --runs 10 --db ..\\parc_prod.db
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_CHILD = '''
+import json, sys, time
+sys.path.insert(0, {root!r})
+from src import db
+db.DB_PATH = {db!r}
+from src.main import init_db, DashboardApp
+init_db()
+app = DashboardApp()
+app.root.update()
+shown = time.time()
+heavy = [m for m in ('matplotlib', 'reportlab', 'numpy') if m in sys.modules]
+app.root.destroy()
+print(json.dumps({{'shown': shown, 'heavy': heavy}}))
+'''
+
+
+def run_once(db_path):
+    started = time.time()
+    proc = subprocess.run(
+        [sys.executable, '-c', _CHILD.format(root=ROOT, db=db_path)],
+        capture_output=True, text=True,
+    )
+    if proc.returncode:
+        raise SystemExit(proc.stderr.strip())
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    return result['shown'] - started, result['heavy']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Temps de démarrage jusqu\'à la première fenêtre')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--db', default=os.path.join(ROOT, 'vehicule_parc.db'), help='base copiée pour les mesures')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        shutil.copyfile(args.db, db_path)
+        # The first run applies any pending migration; it is not counted
+        run_once(db_path)
+        times = []
+        for i in range(args.runs):
+            elapsed, heavy = run_once(db_path)
+            times.append(elapsed)
+            print(f'run {i + 1}: {elapsed * 1000:.0f} ms' + (f"  (chargés : {', '.join(heavy)})" if heavy else ''))
+
+    print(f'médiane {statistics.median(times) * 1000:.0f} ms, min {min(times) * 1000:.0f} ms, '
+          f'max {max(times) * 1000:.0f} ms')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
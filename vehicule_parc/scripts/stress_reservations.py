@@ -0,0 +1,167 @@
+"""Book and return the same few vehicles from many processes at once.
+
+Every process plays a reception desk. First all of them book random
+periods of a small pool of vehicles through src.services, so that most
+attempts collide; then all of them try to close every booking. The first
+vehicle starts with a trip that was due back an hour ago and never closed,
+which must keep it from being booked at all. The run fails if two bookings
+of one vehicle overlap, if the overdue vehicle was booked or offered, or if
+a trip was closed more than once. The database is a fresh temporary one.
+
+    python scripts/stress_reservations.py
+    python scripts/stress_reservations.py --processus 16 --tentatives 500 --vehicules 3
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src import db
+
+# Bookings fall in the DAYS days after tomorrow, so that none starts now
+DAYS = 3
+MAX_HOURS = 12
+
+_OVERLAPS = '''
+    SELECT COUNT(*) FROM sorties_reservations a
+    JOIN sorties_reservations b ON b.vehicule_id = a.vehicule_id AND b.id > a.id
+    WHERE a.debut_prevu < b.fin_prevue AND b.debut_prevu < a.fin_prevue
+'''
+
+
+def _setup(path, vehicles):
+    """Create the vehicles and the employee; returns the id of the overdue vehicle."""
+    db.DB_PATH = path
+    db.init_db()
+    conn = db.get_connection()
+    conn.executemany("INSERT INTO vehicules (immatriculation, statut) VALUES (?, 'disponible')",
+                     [(f'STRESS-{i}',) for i in range(vehicles)])
+    conn.execute("INSERT INTO employes (matricule, nom, prenom, autorise_conduire) VALUES ('S1', 'Test', 'Stress', 1)")
+    # Booked from yesterday until an hour ago and never brought back
+    overdue = conn.execute("SELECT MIN(id) FROM vehicules").fetchone()[0]
+    start, end = datetime.now() - timedelta(days=1), datetime.now() - timedelta(hours=1)
+    conn.execute('''INSERT INTO sorties_reservations (vehicule_id, employe_id, date_sortie_prevue, heure_sortie_prevue,
+                                                      date_retour_prevue, heure_retour_prevue, statut)
+                    VALUES (?, (SELECT id FROM employes), ?, ?, ?, ?, 'réservée')''',
+                 (overdue, start.strftime('%Y-%m-%d'), start.strftime('%H:%M'),
+                  end.strftime('%Y-%m-%d'), end.strftime('%H:%M')))
+    conn.commit()
+    db.close_connection()
+    return overdue
+
+
+def _book(path, seed, attempts):
+    """Booking attempts of one process: ``(booked, refused)``."""
+    db.DB_PATH = path
+    from src.scheduling import ConflictError
+    from src.services import reserve_vehicle
+
+    rng = random.Random(seed)
+    conn = db.get_connection()
+    vehicles = [r[0] for r in conn.execute('SELECT id FROM vehicules')]
+    employee = conn.execute('SELECT id FROM employes').fetchone()[0]
+    origin = datetime.now().replace(minute=0, second=0, microsecond=0) + timedelta(days=1)
+    booked = refused = 0
+    for _ in range(attempts):
+        start = origin + timedelta(hours=rng.randrange(DAYS * 24))
+        end = start + timedelta(hours=rng.randint(1, MAX_HOURS))
+        schedule = (start.strftime('%Y-%m-%d'), start.strftime('%H:%M'),
+                    end.strftime('%Y-%m-%d'), end.strftime('%H:%M'))
+        try:
+            reserve_vehicle(rng.choice(vehicles), employee, schedule, 0, 'Stress', 'Test')
+            booked += 1
+        except ConflictError:
+            refused += 1
+    db.close_connection()
+    return booked, refused
+
+
+def _close(path, seed):
+    """Closing attempts of one process over every booking: ``(closed, refused)``."""
+    db.DB_PATH = path
+    from src.scheduling import ConflictError
+    from src.services import close_return
+
+    conn = db.get_connection()
+    trips = [r[0] for r in conn.execute("SELECT id FROM sorties_reservations WHERE statut = 'réservée'")]
+    random.Random(seed).shuffle(trips)
+    closed = refused = 0
+    for trip in trips:
+        try:
+            close_return(trip, 10, 'Propre', 'Plein', 'disponible', '2000-01-01', '12:00')
+            closed += 1
+        except ConflictError:
+            refused += 1
+    db.close_connection()
+    return closed, refused
+
+
+def _count(path, sql, params=()):
+    db.DB_PATH = path
+    value = db.get_connection().execute(sql, params).fetchone()[0]
+    db.close_connection()
+    return value
+
+
+def _offered(path, vehicule_id):
+    """Whether available_vehicles() lists the vehicle for a period after the
+    booking window, where nothing but the overdue trip can block it."""
+    db.DB_PATH = path
+    from src.scheduling import available_vehicles
+
+    start = datetime.now() + timedelta(days=DAYS + 2)
+    free = available_vehicles(start.strftime('%Y-%m-%d %H:%M'), (start + timedelta(hours=4)).strftime('%Y-%m-%d %H:%M'))
+    db.close_connection()
+    return any(v['id'] == vehicule_id for v in free)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Réservations et retours concurrents depuis plusieurs processus')
+    parser.add_argument('--processus', type=int, default=8)
+    parser.add_argument('--tentatives', type=int, default=200, help='réservations tentées par processus')
+    parser.add_argument('--vehicules', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'stress.db')
+        overdue = _setup(path, args.vehicules)
+
+        started = time.perf_counter()
+        with multiprocessing.Pool(args.processus) as pool:
+            bookings = pool.starmap(_book, [(path, seed, args.tentatives) for seed in range(args.processus)])
+            booking_time = time.perf_counter() - started
+            overlaps = _count(path, _OVERLAPS)
+            booked = _count(path, 'SELECT COUNT(*) FROM sorties_reservations')
+            rebooked = _count(path, 'SELECT COUNT(*) - 1 FROM sorties_reservations WHERE vehicule_id = ?', (overdue,))
+            offered = _offered(path, overdue)
+
+            started = time.perf_counter()
+            closings = pool.starmap(_close, [(path, seed) for seed in range(args.processus)])
+            closing_time = time.perf_counter() - started
+        closed = _count(path, "SELECT COUNT(*) FROM sorties_reservations WHERE statut = 'clôturée'")
+        rolled = _count(path, 'SELECT COALESCE(SUM(nb_sorties), 0) FROM rollup_vehicule_jour')
+
+    accepted, refused = map(sum, zip(*bookings))
+    returned, already = map(sum, zip(*closings))
+    print(f'{args.processus} processus, {args.vehicules} véhicules')
+    print(f'réservations : {accepted} acceptées, {refused} refusées en {booking_time:.1f} s ; '
+          f'{booked} en base, {overlaps} chevauchement(s)')
+    print(f"véhicule en retard : {rebooked} réservation(s), {'proposé' if offered else 'non proposé'}")
+    print(f'retours : {returned} clôturés, {already} déjà clôturés en {closing_time:.1f} s ; '
+          f'{closed} clôturés en base, {rolled} dans les agrégats')
+    # The overdue trip is in the database but was not booked by the processes
+    failed = (overlaps or rebooked or offered or accepted + 1 != booked
+              or returned != booked or closed != booked or rolled != booked)
+    print('ÉCHEC' if failed else 'OK')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,243 @@
+"""Headless alert scheduler.
+
+Every cycle first takes out the vehicles whose booked trip has begun
+(services.start_departures), then evaluates the deadlines of
+alerts.deadlines() (maintenances, documents, driving licences, mileage
+revisions) against ``alertes_emises``, the tag last notified for each of
+them. A deadline seen for the first time, or whose tag got worse (ok, then
+soon, then overdue), gets a row in ``notifications_outbox``; deadlines no
+longer listed (done, or moved beyond the horizon) are forgotten, so they
+are notified again if they come back. A cycle where neither the database
+nor the day changed evaluates nothing.
+
+Sinks then deliver the outbox, oldest first: a file of JSON lines, or mails
+through an SMTP server (for tests, a local stand-in such as
+``python -m aiosmtpd -n -l localhost:1025``). Delivery is at least once: a
+batch that fails is retried whole at the next cycle, up to MAX_ATTEMPTS;
+notifications still not sent then get a ``date_echec`` and an error log.
+
+    python -m src.alertd --once --fichier notifications.jsonl
+    python -m src.alertd --interval 300 --smtp localhost:1025 --a parc@example.org
+"""
+import argparse
+import json
+import logging
+import os
+import smtplib
+import sys
+import time
+from datetime import date, datetime
+from email.message import EmailMessage
+
+# Allow running as a script, like main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.alerts import HORIZON_DAYS, deadlines
+from src.db import data_generation, get_connection, init_db
+from src.services import start_departures
+
+INTERVAL = 300
+BATCH_SIZE = 100
+MAX_ATTEMPTS = 5
+SMTP_TIMEOUT = 10
+
+log = logging.getLogger('parc.alertd')
+
+# Order of the tags; a notification is sent when the tag goes up
+_SEVERITY = {'ok': 0, 'soon': 1, 'overdue': 2}
+_TAG_LABELS = {'ok': 'À venir', 'soon': 'Proche', 'overdue': 'Échue'}
+
+_UPSERT_EMITTED = '''
+    INSERT INTO alertes_emises (cle, categorie, objet, date_echeance, statut, date_emission)
+    VALUES (:cle, :categorie, :objet, :date_echeance, :tag, :now)
+    ON CONFLICT (cle) DO UPDATE SET objet = excluded.objet, date_echeance = excluded.date_echeance,
+                                    statut = excluded.statut, date_emission = excluded.date_emission
+'''
+
+_INSERT_OUTBOX = '''
+    INSERT INTO notifications_outbox (cle, sujet, message, date_creation)
+    VALUES (:cle, :sujet, :message, :now)
+'''
+
+
+def _notification(item):
+    days = item['jours']
+    when = item['date_echeance'] + (f' ({days} jours)' if days != '' else '')
+    return {
+        'sujet': f"[{_TAG_LABELS[item['tag']]}] {item['categorie']} {item['objet']} : {item['description']}",
+        'message': f"{item['categorie']} — {item['objet']}\n{item['description']}\nÉchéance : {when}",
+    }
+
+
+def evaluate(conn, today=None, horizon_days=HORIZON_DAYS):
+    """Queue the notifications of new or worsened deadlines.
+
+    Returns ``(notifications queued, deadlines forgotten)``.
+    """
+    items = deadlines(today or date.today(), horizon_days)
+    now = datetime.now().isoformat(timespec='seconds')
+
+    # Read under the write lock, so that two schedulers on one database
+    # cannot both find the same deadline new
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        emitted = dict(conn.execute('SELECT cle, statut FROM alertes_emises'))
+        changed, notify = [], []
+        for item in items:
+            previous = emitted.get(item['cle'])
+            if previous == item['tag']:
+                continue
+            row = dict(item, now=now)
+            changed.append(row)
+            if previous is None or _SEVERITY[item['tag']] > _SEVERITY.get(previous, -1):
+                notify.append(dict(row, **_notification(item)))
+        gone = emitted.keys() - {item['cle'] for item in items}
+
+        conn.executemany(_UPSERT_EMITTED, changed)
+        conn.executemany(_INSERT_OUTBOX, notify)
+        conn.executemany('DELETE FROM alertes_emises WHERE cle = ?', [(key,) for key in gone])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(notify), len(gone)
+
+
+class FileSink:
+    """Appends each notification to a file as one JSON object per line."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, notifications):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for n in notifications:
+                f.write(json.dumps(n, ensure_ascii=False) + '\n')
+
+
+class SmtpSink:
+    """Sends each notification as a plain-text mail."""
+
+    def __init__(self, host, port, sender, recipients):
+        self.host, self.port = host, port
+        self.sender, self.recipients = sender, recipients
+
+    def send(self, notifications):
+        with smtplib.SMTP(self.host, self.port, timeout=SMTP_TIMEOUT) as smtp:
+            for n in notifications:
+                msg = EmailMessage()
+                msg['Subject'] = n['sujet']
+                msg['From'] = self.sender
+                msg['To'] = ', '.join(self.recipients)
+                msg.set_content(n['message'])
+                smtp.send_message(msg)
+
+
+def _give_up(conn):
+    """Date the notifications that failed MAX_ATTEMPTS times; they are no
+    longer retried."""
+    failed = conn.execute('''SELECT id, cle, erreur FROM notifications_outbox
+                             WHERE date_envoi IS NULL AND date_echec IS NULL AND tentatives >= ?''',
+                          (MAX_ATTEMPTS,)).fetchall()
+    if not failed:
+        return
+    now = datetime.now().isoformat(timespec='seconds')
+    conn.executemany('UPDATE notifications_outbox SET date_echec = ? WHERE id = ?', [(now, r['id']) for r in failed])
+    conn.commit()
+    for r in failed:
+        log.error('notification %d (%s) abandonnée après %d tentatives : %s',
+                  r['id'], r['cle'], MAX_ATTEMPTS, r['erreur'])
+
+
+def deliver(conn, sinks):
+    """Hand the pending notifications to every sink, BATCH_SIZE at a time.
+
+    Returns the number delivered; stops at the first batch a sink rejects.
+    """
+    _give_up(conn)
+    delivered = 0
+    while True:
+        batch = [dict(r) for r in conn.execute(
+            '''SELECT id, cle, sujet, message, date_creation FROM notifications_outbox
+               WHERE date_envoi IS NULL AND date_echec IS NULL ORDER BY id LIMIT ?''',
+            (BATCH_SIZE,))]
+        if not batch:
+            return delivered
+        ids = [(n['id'],) for n in batch]
+        try:
+            for sink in sinks:
+                sink.send(batch)
+        except Exception as exc:
+            log.warning('envoi impossible : %s', exc)
+            conn.executemany('UPDATE notifications_outbox SET tentatives = tentatives + 1, erreur = ? WHERE id = ?',
+                             [(str(exc), i) for (i,) in ids])
+            conn.commit()
+            _give_up(conn)
+            return delivered
+        now = datetime.now().isoformat(timespec='seconds')
+        conn.executemany('UPDATE notifications_outbox SET date_envoi = ?, tentatives = tentatives + 1 WHERE id = ?',
+                         [(now, i) for (i,) in ids])
+        conn.commit()
+        delivered += len(batch)
+
+
+def run(sinks, interval=INTERVAL, horizon_days=HORIZON_DAYS, once=False):
+    """Evaluate and deliver every ``interval`` seconds (a single cycle if once)."""
+    last = None
+    while True:
+        conn = get_connection()
+        today = date.today()
+        departed = start_departures()
+        if departed:
+            log.info('%d véhicule(s) parti(s) en sortie réservée', departed)
+        if (data_generation(conn), today) != last:
+            started = time.perf_counter()
+            queued, forgotten = evaluate(conn, today, horizon_days)
+            log.info('%d notification(s), %d échéance(s) levée(s) en %.0f ms',
+                     queued, forgotten, (time.perf_counter() - started) * 1000)
+        if sinks:
+            delivered = deliver(conn, sinks)
+            if delivered:
+                log.info('%d notification(s) envoyée(s)', delivered)
+        # Taken after this cycle's own writes, so that they do not trigger the next one
+        last = (data_generation(conn), today)
+        if once:
+            return
+        time.sleep(interval)
+
+
+def _smtp_address(value):
+    host, _, port = value.rpartition(':')
+    return (host, int(port)) if host else (value, 25)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Planificateur des alertes et notifications')
+    parser.add_argument('--once', action='store_true', help='un seul cycle puis arrêt')
+    parser.add_argument('--interval', type=int, default=INTERVAL, help='secondes entre deux cycles')
+    parser.add_argument('--horizon', type=int, default=HORIZON_DAYS, help='jours d\'anticipation des échéances')
+    parser.add_argument('--fichier', help='fichier de notifications (une ligne JSON par notification)')
+    parser.add_argument('--smtp', type=_smtp_address, help='serveur SMTP (hôte:port)')
+    parser.add_argument('--de', default='parc-auto@localhost', help='expéditeur des mails')
+    parser.add_argument('--a', nargs='+', default=[], help='destinataires des mails')
+    args = parser.parse_args(argv)
+    if args.smtp and not args.a:
+        parser.error('--smtp demande au moins un destinataire (--a)')
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    sinks = []
+    if args.fichier:
+        sinks.append(FileSink(args.fichier))
+    if args.smtp:
+        sinks.append(SmtpSink(*args.smtp, args.de, args.a))
+
+    init_db()
+    try:
+        run(sinks, args.interval, args.horizon, args.once)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""Maintenance, document and driving licence deadlines, without any Tk dependency.
+
+The deadlines come from the ``echeances`` view and are filtered, classified
+and sorted in SQL: only those already passed or due within the horizon are
+returned. Revisions due by mileage (vehicules.seuil_revision_km) are added,
+with a due date projected from each vehicle's recent km per day.
+"""
+from datetime import date, timedelta
+
+from src.cache import memoize
+from src.db import get_connection
+
+# Deadlines closer than this many days are flagged 'soon'
+SOON_DAYS = 30
+# Deadlines further away than this are not returned
+HORIZON_DAYS = 90
+
+# Maintenance types that reset the revision mileage
+REVISION_TYPES = ('Vidange', 'Révision')
+# Recent mileage per day is averaged over this many days of rollups
+PACE_DAYS = 90
+# A revision is 'soon' once less than this fraction of its interval is left
+SOON_KM_RATIO = 0.1
+
+# The range on date_echeance is applied to every branch of the view, each of
+# which has an index on its due date; date() = itself skips malformed dates
+_DUE = '''
+    SELECT categorie || ':' || source_id AS cle,
+           categorie, COALESCE(objet, '') AS objet, COALESCE(description, '') AS description,
+           date_echeance,
+           CAST(julianday(date_echeance) - julianday(:today) AS INTEGER) AS jours,
+           CASE WHEN date_echeance < :today THEN 'overdue'
+                WHEN date_echeance <= :soon THEN 'soon'
+                ELSE 'ok' END AS tag
+    FROM echeances
+    WHERE date_echeance <= :horizon AND date(date_echeance) = date_echeance
+    ORDER BY date_echeance, categorie, objet
+'''
+
+
+# One pass over the fleet: km left before the next revision, from the last
+# revision's odometer (or the initial one) plus the vehicle's interval, and
+# the day it will be reached at the pace of the last PACE_DAYS days
+_REVISIONS = '''
+    WITH last_revision AS (
+        SELECT vehicule_id, MAX(kilometrage) AS km
+        FROM maintenances
+        WHERE type_intervention IN ({types}) AND kilometrage IS NOT NULL
+        GROUP BY vehicule_id
+    ), pace AS (
+        SELECT vehicule_id, SUM(km) * 1.0 / :pace_days AS km_per_day
+        FROM rollup_vehicule_jour
+        WHERE jour > date(:today, '-' || :pace_days || ' days') AND jour <= :today
+        GROUP BY vehicule_id
+    ), due AS (
+        SELECT v.id, v.immatriculation, v.seuil_revision_km AS interval_km,
+               COALESCE(l.km, v.kilometrage_initial, 0) + v.seuil_revision_km
+                   - COALESCE(v.kilometrage_actuel, 0) AS km_left,
+               p.km_per_day
+        FROM vehicules v
+        LEFT JOIN last_revision l ON l.vehicule_id = v.id
+        LEFT JOIN pace p ON p.vehicule_id = v.id
+        WHERE v.seuil_revision_km > 0
+    ), projected AS (
+        SELECT *, CASE WHEN km_per_day > 0
+                       THEN date(:today, CAST(CAST(km_left / km_per_day AS INTEGER) AS TEXT) || ' days')
+                       WHEN km_left <= 0 THEN :today END AS due_date
+        FROM due
+    )
+    SELECT 'Révision:' || id AS cle, 'Révision' AS categorie, immatriculation AS objet,
+           km_left || ' km restants (intervalle ' || interval_km || ' km)' AS description,
+           COALESCE(due_date, '') AS date_echeance, COALESCE(CAST(julianday(due_date) - julianday(:today) AS INTEGER), '') AS jours,
+           CASE WHEN km_left <= 0 THEN 'overdue'
+                WHEN km_left <= interval_km * :soon_ratio OR due_date <= :soon THEN 'soon'
+                ELSE 'ok' END AS tag
+    FROM projected
+    WHERE km_left <= interval_km * :soon_ratio OR due_date <= :horizon
+'''.format(types=', '.join(f"'{t}'" for t in REVISION_TYPES))
+
+
+@memoize
+def deadlines(today, horizon_days=HORIZON_DAYS):
+    """Deadlines passed or due within ``horizon_days`` of ``today``, soonest
+    first: dicts with ``cle`` (stable per item, e.g. 'Document:12'),
+    ``categorie``, ``objet``, ``description``, ``date_echeance``, ``jours``
+    and ``tag`` ('overdue', 'soon' or 'ok'). Cached until the database changes.
+    """
+    params = {
+        'today': today.isoformat(),
+        'soon': (today + timedelta(days=SOON_DAYS)).isoformat(),
+        'horizon': (today + timedelta(days=horizon_days)).isoformat(),
+        'pace_days': PACE_DAYS,
+        'soon_ratio': SOON_KM_RATIO,
+    }
+    conn = get_connection()
+    rows = [dict(r) for r in conn.execute(_DUE, params)]
+    revisions = [dict(r) for r in conn.execute(_REVISIONS, params)]
+    conn.close()
+    # Both lists are sorted by date; revisions without a projected date go first
+    return sorted(rows + revisions, key=lambda row: row['date_echeance'])
+
+
+def fetch_alerts(today=None, horizon_days=HORIZON_DAYS):
+    """(values, tag) of every deadline passed or due within ``horizon_days``,
+    soonest first, for AlertsWindow. Cached until the database or the day
+    changes.
+    """
+    return [((d['categorie'], d['objet'], d['description'], d['date_echeance'], d['jours']), d['tag'])
+            for d in deadlines(today or date.today(), horizon_days)]
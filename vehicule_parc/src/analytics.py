@@ -0,0 +1,219 @@
+"""Vectorized fleet analytics over columnar NumPy copies of the history.
+
+load_history() reads the closed trips, refuels and maintenances once into
+one array per column (vehicle id, day ordinal, km, litres, cost); it is
+cached until the database changes, so repeated analyses of any period only
+pay for the array operations. Group-bys are np.bincount over vehicle ids and
+np.add.reduceat over sorted period keys.
+
+Day ordinals are ``date.toordinal()`` values; rows without a valid date are
+left out.
+"""
+from datetime import date
+
+import numpy as np
+
+from src.cache import memoize
+from src.db import get_connection, read_transaction
+
+PERCENTILES = (10, 50, 90, 95, 99)
+
+# julianday() of day ordinal 0
+_ORDINAL_EPOCH = 1721424.5
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def _day(column):
+    return f'CAST(julianday({column}) - {_ORDINAL_EPOCH} AS INTEGER)'
+
+
+_TRIPS = (f'''
+    SELECT vehicule_id, COALESCE(employe_id, -1), {_day('COALESCE(date_sortie_reelle, date_sortie_prevue)')},
+           MAX(km_retour - COALESCE(km_depart, 0), 0)
+    FROM sorties_reservations
+    WHERE km_retour IS NOT NULL AND vehicule_id IS NOT NULL
+      AND julianday(COALESCE(date_sortie_reelle, date_sortie_prevue)) IS NOT NULL
+''', [('vehicle', 'i4'), ('employee', 'i4'), ('day', 'i4'), ('km', 'f8')])
+
+_REFUELS = (f'''
+    SELECT vehicule_id, {_day('date')}, COALESCE(kilometrage, 0),
+           COALESCE(quantite_litres, 0), COALESCE(cout, 0)
+    FROM ravitaillements
+    WHERE vehicule_id IS NOT NULL AND julianday(date) IS NOT NULL
+''', [('vehicle', 'i4'), ('day', 'i4'), ('odometer', 'f8'), ('litres', 'f8'), ('cost', 'f8')])
+
+_MAINTENANCES = (f'''
+    SELECT vehicule_id, {_day('date')}, COALESCE(cout, 0)
+    FROM maintenances
+    WHERE vehicule_id IS NOT NULL AND julianday(date) IS NOT NULL
+''', [('vehicle', 'i4'), ('day', 'i4'), ('cost', 'f8')])
+
+
+def _columns(conn, sql, fields):
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    records = np.fromiter(cursor.execute(sql), dtype=np.dtype(fields))
+    return {name: np.ascontiguousarray(records[name]) for name, _ in fields}
+
+
+@memoize
+def load_history():
+    """``{'trips': {...}, 'refuels': {...}, 'maintenances': {...}}`` of column
+    arrays, and ``'registrations'``: ``{vehicule_id: immatriculation}`` read
+    from the same snapshot.
+
+    Cached until the database changes; the arrays must not be modified.
+    """
+    conn = get_connection()
+    with read_transaction(conn):
+        return {
+            'trips': _columns(conn, *_TRIPS),
+            'refuels': _columns(conn, *_REFUELS),
+            'maintenances': _columns(conn, *_MAINTENANCES),
+            'registrations': dict(conn.execute('SELECT id, immatriculation FROM vehicules')),
+        }
+
+
+def _period(table, start, end):
+    """The rows of ``table`` whose day falls between start and end (dates or None)."""
+    if not (start or end):
+        return table
+    day = table['day']
+    mask = np.ones(len(day), dtype=bool)
+    if start:
+        mask &= day >= start.toordinal()
+    if end:
+        mask &= day <= end.toordinal()
+    return {name: column[mask] for name, column in table.items()}
+
+
+def _sum_by(keys, weights, size):
+    return np.bincount(keys, weights=weights, minlength=size)
+
+
+def per_vehicle(history, start=None, end=None):
+    """Totals per vehicle id: arrays indexed by vehicule_id.
+
+    Keys: ``km``, ``trips``, ``litres``, ``fuel_cost``, ``maintenance_cost``,
+    ``l_per_100km`` and ``cost_per_km`` (NaN where no km was driven).
+    """
+    trips = _period(history['trips'], start, end)
+    refuels = _period(history['refuels'], start, end)
+    maintenances = _period(history['maintenances'], start, end)
+    size = 1 + max((int(t['vehicle'].max()) for t in (trips, refuels, maintenances) if len(t['vehicle'])),
+                   default=0)
+
+    km = _sum_by(trips['vehicle'], trips['km'], size)
+    litres = _sum_by(refuels['vehicle'], refuels['litres'], size)
+    fuel_cost = _sum_by(refuels['vehicle'], refuels['cost'], size)
+    maintenance_cost = _sum_by(maintenances['vehicle'], maintenances['cost'], size)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        driven = np.where(km > 0, km, np.nan)
+        return {
+            'km': km,
+            'trips': np.bincount(trips['vehicle'], minlength=size),
+            'litres': litres,
+            'fuel_cost': fuel_cost,
+            'maintenance_cost': maintenance_cost,
+            'l_per_100km': litres * 100 / driven,
+            'cost_per_km': (fuel_cost + maintenance_cost) / driven,
+        }
+
+
+def _period_keys(days, period):
+    dates = (days - _EPOCH_ORDINAL).astype('datetime64[D]')
+    if period == 'day':
+        return dates.astype('datetime64[D]')
+    if period == 'week':
+        # Weeks starting on Monday; 1970-01-01 was a Thursday
+        return (dates - ((days - _EPOCH_ORDINAL + 3) % 7)).astype('datetime64[D]')
+    if period == 'month':
+        return dates.astype('datetime64[M]')
+    if period == 'year':
+        return dates.astype('datetime64[Y]')
+    raise ValueError(f'période inconnue : {period}')
+
+
+def _reduce(days, values, period):
+    """(sorted period keys, sums of each ``values`` array per key)."""
+    keys = _period_keys(days, period)
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    if not len(keys):
+        return keys, [np.zeros(0) for _ in values]
+    starts = np.concatenate(([0], np.flatnonzero(keys[1:] != keys[:-1]) + 1))
+    return keys[starts], [np.add.reduceat(v[order], starts) for v in values]
+
+
+def per_period(history, period='month', start=None, end=None):
+    """Fleet totals per day, week, month or year, in chronological order.
+
+    Returns a list of dicts with ``period`` (the first day, as a date),
+    ``km``, ``trips``, ``litres``, ``fuel_cost`` and ``maintenance_cost``.
+    """
+    trips = _period(history['trips'], start, end)
+    refuels = _period(history['refuels'], start, end)
+    maintenances = _period(history['maintenances'], start, end)
+
+    sums = {}
+    for table, measures in ((trips, {'km': trips['km'], 'trips': np.ones(len(trips['day']))}),
+                            (refuels, {'litres': refuels['litres'], 'fuel_cost': refuels['cost']}),
+                            (maintenances, {'maintenance_cost': maintenances['cost']})):
+        keys, totals = _reduce(table['day'], list(measures.values()), period)
+        for name, total in zip(measures, totals):
+            sums[name] = dict(zip(keys.astype('datetime64[D]').tolist(), total.tolist()))
+
+    periods = sorted(set().union(*(s.keys() for s in sums.values())))
+    names = ('km', 'trips', 'litres', 'fuel_cost', 'maintenance_cost')
+    return [dict(period=p, **{name: sums[name].get(p, 0.0) for name in names}) for p in periods]
+
+
+def fill_consumption(history, start=None, end=None):
+    """L/100km of each refuel, from the distance since the previous one of the
+    same vehicle (ordered by odometer); ``(vehicle ids, values)`` arrays."""
+    refuels = _period(history['refuels'], start, end)
+    order = np.lexsort((refuels['odometer'], refuels['vehicle']))
+    vehicle = refuels['vehicle'][order]
+    odometer = refuels['odometer'][order]
+    litres = refuels['litres'][order]
+    distance = np.diff(odometer)
+    valid = (vehicle[1:] == vehicle[:-1]) & (distance > 0)
+    return vehicle[1:][valid], litres[1:][valid] * 100 / distance[valid]
+
+
+def percentiles(values, qs=PERCENTILES):
+    """``{q: value}`` over the finite values (NaN when there are none)."""
+    values = np.asarray(values, dtype=float)
+    values = values[np.isfinite(values)]
+    if not len(values):
+        return {q: float('nan') for q in qs}
+    return dict(zip(qs, np.percentile(values, qs).tolist()))
+
+
+@memoize
+def fleet_summary(start=None, end=None):
+    """Per-vehicle indicators and their distribution across the fleet, for
+    StatisticsWindow; cached like load_history()."""
+    history = load_history()
+    totals = per_vehicle(history, start, end)
+    names = history['registrations']
+    vehicles = []
+    for vid in np.flatnonzero(totals['trips'] + totals['litres'] + totals['maintenance_cost']):
+        vehicles.append({
+            'imm': names.get(int(vid), str(vid)),
+            'km': float(totals['km'][vid]),
+            'l_per_100km': _finite(totals['l_per_100km'][vid]),
+            'cost_per_km': _finite(totals['cost_per_km'][vid]),
+        })
+    _, fills = fill_consumption(history, start, end)
+    return {
+        'vehicles': vehicles,
+        'l_per_100km': percentiles(totals['l_per_100km']),
+        'cost_per_km': percentiles(totals['cost_per_km']),
+        'fill_l_per_100km': percentiles(fills),
+    }
+
+
+def _finite(value):
+    value = float(value)
+    return value if np.isfinite(value) else None
@@ -0,0 +1,335 @@
+"""Batch detection of suspicious refuels, stored in ``anomalies_carburant``.
+
+Each refuel is checked for:
+
+- an abnormal consumption: the L/100km since the previous fill of the vehicle
+  (odometer order) compared with the median and MAD of the vehicle's last
+  WINDOW fills, or of all fills of the same model while the vehicle has fewer
+  than MIN_HISTORY; flagged when the robust z-score exceeds Z_THRESHOLD;
+- an odometer lower than at the previous fill (date order), or a distance
+  since it that cannot be driven in the elapsed days;
+- more litres than the tank holds (vehicules.capacite_reservoir);
+- a fill on a day the vehicle was in maintenance, or on a day it was neither
+  on a trip nor permanently assigned.
+
+Only refuels added since the last run are checked, each from its vehicle's
+last fills: the highest refuel id seen is kept in ``jobs_checkpoints``.
+``--reset`` checks the whole history again, e.g. after correcting old rows.
+A run over the whole history (the first one, or ``--reset``) also stores
+the baseline of every model in ``consommation_modeles``; later runs and
+check_refuel(), run when a refuel is saved, read it from there.
+
+    python -m src.anomalies
+    python -m src.anomalies --reset
+"""
+import argparse
+import os
+import sys
+from collections import defaultdict
+from datetime import datetime
+from statistics import median
+
+# Allow running as a script, like main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.dates import to_date
+from src.db import get_connection, init_db
+
+JOB = 'anomalies_carburant'
+
+WINDOW = 10
+MIN_HISTORY = 5
+Z_THRESHOLD = 3.5
+# The MAD of a very regular vehicle is close to 0; never divide by less than
+# this fraction of the median
+MAD_FLOOR = 0.05
+MAX_KM_PER_DAY = 1500
+TANK_TOLERANCE = 1.05
+
+ANOMALY_LABELS = {
+    'consommation_anormale': 'Consommation anormale',
+    'kilometrage_regressif': 'Kilométrage inférieur au plein précédent',
+    'delta_km_impossible': 'Distance impossible depuis le plein précédent',
+    'plein_superieur_reservoir': 'Plein supérieur au réservoir',
+    'pendant_maintenance': 'Plein pendant une maintenance',
+    'hors_sortie': 'Plein hors sortie et hors affectation',
+}
+
+_INSERT = '''
+    INSERT OR IGNORE INTO anomalies_carburant
+        (ravitaillement_id, vehicule_id, type, valeur, reference, details, date_detection)
+    VALUES (?,?,?,?,?,?,?)
+'''
+
+# Refuels with what the checks need of their vehicle
+_FILL = '''
+    SELECT r.id, r.vehicule_id, r.date, r.kilometrage, r.quantite_litres,
+           v.capacite_reservoir, COALESCE(v.marque, '') || ' ' || COALESCE(v.modele, '') AS model
+    FROM ravitaillements r
+    JOIN vehicules v ON v.id = r.vehicule_id
+'''
+
+_ALL_FILLS = _FILL + 'ORDER BY r.vehicule_id, r.kilometrage, r.id'
+
+_IN_MAINTENANCE = '''
+    SELECT r.id, r.vehicule_id, m.type_intervention
+    FROM ravitaillements r
+    JOIN maintenances m ON m.vehicule_id = r.vehicule_id AND m.date = date(r.date)
+    WHERE r.id BETWEEN ? AND ?
+    GROUP BY r.id
+'''
+
+# The trip under way is the one of the vehicle that started last, on or before the day
+_OUTSIDE_TRIPS = '''
+    SELECT r.id, r.vehicule_id
+    FROM ravitaillements r
+    WHERE r.id BETWEEN ? AND ? AND r.vehicule_id IS NOT NULL AND date(r.date) IS NOT NULL
+      AND COALESCE((
+          SELECT COALESCE(s.date_retour_reelle, s.date_retour_prevue, '9999-12-31')
+          FROM sorties_reservations s
+          WHERE s.vehicule_id = r.vehicule_id
+            AND COALESCE(s.date_sortie_reelle, s.date_sortie_prevue) <= date(r.date)
+          ORDER BY COALESCE(s.date_sortie_reelle, s.date_sortie_prevue) DESC
+          LIMIT 1), '') < date(r.date)
+      AND NOT EXISTS (
+          SELECT 1 FROM affectations_permanentes a
+          WHERE a.vehicule_id = r.vehicule_id
+            AND COALESCE(a.date_debut, '') <= date(r.date)
+            AND COALESCE(a.date_fin, '9999-12-31') >= date(r.date))
+'''
+
+
+def _baseline(values):
+    """(median, MAD) of values, the MAD floored at MAD_FLOOR * median."""
+    mid = median(values)
+    mad = median(abs(v - mid) for v in values)
+    return mid, max(mad, MAD_FLOOR * mid)
+
+
+def _robust_z(value, mid, mad):
+    # 0.6745 makes the MAD comparable to a standard deviation
+    return 0.6745 * (value - mid) / mad if mad else 0.0
+
+
+def _consumptions(fills):
+    """[(fill, L/100km)] of one vehicle's fills sorted by odometer."""
+    result = []
+    for previous, fill in zip(fills, fills[1:]):
+        if fill['kilometrage'] is None or previous['kilometrage'] is None:
+            continue
+        distance = fill['kilometrage'] - previous['kilometrage']
+        if distance > 0 and (fill['quantite_litres'] or 0) > 0:
+            result.append((fill, fill['quantite_litres'] * 100 / distance))
+    return result
+
+
+def _model_baselines(by_vehicle):
+    """``{model: (median, MAD, fills)}`` of the models with MIN_HISTORY consumptions."""
+    by_model = defaultdict(list)
+    for fills in by_vehicle.values():
+        by_model[fills[0]['model']].extend(c for _, c in _consumptions(fills))
+    return {model: _baseline(values) + (len(values),)
+            for model, values in by_model.items() if len(values) >= MIN_HISTORY}
+
+
+def _consumption_anomalies(by_vehicle, is_new, models):
+    for vid, fills in by_vehicle.items():
+        consumptions = _consumptions(fills)
+        model = fills[0]['model']
+        for i, (fill, value) in enumerate(consumptions):
+            if not is_new(fill['id']):
+                continue
+            history = [c for _, c in consumptions[max(0, i - WINDOW):i]]
+            if len(history) >= MIN_HISTORY:
+                (mid, mad), source = _baseline(history), 'véhicule'
+            elif model in models:
+                (mid, mad, _), source = models[model], 'modèle'
+            else:
+                continue
+            if abs(_robust_z(value, mid, mad)) > Z_THRESHOLD:
+                yield (fill['id'], vid, 'consommation_anormale', round(value, 2), round(mid, 2),
+                       f'{value:.1f} L/100 km, médiane {mid:.1f} ({source})')
+
+
+def _sequence_anomalies(fills, is_new):
+    """Odometer going back or jumping too far between fills in date order."""
+    dated = sorted((f for f in fills if to_date(f['date']) and f['kilometrage'] is not None),
+                   key=lambda f: (to_date(f['date']), f['id']))
+    for previous, fill in zip(dated, dated[1:]):
+        if not is_new(fill['id']):
+            continue
+        distance = fill['kilometrage'] - previous['kilometrage']
+        if distance < 0:
+            yield (fill['id'], fill['vehicule_id'], 'kilometrage_regressif', fill['kilometrage'],
+                   previous['kilometrage'], f"{fill['kilometrage']} km après {previous['kilometrage']} km")
+            continue
+        days = max((to_date(fill['date']) - to_date(previous['date'])).days, 1)
+        if distance > MAX_KM_PER_DAY * days:
+            yield (fill['id'], fill['vehicule_id'], 'delta_km_impossible', distance, MAX_KM_PER_DAY * days,
+                   f'{distance} km en {days} jour(s)')
+
+
+def _tank_anomalies(fills, is_new):
+    for fill in fills:
+        capacity, litres = fill['capacite_reservoir'], fill['quantite_litres'] or 0
+        if is_new(fill['id']) and capacity and litres > capacity * TANK_TOLERANCE:
+            yield (fill['id'], fill['vehicule_id'], 'plein_superieur_reservoir', litres, capacity,
+                   f'{litres:.1f} L pour un réservoir de {capacity:.0f} L')
+
+
+def _all_fills(conn):
+    by_vehicle = defaultdict(list)
+    for fill in conn.execute(_ALL_FILLS):
+        by_vehicle[fill['vehicule_id']].append(fill)
+    return by_vehicle
+
+
+def _stored_baselines(conn):
+    return {model: (mid, mad, count) for model, mid, mad, count in
+            conn.execute('SELECT modele, mediane, mad, nb_pleins FROM consommation_modeles')}
+
+
+def _detect(conn, first_id, last_id):
+    """Anomaly rows of the refuels with ids from first_id to last_id, and the
+    model baselines to store (none unless the whole history was read)."""
+    if first_id > 1:
+        # Each new refuel is checked as check_refuel() does, from its vehicle's last fills
+        baselines = _stored_baselines(conn)
+        found = []
+        for fill in conn.execute(_FILL + 'WHERE r.id BETWEEN ? AND ?', (first_id, last_id)).fetchall():
+            found += _fill_anomalies(conn, fill, baselines)
+        found += _calendar_anomalies(conn, first_id, last_id)
+        return found, {}
+
+    def is_new(refuel_id):
+        return first_id <= refuel_id <= last_id
+
+    by_vehicle = defaultdict(list)
+    for fill in conn.execute(_ALL_FILLS):
+        by_vehicle[fill['vehicule_id']].append(fill)
+    models = _model_baselines(by_vehicle)
+    found = list(_consumption_anomalies(by_vehicle, is_new, models))
+    for fills in by_vehicle.values():
+        found += _sequence_anomalies(fills, is_new)
+        found += _tank_anomalies(fills, is_new)
+    found += _calendar_anomalies(conn, first_id, last_id)
+    return found, models
+
+
+def _calendar_anomalies(conn, first_id, last_id):
+    for refuel_id, vid, intervention in conn.execute(_IN_MAINTENANCE, (first_id, last_id)):
+        yield (refuel_id, vid, 'pendant_maintenance', None, None, intervention or '')
+    for refuel_id, vid in conn.execute(_OUTSIDE_TRIPS, (first_id, last_id)):
+        yield (refuel_id, vid, 'hors_sortie', None, None, '')
+
+
+def _store(conn, found):
+    now = datetime.now().isoformat(timespec='seconds')
+    conn.executemany(_INSERT, [row + (now,) for row in found])
+
+
+def _store_baselines(conn, models):
+    now = datetime.now().isoformat(timespec='seconds')
+    conn.executemany('''
+        INSERT INTO consommation_modeles (modele, mediane, mad, nb_pleins, date_maj) VALUES (?,?,?,?,?)
+        ON CONFLICT (modele) DO UPDATE SET mediane = excluded.mediane, mad = excluded.mad,
+                                           nb_pleins = excluded.nb_pleins, date_maj = excluded.date_maj
+    ''', [(model, mid, mad, count, now) for model, (mid, mad, count) in models.items()])
+
+
+def _fill_anomalies(conn, fill, models):
+    """Consumption, odometer and tank anomaly rows of one fill, read from its
+    vehicle's last WINDOW + 2 fills by odometer and its previous fill by date."""
+    vid, km, refuel_id = fill['vehicule_id'], fill['kilometrage'], fill['id']
+    if vid is None:
+        return []
+
+    def is_new(fill_id):
+        return fill_id == refuel_id
+
+    found = []
+    if km is not None:
+        # Fills up to this one in odometer order, as the batch orders them
+        recent = conn.execute(_FILL + '''
+            WHERE r.vehicule_id = ? AND (r.kilometrage < ? OR (r.kilometrage = ? AND r.id <= ?))
+            ORDER BY r.kilometrage DESC, r.id DESC LIMIT ?''', (vid, km, km, refuel_id, WINDOW + 2)).fetchall()
+        found += _consumption_anomalies({vid: recent[::-1]}, is_new, models)
+    if fill['date']:
+        previous = conn.execute(_FILL + '''
+            WHERE r.vehicule_id = ? AND r.kilometrage IS NOT NULL AND (r.date < ? OR (r.date = ? AND r.id < ?))
+            ORDER BY r.date DESC, r.id DESC LIMIT 1''', (vid, fill['date'], fill['date'], refuel_id)).fetchall()
+        found += _sequence_anomalies(previous + [fill], is_new)
+    found += _tank_anomalies([fill], is_new)
+    return found
+
+
+def check_refuel(conn, refuel_id):
+    """Check one refuel just inserted, in the caller's transaction.
+
+    Reads the vehicle's last fills and the stored baseline of its model,
+    never a whole history. Returns ``[(type, details)]`` of the anomalies
+    found.
+    """
+    fill = conn.execute(_FILL + 'WHERE r.id = ?', (refuel_id,)).fetchone()
+    if fill is None or fill['vehicule_id'] is None:
+        return []
+    row = conn.execute('SELECT mediane, mad, nb_pleins FROM consommation_modeles WHERE modele = ?',
+                       (fill['model'],)).fetchone()
+    found = _fill_anomalies(conn, fill, {fill['model']: tuple(row)} if row else {})
+    found += _calendar_anomalies(conn, refuel_id, refuel_id)
+    _store(conn, found)
+    return [(row[2], row[5]) for row in found]
+
+
+def run(reset=False):
+    """Check the refuels added since the last run (all of them if reset).
+
+    Returns ``(refuels checked, anomalies found)``.
+    """
+    conn = get_connection()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        if reset:
+            conn.execute('DELETE FROM anomalies_carburant')
+            since = 0
+        else:
+            row = conn.execute('SELECT dernier_id FROM jobs_checkpoints WHERE job = ?', (JOB,)).fetchone()
+            since = row[0] if row else 0
+        last = conn.execute('SELECT COALESCE(MAX(id), 0) FROM ravitaillements').fetchone()[0]
+        found, models = _detect(conn, since + 1, last) if last > since else ([], {})
+        _store(conn, found)
+        if since == 0:
+            conn.execute('DELETE FROM consommation_modeles')
+            _store_baselines(conn, models)
+        conn.execute('''INSERT INTO jobs_checkpoints (job, dernier_id, date_maj) VALUES (?,?,?)
+                        ON CONFLICT (job) DO UPDATE SET dernier_id = excluded.dernier_id,
+                                                        date_maj = excluded.date_maj''',
+                     (JOB, last, datetime.now().isoformat(timespec='seconds')))
+        checked = conn.execute('SELECT COUNT(*) FROM ravitaillements WHERE id BETWEEN ? AND ?',
+                               (since + 1, last)).fetchone()[0]
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return checked, len(found)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Détection des ravitaillements suspects')
+    parser.add_argument('--reset', action='store_true', help='réanalyser tout l\'historique')
+    args = parser.parse_args(argv)
+
+    init_db()
+    checked, found = run(args.reset)
+    print(f'{checked} ravitaillements analysés, {found} anomalies')
+    conn = get_connection()
+    for kind, count in conn.execute('SELECT type, COUNT(*) FROM anomalies_carburant GROUP BY type ORDER BY type'):
+        print(f'  {ANOMALY_LABELS.get(kind, kind)} : {count}')
+    conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
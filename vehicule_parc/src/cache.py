@@ -0,0 +1,76 @@
+"""In-memory cache of report and alert results.
+
+Entries are keyed on the function, its arguments and db.data_generation(),
+which changes on every commit made through get_connection() and whenever
+another connection or process changes the database: a result is reused only
+as long as the data it was computed from is unchanged, and stale entries
+simply age out of the LRU.
+
+Cached results are shared between callers, which must not modify them.
+"""
+import functools
+import threading
+from collections import OrderedDict
+
+from src.db import data_generation
+
+MAX_ENTRIES = 64
+
+_lock = threading.Lock()
+_entries = OrderedDict()
+_hits = 0
+_misses = 0
+
+
+def _get(key):
+    global _hits, _misses
+    with _lock:
+        try:
+            value = _entries[key]
+        except KeyError:
+            _misses += 1
+            raise
+        _entries.move_to_end(key)
+        _hits += 1
+        return value
+
+
+def _put(key, value):
+    with _lock:
+        _entries[key] = value
+        _entries.move_to_end(key)
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+
+
+def memoize(fn):
+    """Cache ``fn``'s results; its arguments must be hashable."""
+    name = f'{fn.__module__}.{fn.__qualname__}'
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        # Read the generation first: a commit made while fn runs then leaves
+        # the result filed under an older generation, never a newer one.
+        key = (name, args, tuple(sorted(kwargs.items())), data_generation())
+        try:
+            return _get(key)
+        except KeyError:
+            pass
+        value = fn(*args, **kwargs)
+        _put(key, value)
+        return value
+
+    wrapper.uncached = fn
+    return wrapper
+
+
+def clear():
+    global _hits, _misses
+    with _lock:
+        _entries.clear()
+        _hits = _misses = 0
+
+
+def stats():
+    with _lock:
+        return {'entries': len(_entries), 'hits': _hits, 'misses': _misses}
@@ -0,0 +1,91 @@
+"""Parsing and validation of the dates and times written to the database.
+
+Dates are stored as ``YYYY-MM-DD`` and times as ``HH:MM``, so that they sort
+and compare as text and range filters can use an index; the database rejects
+anything else (see migration 10 in db.py). Every write path goes through
+parse_date() / parse_time(), which also accept the usual French input shapes
+(``31/01/2026``, ``9h30``...) and return the stored form.
+"""
+from datetime import date, datetime
+
+DATE_FORMAT = '%Y-%m-%d'
+TIME_FORMAT = '%H:%M'
+DATETIME_FORMAT = f'{DATE_FORMAT} {TIME_FORMAT}'
+
+# Accepted input shapes, the stored one first
+_DATE_INPUTS = ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%d.%m.%Y', '%Y/%m/%d', '%d/%m/%y')
+_TIME_INPUTS = ('%H:%M', '%H:%M:%S', '%Hh%M', '%Hh', '%H')
+# Only when normalizing old rows: a bare year or month means its first day
+_PARTIAL_DATE_INPUTS = ('%Y', '%m/%Y', '%Y-%m')
+
+
+def _blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def parse_date(value, field='date', required=False, partial=False):
+    """``YYYY-MM-DD`` text of ``value`` (a string, date or datetime), or None
+    if it is empty; ValueError if it cannot be read or is required and empty.
+
+    A datetime string keeps its date part. ``partial`` also accepts a bare
+    year or month, read as its first day.
+    """
+    if _blank(value):
+        if required:
+            raise ValueError(f'{field} obligatoire')
+        return None
+    if isinstance(value, datetime):
+        return value.strftime(DATE_FORMAT)
+    if isinstance(value, date):
+        return value.isoformat()
+    text = str(value).strip()
+    # '2026-01-31 10:00:00' or '2026-01-31T10:00'
+    if len(text) > 10 and text[10] in ' T':
+        text = text[:10]
+    for fmt in _DATE_INPUTS + (_PARTIAL_DATE_INPUTS if partial else ()):
+        try:
+            return datetime.strptime(text, fmt).strftime(DATE_FORMAT)
+        except ValueError:
+            pass
+    raise ValueError(f'{field} invalide (AAAA-MM-JJ attendu) : {value!r}')
+
+
+def parse_time(value, field='heure', required=False):
+    """``HH:MM`` text of ``value``, or None if it is empty; seconds are dropped."""
+    if _blank(value):
+        if required:
+            raise ValueError(f'{field} obligatoire')
+        return None
+    if isinstance(value, datetime):
+        return value.strftime(TIME_FORMAT)
+    text = str(value).strip().lower()
+    for fmt in _TIME_INPUTS:
+        try:
+            return datetime.strptime(text, fmt).strftime(TIME_FORMAT)
+        except ValueError:
+            pass
+    raise ValueError(f'{field} invalide (HH:MM attendu) : {value!r}')
+
+
+def to_date(value):
+    """date object of a stored ``YYYY-MM-DD`` value, or None."""
+    try:
+        return datetime.strptime(value, DATE_FORMAT).date()
+    except (TypeError, ValueError):
+        return None
+
+
+def to_datetime(day, time=None):
+    """datetime of a stored date and optional time, or None."""
+    try:
+        return datetime.strptime(f"{day} {time or '00:00'}", DATETIME_FORMAT)
+    except (TypeError, ValueError):
+        return None
+
+
+def today():
+    return date.today().strftime(DATE_FORMAT)
+
+
+def now_time():
+    return datetime.now().strftime(TIME_FORMAT)
@@ -1,141 +1,738 @@
+import json
 import sqlite3
 import os
+import threading
+from contextlib import contextmanager
 
 DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'vehicule_parc.db')
 
-def get_connection():
-    conn = sqlite3.connect(DB_PATH)
+# Connection tuning, applied to every connection handed out by get_connection()
+BUSY_TIMEOUT_MS = 5000
+CACHE_SIZE_KB = 16384
+
+_local = threading.local()
+
+# Bumped whenever this process commits a change or notices one committed by
+# another connection; see data_generation()
+_generation = 0
+_generation_lock = threading.Lock()
+
+
+def _bump_generation():
+    global _generation
+    with _generation_lock:
+        _generation += 1
+
+
+class PooledConnection(sqlite3.Connection):
+    """Connection shared by every get_connection() call of one thread.
+
+    Callers keep their usual ``conn.close()``: it only rolls back what was left
+    uncommitted, as a real close would, and keeps the handle open for the next
+    caller. ``close_connection()`` really closes it.
+    """
+
+    _changes_seen = 0
+    _data_version = None
+
+    def commit(self):
+        super().commit()
+        if self.total_changes != self._changes_seen:
+            self._changes_seen = self.total_changes
+            _bump_generation()
+
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+
+    def _really_close(self):
+        super().close()
+
+
+def _configure(conn):
     conn.row_factory = sqlite3.Row
+    conn.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute('PRAGMA foreign_keys = ON')
+    conn.execute(f'PRAGMA cache_size = -{CACHE_SIZE_KB}')
+    conn.execute('PRAGMA temp_store = MEMORY')
+
+
+def _connection_factory():
+    # Tracing (see sqltrace.py) is opt-in; when off, nothing of it is loaded
+    if os.environ.get('PARC_SQL_TRACE'):
+        from .sqltrace import TracedConnection
+        return TracedConnection
+    return PooledConnection
+
+
+def get_connection():
+    """Return this thread's connection to DB_PATH, opening it on first use."""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.path == DB_PATH:
+        return conn
+    close_connection()
+    conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT_MS / 1000, factory=_connection_factory())
+    _configure(conn)
+    _local.conn = conn
+    _local.path = DB_PATH
     return conn
 
+
+@contextmanager
+def read_transaction(conn=None):
+    """Run several reads against one consistent snapshot of the database.
+
+    In WAL mode the snapshot is taken at the first read and commits made by
+    other connections meanwhile stay invisible until the block ends.
+    """
+    conn = conn or get_connection()
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute('BEGIN')
+    try:
+        yield conn
+    finally:
+        conn.rollback()
+
+
+def data_generation(conn=None):
+    """Counter that changes whenever the database content may have changed.
+
+    Commits through a PooledConnection bump it directly; commits by other
+    connections or processes are noticed through ``PRAGMA data_version`` of
+    ``conn`` (this thread's connection by default). Values are comparable
+    across threads of the process.
+    """
+    conn = conn or get_connection()
+    version = conn.execute('PRAGMA data_version').fetchone()[0]
+    if version != conn._data_version:
+        # Also on a connection's first call: it cannot tell what happened before
+        conn._data_version = version
+        _bump_generation()
+    return _generation
+
+
+def close_connection():
+    """Close this thread's pooled connection, if any."""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        _local.conn = None
+        conn._really_close()
+
+
+# ==========================================================
+# SCHEMA & MIGRATIONS
+# ==========================================================
+_SCHEMA_V1 = '''
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT UNIQUE NOT NULL,
+    password_hash TEXT NOT NULL,
+    role TEXT NOT NULL,
+    nom TEXT,
+    prenom TEXT,
+    email TEXT,
+    actif INTEGER DEFAULT 1
+);
+
+CREATE TABLE IF NOT EXISTS employes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    matricule TEXT UNIQUE NOT NULL,
+    nom TEXT NOT NULL,
+    prenom TEXT NOT NULL,
+    service TEXT,
+    telephone TEXT,
+    email TEXT,
+    num_permis TEXT,
+    date_validite_permis TEXT,
+    autorise_conduire INTEGER DEFAULT 0,
+    photo_path TEXT
+);
+
+CREATE TABLE IF NOT EXISTS vehicules (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    immatriculation TEXT UNIQUE NOT NULL,
+    marque TEXT,
+    modele TEXT,
+    type_vehicule TEXT,
+    annee INTEGER,
+    date_acquisition TEXT,
+    kilometrage_initial INTEGER DEFAULT 0,
+    kilometrage_actuel INTEGER DEFAULT 0,
+    carburant TEXT,
+    puissance_fiscale TEXT,
+    numero_chassis TEXT,
+    photo_path TEXT,
+    type_affectation TEXT,
+    statut TEXT,
+    service_principal TEXT,
+    seuil_revision_km INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS affectations_permanentes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    vehicule_id INTEGER,
+    employe_id INTEGER,
+    date_debut TEXT,
+    date_fin TEXT,
+    FOREIGN KEY (vehicule_id) REFERENCES vehicules(id),
+    FOREIGN KEY (employe_id) REFERENCES employes(id)
+);
+
+CREATE TABLE IF NOT EXISTS sorties_reservations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    vehicule_id INTEGER,
+    employe_id INTEGER,
+    date_sortie_prevue TEXT,
+    heure_sortie_prevue TEXT,
+    date_retour_prevue TEXT,
+    heure_retour_prevue TEXT,
+    date_sortie_reelle TEXT,
+    heure_sortie_reelle TEXT,
+    km_depart INTEGER,
+    date_retour_reelle TEXT,
+    heure_retour_reelle TEXT,
+    km_retour INTEGER,
+    motif TEXT,
+    destination TEXT,
+    etat_retour TEXT,
+    niveau_carburant_retour TEXT,
+    statut TEXT,
+    FOREIGN KEY (vehicule_id) REFERENCES vehicules(id),
+    FOREIGN KEY (employe_id) REFERENCES employes(id)
+);
+
+CREATE TABLE IF NOT EXISTS maintenances (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    vehicule_id INTEGER,
+    date TEXT,
+    type_intervention TEXT,
+    kilometrage INTEGER,
+    cout REAL,
+    prestataire TEXT,
+    remarques TEXT,
+    date_prochaine_echeance TEXT,
+    FOREIGN KEY (vehicule_id) REFERENCES vehicules(id)
+);
+
+CREATE TABLE IF NOT EXISTS ravitaillements (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    vehicule_id INTEGER,
+    employe_id INTEGER,
+    date TEXT,
+    quantite_litres REAL,
+    cout REAL,
+    station TEXT,
+    kilometrage INTEGER,
+    FOREIGN KEY (vehicule_id) REFERENCES vehicules(id),
+    FOREIGN KEY (employe_id) REFERENCES employes(id)
+);
+
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    vehicule_id INTEGER,
+    type_document TEXT,
+    date_emission TEXT,
+    date_echeance TEXT,
+    chemin_fichier TEXT,
+    description TEXT,
+    FOREIGN KEY (vehicule_id) REFERENCES vehicules(id)
+);
+
+CREATE TABLE IF NOT EXISTS logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    action TEXT,
+    date_action TEXT,
+    details TEXT
+);
+'''
+
+_INDEXES_V2 = '''
+CREATE INDEX IF NOT EXISTS idx_vehicules_statut ON vehicules(statut);
+
+CREATE INDEX IF NOT EXISTS idx_affectations_vehicule ON affectations_permanentes(vehicule_id);
+CREATE INDEX IF NOT EXISTS idx_affectations_employe ON affectations_permanentes(employe_id);
+
+CREATE INDEX IF NOT EXISTS idx_sorties_vehicule ON sorties_reservations(vehicule_id, km_depart, km_retour);
+CREATE INDEX IF NOT EXISTS idx_sorties_employe ON sorties_reservations(employe_id, km_depart, km_retour);
+CREATE INDEX IF NOT EXISTS idx_sorties_statut_date ON sorties_reservations(statut, date_sortie_prevue);
+
+CREATE INDEX IF NOT EXISTS idx_maintenances_vehicule ON maintenances(vehicule_id, cout);
+CREATE INDEX IF NOT EXISTS idx_maintenances_echeance ON maintenances(date_prochaine_echeance);
+
+CREATE INDEX IF NOT EXISTS idx_ravitaillements_vehicule ON ravitaillements(vehicule_id, quantite_litres, cout);
+CREATE INDEX IF NOT EXISTS idx_ravitaillements_employe ON ravitaillements(employe_id);
+
+CREATE INDEX IF NOT EXISTS idx_documents_vehicule ON documents(vehicule_id);
+CREATE INDEX IF NOT EXISTS idx_documents_echeance ON documents(date_echeance);
+'''
+
+
+def _create_search_index(conn, table, fts_table, columns):
+    cols = ', '.join(columns)
+    new_cols = ', '.join(f'new.{col}' for col in columns)
+    old_cols = ', '.join(f'old.{col}' for col in columns)
+    conn.execute(f"""CREATE VIRTUAL TABLE {fts_table} USING fts5(
+        {cols}, content='{table}', content_rowid='id', tokenize='trigram')""")
+    conn.execute(f"""CREATE TRIGGER {fts_table}_ai AFTER INSERT ON {table} BEGIN
+        INSERT INTO {fts_table}(rowid, {cols}) VALUES (new.id, {new_cols});
+    END""")
+    conn.execute(f"""CREATE TRIGGER {fts_table}_ad AFTER DELETE ON {table} BEGIN
+        INSERT INTO {fts_table}({fts_table}, rowid, {cols}) VALUES ('delete', old.id, {old_cols});
+    END""")
+    conn.execute(f"""CREATE TRIGGER {fts_table}_au AFTER UPDATE OF {cols} ON {table} BEGIN
+        INSERT INTO {fts_table}({fts_table}, rowid, {cols}) VALUES ('delete', old.id, {old_cols});
+        INSERT INTO {fts_table}(rowid, {cols}) VALUES (new.id, {new_cols});
+    END""")
+    conn.execute(f"INSERT INTO {fts_table}({fts_table}) VALUES ('rebuild')")
+
+
+def _search_indexes_v3(conn):
+    # FTS5 and its trigram tokenizer are optional SQLite features: without
+    # them the searches in models.py keep using LIKE.
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp._fts_probe USING fts5(x, tokenize='trigram')")
+    except sqlite3.OperationalError:
+        return
+    conn.execute('DROP TABLE temp._fts_probe')
+    _create_search_index(conn, 'vehicules', 'vehicules_fts',
+                         ('immatriculation', 'marque', 'modele', 'service_principal'))
+    _create_search_index(conn, 'employes', 'employes_fts',
+                         ('matricule', 'nom', 'prenom', 'service'))
+
+
+_SORT_INDEXES_V4 = '''
+CREATE INDEX IF NOT EXISTS idx_vehicules_tri_marque ON vehicules(COALESCE(marque, ''));
+CREATE INDEX IF NOT EXISTS idx_vehicules_tri_modele ON vehicules(COALESCE(modele, ''));
+CREATE INDEX IF NOT EXISTS idx_vehicules_tri_type ON vehicules(COALESCE(type_vehicule, ''));
+CREATE INDEX IF NOT EXISTS idx_vehicules_tri_annee ON vehicules(COALESCE(annee, ''));
+CREATE INDEX IF NOT EXISTS idx_vehicules_tri_statut ON vehicules(COALESCE(statut, ''));
+CREATE INDEX IF NOT EXISTS idx_vehicules_tri_service ON vehicules(COALESCE(service_principal, ''));
+
+CREATE INDEX IF NOT EXISTS idx_employes_nom ON employes(nom);
+CREATE INDEX IF NOT EXISTS idx_employes_prenom ON employes(prenom);
+CREATE INDEX IF NOT EXISTS idx_employes_tri_service ON employes(COALESCE(service, ''));
+'''
+
+_STATUS_COUNTS_V5 = '''
+CREATE TABLE IF NOT EXISTS vehicle_status_counts (
+    statut TEXT NOT NULL,
+    service TEXT NOT NULL,
+    nb INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (statut, service)
+) WITHOUT ROWID;
+
+DELETE FROM vehicle_status_counts;
+INSERT INTO vehicle_status_counts (statut, service, nb)
+SELECT COALESCE(statut, ''), COALESCE(service_principal, ''), COUNT(*)
+FROM vehicules GROUP BY 1, 2;
+
+CREATE TRIGGER IF NOT EXISTS vehicle_status_counts_ai AFTER INSERT ON vehicules BEGIN
+    INSERT INTO vehicle_status_counts (statut, service, nb)
+    VALUES (COALESCE(new.statut, ''), COALESCE(new.service_principal, ''), 1)
+    ON CONFLICT (statut, service) DO UPDATE SET nb = nb + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS vehicle_status_counts_ad AFTER DELETE ON vehicules BEGIN
+    UPDATE vehicle_status_counts SET nb = nb - 1
+    WHERE statut = COALESCE(old.statut, '') AND service = COALESCE(old.service_principal, '');
+END;
+
+CREATE TRIGGER IF NOT EXISTS vehicle_status_counts_au AFTER UPDATE OF statut, service_principal ON vehicules
+WHEN COALESCE(old.statut, '') <> COALESCE(new.statut, '')
+  OR COALESCE(old.service_principal, '') <> COALESCE(new.service_principal, '')
+BEGIN
+    UPDATE vehicle_status_counts SET nb = nb - 1
+    WHERE statut = COALESCE(old.statut, '') AND service = COALESCE(old.service_principal, '');
+    INSERT INTO vehicle_status_counts (statut, service, nb)
+    VALUES (COALESCE(new.statut, ''), COALESCE(new.service_principal, ''), 1)
+    ON CONFLICT (statut, service) DO UPDATE SET nb = nb + 1;
+END;
+'''
+
+_ROLLUP_COLUMNS = '''
+    km INTEGER NOT NULL DEFAULT 0,
+    litres REAL NOT NULL DEFAULT 0,
+    cout_carburant REAL NOT NULL DEFAULT 0,
+    cout_maintenance REAL NOT NULL DEFAULT 0,
+    nb_sorties INTEGER NOT NULL DEFAULT 0,
+    heures_utilisation REAL NOT NULL DEFAULT 0,'''
+
+
+def _daily_rollups_v6(conn):
+    for table, key in (('rollup_vehicule_jour', 'vehicule_id INTEGER'),
+                       ('rollup_employe_jour', 'employe_id INTEGER'),
+                       ('rollup_service_jour', 'service TEXT')):
+        key_column = key.split()[0]
+        conn.execute(f'''CREATE TABLE IF NOT EXISTS {table} (
+            jour TEXT NOT NULL,
+            {key} NOT NULL,{_ROLLUP_COLUMNS}
+            PRIMARY KEY (jour, {key_column})
+        ) WITHOUT ROWID''')
+    # Backfill from the existing history
+    from .rollups import rebuild
+    rebuild(conn)
+
+
+_FUEL_ANOMALIES_V7 = '''
+ALTER TABLE vehicules ADD COLUMN capacite_reservoir REAL;
+
+CREATE TABLE IF NOT EXISTS anomalies_carburant (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ravitaillement_id INTEGER NOT NULL,
+    vehicule_id INTEGER,
+    type TEXT NOT NULL,
+    valeur REAL,
+    reference REAL,
+    details TEXT,
+    date_detection TEXT NOT NULL,
+    UNIQUE (ravitaillement_id, type),
+    FOREIGN KEY (ravitaillement_id) REFERENCES ravitaillements(id) ON DELETE CASCADE,
+    FOREIGN KEY (vehicule_id) REFERENCES vehicules(id)
+);
+CREATE INDEX IF NOT EXISTS idx_anomalies_carburant_vehicule ON anomalies_carburant(vehicule_id);
+
+CREATE TABLE IF NOT EXISTS jobs_checkpoints (
+    job TEXT PRIMARY KEY,
+    dernier_id INTEGER NOT NULL DEFAULT 0,
+    date_maj TEXT
+);
+
+-- Fills of a vehicle in odometer order, and the trip of a vehicle under way on a given day
+CREATE INDEX IF NOT EXISTS idx_ravitaillements_vehicule_km ON ravitaillements(vehicule_id, kilometrage);
+CREATE INDEX IF NOT EXISTS idx_sorties_vehicule_depart
+    ON sorties_reservations(vehicule_id, COALESCE(date_sortie_reelle, date_sortie_prevue));
+CREATE INDEX IF NOT EXISTS idx_maintenances_vehicule_date ON maintenances(vehicule_id, date);
+'''
+
+# Every dated deadline in one place: maintenance and document due dates and
+# driving licence expiries. A maintenance or a document followed by a later
+# one of the same type for the same vehicle is superseded and left out.
+_DEADLINES_V8 = '''
+CREATE INDEX IF NOT EXISTS idx_employes_validite_permis ON employes(date_validite_permis);
+CREATE INDEX IF NOT EXISTS idx_maintenances_vehicule_type_date ON maintenances(vehicule_id, type_intervention, date);
+CREATE INDEX IF NOT EXISTS idx_documents_vehicule_type_emission ON documents(vehicule_id, type_document, date_emission);
+
+CREATE VIEW IF NOT EXISTS echeances AS
+SELECT 'Maintenance' AS categorie, m.id AS source_id, m.vehicule_id, NULL AS employe_id,
+       v.immatriculation AS objet, m.type_intervention AS description,
+       m.date_prochaine_echeance AS date_echeance
+FROM maintenances m
+LEFT JOIN vehicules v ON v.id = m.vehicule_id
+WHERE m.date_prochaine_echeance IS NOT NULL
+  AND NOT EXISTS (
+      SELECT 1 FROM maintenances n
+      WHERE n.vehicule_id = m.vehicule_id AND n.type_intervention = m.type_intervention
+        AND n.date > m.date)
+UNION ALL
+SELECT 'Document', d.id, d.vehicule_id, NULL,
+       v.immatriculation, d.type_document, d.date_echeance
+FROM documents d
+LEFT JOIN vehicules v ON v.id = d.vehicule_id
+WHERE d.date_echeance IS NOT NULL
+  AND NOT EXISTS (
+      SELECT 1 FROM documents n
+      WHERE n.vehicule_id = d.vehicule_id AND n.type_document = d.type_document
+        AND n.date_emission > d.date_emission)
+UNION ALL
+SELECT 'Permis', e.id, NULL, e.id,
+       TRIM(COALESCE(e.prenom, '') || ' ' || COALESCE(e.nom, '')), 'Permis de conduire',
+       e.date_validite_permis
+FROM employes e
+WHERE e.date_validite_permis IS NOT NULL;
+'''
+
+# State of the alert daemon (src/alertd.py): the last tag notified per
+# deadline, and the notifications waiting for, or already handed to, a sink
+_ALERT_OUTBOX_V9 = '''
+CREATE TABLE IF NOT EXISTS alertes_emises (
+    cle TEXT PRIMARY KEY,
+    categorie TEXT NOT NULL,
+    objet TEXT,
+    date_echeance TEXT,
+    statut TEXT NOT NULL,
+    date_emission TEXT NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS notifications_outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    cle TEXT NOT NULL,
+    sujet TEXT NOT NULL,
+    message TEXT NOT NULL,
+    date_creation TEXT NOT NULL,
+    date_envoi TEXT,
+    tentatives INTEGER NOT NULL DEFAULT 0,
+    erreur TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_notifications_a_envoyer ON notifications_outbox(id) WHERE date_envoi IS NULL;
+'''
+
+# Date and time columns, stored as YYYY-MM-DD and HH:MM from migration 10 on
+DATE_COLUMNS = {
+    'vehicules': ('date_acquisition',),
+    'employes': ('date_validite_permis',),
+    'affectations_permanentes': ('date_debut', 'date_fin'),
+    'sorties_reservations': ('date_sortie_prevue', 'date_retour_prevue', 'date_sortie_reelle', 'date_retour_reelle'),
+    'maintenances': ('date', 'date_prochaine_echeance'),
+    'ravitaillements': ('date',),
+    'documents': ('date_emission', 'date_echeance'),
+}
+TIME_COLUMNS = {
+    'sorties_reservations': ('heure_sortie_prevue', 'heure_retour_prevue', 'heure_sortie_reelle', 'heure_retour_reelle'),
+}
+
+# Combined departure/return moments of a trip: (column, date column, time column)
+_TRIP_MOMENTS = (
+    ('debut_prevu', 'date_sortie_prevue', 'heure_sortie_prevue'),
+    ('fin_prevue', 'date_retour_prevue', 'heure_retour_prevue'),
+    ('debut_reel', 'date_sortie_reelle', 'heure_sortie_reelle'),
+    ('fin_reelle', 'date_retour_reelle', 'heure_retour_reelle'),
+)
+
+
+def _normalize_column(conn, table, column, stored, parse):
+    """Rewrite the values of column that differ from ``stored`` (an SQL
+    expression of the column in stored form) with ``parse(value, column)``.
+    Values it cannot read are set to NULL and kept in ``logs``.
+    Returns the number of rows changed."""
+    rows = conn.execute(f'SELECT id, {column} FROM {table} WHERE {column} IS NOT {stored.format(column)}').fetchall()
+    updates, lost = [], []
+    for row_id, value in rows:
+        try:
+            updates.append((parse(value, column), row_id))
+        except ValueError:
+            updates.append((None, row_id))
+            lost.append((row_id, value))
+    conn.executemany(f'UPDATE {table} SET {column} = ? WHERE id = ?', updates)
+    conn.executemany(
+        "INSERT INTO logs (action, date_action, details) VALUES ('migration_dates', datetime('now'), ?)",
+        [(json.dumps({'table': table, 'id': i, 'colonne': column, 'valeur': v}, ensure_ascii=False),)
+         for i, v in lost])
+    return len(updates)
+
+
+def _normalized_dates_v10(conn):
+    from .dates import parse_date, parse_time
+    changed = set()
+    for columns, stored, parse in (
+        (DATE_COLUMNS, "date({}, '+0 days')", lambda value, column: parse_date(value, column, partial=True)),
+        (TIME_COLUMNS, "strftime('%H:%M', {})", parse_time),
+    ):
+        for table, names in columns.items():
+            for column in names:
+                if _normalize_column(conn, table, column, stored, parse):
+                    changed.add((table, column))
+
+    # Adding a column with a CHECK also tests the existing rows
+    for name, day, time in _TRIP_MOMENTS:
+        conn.execute(f'''ALTER TABLE sorties_reservations ADD COLUMN {name} TEXT
+            GENERATED ALWAYS AS ({day} || ' ' || COALESCE({time}, '00:00')) VIRTUAL
+            CHECK ({name} IS strftime('%Y-%m-%d %H:%M', {name}, '+0 days'))''')
+
+    # Plain date columns cannot get a CHECK without rebuilding their table.
+    # The '+0 days' modifier makes date() roll over impossible days (02-30)
+    for table, names in DATE_COLUMNS.items():
+        if table == 'sorties_reservations':
+            continue
+        invalid = ' OR '.join(f"NEW.{c} IS NOT date(NEW.{c}, '+0 days')" for c in names)
+        message = f'{table} : date invalide (AAAA-MM-JJ attendu)'
+        conn.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_{table}_dates_insert
+            BEFORE INSERT ON {table} WHEN {invalid}
+            BEGIN SELECT RAISE(ABORT, '{message}'); END''')
+        conn.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_{table}_dates_update
+            BEFORE UPDATE OF {', '.join(names)} ON {table} WHEN {invalid}
+            BEGIN SELECT RAISE(ABORT, '{message}'); END''')
+
+    for statement in (
+        'CREATE INDEX IF NOT EXISTS idx_sorties_debut_prevu ON sorties_reservations(debut_prevu)',
+        'CREATE INDEX IF NOT EXISTS idx_sorties_depart ON sorties_reservations(COALESCE(date_sortie_reelle, date_sortie_prevue))',
+        'CREATE INDEX IF NOT EXISTS idx_ravitaillements_date ON ravitaillements(date)',
+        'CREATE INDEX IF NOT EXISTS idx_maintenances_date ON maintenances(date)',
+    ):
+        conn.execute(statement)
+
+    # Rows whose date could not be read before now count in the rollups
+    if changed & {('sorties_reservations', 'date_sortie_prevue'), ('sorties_reservations', 'date_sortie_reelle'),
+                  ('ravitaillements', 'date'), ('maintenances', 'date')}:
+        from .rollups import rebuild
+        rebuild(conn)
+
+
+# Planned interval of an open trip row, in minutes since 1970; an unknown
+# start or end leaves it open on that side
+def _interval_select(row):
+    start = (f"COALESCE(CAST(strftime('%s', COALESCE({row}.debut_reel, {row}.debut_prevu)) AS INTEGER) / 60,"
+             " -2147483648)")
+    end = f"COALESCE(CAST(strftime('%s', {row}.fin_prevue) AS INTEGER) / 60, 2147483647)"
+    return (f"SELECT {row}.id, {row}.vehicule_id, {row}.vehicule_id, {start}, MAX({start}, {end})",
+            f"{row}.statut IN ('réservée', 'en sortie') AND {row}.vehicule_id IS NOT NULL")
+
+
+def _booking_intervals_v11(conn):
+    # Trips being driven, whatever their planned return, and booked trips
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_sorties_en_sortie ON sorties_reservations(vehicule_id, fin_prevue)
+                    WHERE statut = 'en sortie'""")
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_sorties_actives ON sorties_reservations(vehicule_id, debut_prevu)
+                    WHERE statut IN ('réservée', 'en sortie')""")
+
+    # What a vehicle is doing now: out of service by its flag, or on a trip
+    # started and not closed; otherwise available. Bookings for later do not
+    # change it.
+    conn.execute('''CREATE VIEW IF NOT EXISTS vehicules_etat AS
+        SELECT v.id, v.immatriculation,
+               CASE WHEN v.statut IN ('en maintenance', 'immobilisé', 'panne', 'à nettoyer') THEN v.statut
+                    WHEN EXISTS (SELECT 1 FROM sorties_reservations s
+                                 WHERE s.vehicule_id = v.id AND s.statut = 'en sortie') THEN 'en sortie'
+                    WHEN EXISTS (SELECT 1 FROM sorties_reservations s
+                                 WHERE s.vehicule_id = v.id AND s.statut = 'réservée'
+                                   AND s.debut_prevu <= strftime('%Y-%m-%d %H:%M', 'now', 'localtime')
+                                   AND s.fin_prevue > strftime('%Y-%m-%d %H:%M', 'now', 'localtime')) THEN 'en sortie'
+                    ELSE 'disponible' END AS statut
+        FROM vehicules v''')
+
+    # R*Tree of the open trips' intervals (scheduling.py); without the module
+    # the same questions are answered from idx_sorties_actives
+    try:
+        conn.execute('''CREATE VIRTUAL TABLE sorties_intervalles
+                        USING rtree_i32(id, vehicule_min, vehicule_max, debut, fin)''')
+    except sqlite3.OperationalError:
+        return
+    select, is_open = _interval_select('NEW')
+    conn.execute(f'''CREATE TRIGGER trg_sorties_intervalles_insert AFTER INSERT ON sorties_reservations
+        BEGIN INSERT INTO sorties_intervalles {select} WHERE {is_open}; END''')
+    conn.execute(f'''CREATE TRIGGER trg_sorties_intervalles_update
+        AFTER UPDATE OF statut, vehicule_id, date_sortie_prevue, heure_sortie_prevue, date_retour_prevue,
+                        heure_retour_prevue, date_sortie_reelle, heure_sortie_reelle ON sorties_reservations
+        BEGIN
+            DELETE FROM sorties_intervalles WHERE id = OLD.id;
+            INSERT INTO sorties_intervalles {select} WHERE {is_open};
+        END''')
+    conn.execute('''CREATE TRIGGER trg_sorties_intervalles_delete AFTER DELETE ON sorties_reservations
+        BEGIN DELETE FROM sorties_intervalles WHERE id = OLD.id; END''')
+    select, is_open = _interval_select('s')
+    conn.execute(f'INSERT INTO sorties_intervalles {select} FROM sorties_reservations s WHERE {is_open}')
+
+
+# Open trips by employee and by departure, beside idx_sorties_actives (by
+# vehicle), for the list of ReturnWindow (models.find_active_rentals)
+_ACTIVE_RENTALS_V12 = '''
+CREATE INDEX IF NOT EXISTS idx_sorties_actives_employe ON sorties_reservations(employe_id, debut_prevu)
+    WHERE statut IN ('réservée', 'en sortie');
+CREATE INDEX IF NOT EXISTS idx_sorties_actives_debut ON sorties_reservations(debut_prevu)
+    WHERE statut IN ('réservée', 'en sortie');
+'''
+
+
+# Consumption baseline of each model, written by the anomalies batch job so
+# that the check of a single refuel does not read the model's whole history
+_CONSUMPTION_BASELINES_V13 = '''
+CREATE TABLE IF NOT EXISTS consommation_modeles (
+    modele TEXT PRIMARY KEY,
+    mediane REAL NOT NULL,
+    mad REAL NOT NULL,
+    nb_pleins INTEGER NOT NULL,
+    date_maj TEXT
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_ravitaillements_vehicule_date ON ravitaillements(vehicule_id, date);
+'''
+
+
+# Notifications given up after too many failed deliveries are dated, and
+# leave the index of the ones still to send
+_OUTBOX_FAILURES_V14 = '''
+ALTER TABLE notifications_outbox ADD COLUMN date_echec TEXT;
+DROP INDEX IF EXISTS idx_notifications_a_envoyer;
+CREATE INDEX idx_notifications_a_envoyer ON notifications_outbox(id)
+    WHERE date_envoi IS NULL AND date_echec IS NULL;
+'''
+
+
+# vehicules.statut stays the status shown everywhere; the view deriving it
+# from the open trips was not read by anything
+_DROP_VEHICLE_STATE_V15 = '''
+DROP VIEW IF EXISTS vehicules_etat;
+'''
+
+
+# Open trips by planned return, for the overdue ones that block their
+# vehicle; idx_sorties_en_sortie only covered trips marked 'en sortie'. The
+# statistics let the planner choose between the partial indexes of the
+# open trips and the older ones on statut.
+_OVERDUE_TRIPS_V16 = '''
+CREATE INDEX IF NOT EXISTS idx_sorties_ouvertes_fin ON sorties_reservations(fin_prevue)
+    WHERE statut IN ('réservée', 'en sortie');
+DROP INDEX IF EXISTS idx_sorties_en_sortie;
+ANALYZE sorties_reservations;
+'''
+
+
+# (version, script) pairs applied in order. A script is either SQL text or a
+# callable taking the connection; each one runs in its own transaction and the
+# database's PRAGMA user_version records the last version applied.
+MIGRATIONS = [
+    (1, _SCHEMA_V1),
+    (2, _INDEXES_V2),
+    (3, _search_indexes_v3),
+    (4, _SORT_INDEXES_V4),
+    (5, _STATUS_COUNTS_V5),
+    (6, _daily_rollups_v6),
+    (7, _FUEL_ANOMALIES_V7),
+    (8, _DEADLINES_V8),
+    (9, _ALERT_OUTBOX_V9),
+    (10, _normalized_dates_v10),
+    (11, _booking_intervals_v11),
+    (12, _ACTIVE_RENTALS_V12),
+    (13, _CONSUMPTION_BASELINES_V13),
+    (14, _OUTBOX_FAILURES_V14),
+    (15, _DROP_VEHICLE_STATE_V15),
+    (16, _OVERDUE_TRIPS_V16),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def _apply_migration(conn, version, script):
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        if callable(script):
+            script(conn)
+        else:
+            # executescript() would commit first; run statement by statement
+            # so that a failing migration leaves nothing behind.
+            for statement in _split_script(script):
+                conn.execute(statement)
+        conn.execute(f'PRAGMA user_version = {version}')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def _split_script(script):
+    statement = ''
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            yield statement.strip()
+            statement = ''
+    if statement.strip():
+        yield statement.strip()
+
+
+def schema_version(conn=None):
+    conn = conn or get_connection()
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
 def init_db():
+    """Bring the database up to SCHEMA_VERSION, applying only missing migrations."""
     conn = get_connection()
-    c = conn.cursor()
-    c.executescript('''
-    PRAGMA foreign_keys = ON;
-
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT UNIQUE NOT NULL,
-        password_hash TEXT NOT NULL,
-        role TEXT NOT NULL,
-        nom TEXT,
-        prenom TEXT,
-        email TEXT,
-        actif INTEGER DEFAULT 1
-    );
-
-    CREATE TABLE IF NOT EXISTS employes (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        matricule TEXT UNIQUE NOT NULL,
-        nom TEXT NOT NULL,
-        prenom TEXT NOT NULL,
-        service TEXT,
-        telephone TEXT,
-        email TEXT,
-        num_permis TEXT,
-        date_validite_permis TEXT,
-        autorise_conduire INTEGER DEFAULT 0,
-        photo_path TEXT
-    );
-
-    CREATE TABLE IF NOT EXISTS vehicules (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        immatriculation TEXT UNIQUE NOT NULL,
-        marque TEXT,
-        modele TEXT,
-        type_vehicule TEXT,
-        annee INTEGER,
-        date_acquisition TEXT,
-        kilometrage_initial INTEGER DEFAULT 0,
-        kilometrage_actuel INTEGER DEFAULT 0,
-        carburant TEXT,
-        puissance_fiscale TEXT,
-        numero_chassis TEXT,
-        photo_path TEXT,
-        type_affectation TEXT,
-        statut TEXT,
-        service_principal TEXT,
-        seuil_revision_km INTEGER
-    );
-
-    CREATE TABLE IF NOT EXISTS affectations_permanentes (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        vehicule_id INTEGER,
-        employe_id INTEGER,
-        date_debut TEXT,
-        date_fin TEXT,
-        FOREIGN KEY (vehicule_id) REFERENCES vehicules(id),
-        FOREIGN KEY (employe_id) REFERENCES employes(id)
-    );
-
-    CREATE TABLE IF NOT EXISTS sorties_reservations (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        vehicule_id INTEGER,
-        employe_id INTEGER,
-        date_sortie_prevue TEXT,
-        heure_sortie_prevue TEXT,
-        date_retour_prevue TEXT,
-        heure_retour_prevue TEXT,
-        date_sortie_reelle TEXT,
-        heure_sortie_reelle TEXT,
-        km_depart INTEGER,
-        date_retour_reelle TEXT,
-        heure_retour_reelle TEXT,
-        km_retour INTEGER,
-        motif TEXT,
-        destination TEXT,
-        etat_retour TEXT,
-        niveau_carburant_retour TEXT,
-        statut TEXT,
-        FOREIGN KEY (vehicule_id) REFERENCES vehicules(id),
-        FOREIGN KEY (employe_id) REFERENCES employes(id)
-    );
-
-    CREATE TABLE IF NOT EXISTS maintenances (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        vehicule_id INTEGER,
-        date TEXT,
-        type_intervention TEXT,
-        kilometrage INTEGER,
-        cout REAL,
-        prestataire TEXT,
-        remarques TEXT,
-        date_prochaine_echeance TEXT,
-        FOREIGN KEY (vehicule_id) REFERENCES vehicules(id)
-    );
-
-    CREATE TABLE IF NOT EXISTS ravitaillements (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        vehicule_id INTEGER,
-        employe_id INTEGER,
-        date TEXT,
-        quantite_litres REAL,
-        cout REAL,
-        station TEXT,
-        kilometrage INTEGER,
-        FOREIGN KEY (vehicule_id) REFERENCES vehicules(id),
-        FOREIGN KEY (employe_id) REFERENCES employes(id)
-    );
-
-    CREATE TABLE IF NOT EXISTS documents (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        vehicule_id INTEGER,
-        type_document TEXT,
-        date_emission TEXT,
-        date_echeance TEXT,
-        chemin_fichier TEXT,
-        description TEXT,
-        FOREIGN KEY (vehicule_id) REFERENCES vehicules(id)
-    );
-
-    CREATE TABLE IF NOT EXISTS logs (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER,
-        action TEXT,
-        date_action TEXT,
-        details TEXT
-    );
-    ''')
-    conn.commit()
-    conn.close()
+    current = schema_version(conn)
+    for version, script in MIGRATIONS:
+        if version > current:
+            _apply_migration(conn, version, script)
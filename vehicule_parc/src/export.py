@@ -0,0 +1,171 @@
+"""Streaming CSV export of the statistics and of the raw history.
+
+Every section is written straight from its cursor, FETCH_SIZE rows at a
+time, so memory use does not depend on the number of rows exported. All the
+sections come from one read snapshot. A path ending in ``.gz`` (or
+``compress=True``) produces a gzip-compressed file.
+
+    python -m src.export rapport.csv.gz --debut 2024-01-01 --fin 2024-12-31
+"""
+import argparse
+import csv
+import gzip
+import os
+import sys
+from datetime import date
+
+# Allow running as a script, like main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.db import get_connection, init_db, read_transaction
+from src.reporting import statistics_queries
+from src.rollups import day_bounds
+
+FETCH_SIZE = 1000
+# zlib's default level: much faster than gzip's 9 for a slightly larger file
+GZIP_LEVEL = 6
+
+_TRIPS = '''
+    SELECT s.id, v.immatriculation, e.matricule, e.nom, e.prenom,
+           s.date_sortie_prevue, s.heure_sortie_prevue, s.date_retour_prevue, s.heure_retour_prevue,
+           s.date_sortie_reelle, s.heure_sortie_reelle, s.km_depart,
+           s.date_retour_reelle, s.heure_retour_reelle, s.km_retour,
+           s.motif, s.destination, s.etat_retour, s.niveau_carburant_retour, s.statut
+    FROM sorties_reservations s
+    LEFT JOIN vehicules v ON v.id = s.vehicule_id
+    LEFT JOIN employes e ON e.id = s.employe_id
+    {period}
+    ORDER BY s.id
+'''
+
+_REFUELS = '''
+    SELECT r.id, v.immatriculation, e.matricule, r.date, r.quantite_litres, r.cout,
+           r.station, r.kilometrage
+    FROM ravitaillements r
+    LEFT JOIN vehicules v ON v.id = r.vehicule_id
+    LEFT JOIN employes e ON e.id = r.employe_id
+    {period}
+    ORDER BY r.id
+'''
+
+_MAINTENANCES = '''
+    SELECT m.id, v.immatriculation, m.date, m.type_intervention, m.kilometrage, m.cout,
+           m.prestataire, m.remarques, m.date_prochaine_echeance
+    FROM maintenances m
+    LEFT JOIN vehicules v ON v.id = m.vehicule_id
+    {period}
+    ORDER BY m.id
+'''
+
+# name -> (title, header); the statistics sections come from reporting.py
+SECTIONS = {
+    'km_per_vehicle': ('Kilométrage par véhicule', ['Id', 'Immatriculation', 'Km', 'Type']),
+    'costs': ('Coûts par véhicule', ['Immatriculation', 'Carburant', 'Maintenance', 'Total']),
+    'employees': ('Conducteurs', ['Employé', 'Sorties', 'Km', 'Nom', 'Prénom']),
+    'consumption': ('Consommation', ['Immatriculation', 'Litres', 'Km', 'L/100km', 'Type']),
+    'trips': ('Sorties', [
+        'Id', 'Immatriculation', 'Matricule', 'Nom', 'Prénom',
+        'Sortie prévue', 'Heure sortie prévue', 'Retour prévu', 'Heure retour prévu',
+        'Sortie réelle', 'Heure sortie réelle', 'Km départ',
+        'Retour réel', 'Heure retour réel', 'Km retour',
+        'Motif', 'Destination', 'État retour', 'Carburant retour', 'Statut',
+    ]),
+    'refuels': ('Ravitaillements', [
+        'Id', 'Immatriculation', 'Matricule', 'Date', 'Litres', 'Coût', 'Station', 'Kilométrage',
+    ]),
+    'maintenances': ('Maintenances', [
+        'Id', 'Immatriculation', 'Date', 'Intervention', 'Kilométrage', 'Coût',
+        'Prestataire', 'Remarques', 'Prochaine échéance',
+    ]),
+}
+
+
+def _history(sql, day, start, end):
+    """(sql, params) of a raw table section. Rows are filtered on ``day``
+    only when a period is given: a full export keeps the undated ones."""
+    if start is None and end is None:
+        return sql.format(period=''), ()
+    return sql.format(period=f'WHERE {day} BETWEEN ? AND ?'), day_bounds(start, end)
+
+
+def _queries(start, end):
+    queries = statistics_queries(start, end, top_employees=-1)
+    queries.update(
+        trips=_history(_TRIPS, 'COALESCE(s.date_sortie_reelle, s.date_sortie_prevue)', start, end),
+        refuels=_history(_REFUELS, 'r.date', start, end),
+        maintenances=_history(_MAINTENANCES, 'm.date', start, end),
+    )
+    return queries
+
+
+def _open(path, compress):
+    if compress:
+        return gzip.open(path, 'wt', compresslevel=GZIP_LEVEL, newline='', encoding='utf-8')
+    return open(path, 'w', newline='', encoding='utf-8')
+
+
+def export_report(path, start=None, end=None, sections=None, compress=None,
+                  progress=None, cancelled=None):
+    """Write the chosen ``sections`` (all of SECTIONS by default) to ``path``.
+
+    Each section is a title line, a header line, its rows and an empty line.
+    ``progress(section title, rows written in it)`` is called after every
+    batch; when ``cancelled()`` returns true the export stops and the partial
+    file is removed. Returns ``{section: rows}``, or None if cancelled.
+    """
+    if compress is None:
+        compress = path.endswith('.gz')
+    queries = _queries(start, end)
+    counts = {}
+    stopped = False
+    conn = get_connection()
+    with read_transaction(conn), _open(path, compress) as f:
+        writer = csv.writer(f)
+        for name in sections or SECTIONS:
+            title, header = SECTIONS[name]
+            sql, params = queries[name]
+            writer.writerow([title])
+            writer.writerow(header)
+            cursor = conn.execute(sql, params)
+            written = 0
+            for rows in iter(lambda: cursor.fetchmany(FETCH_SIZE), []):
+                if cancelled and cancelled():
+                    stopped = True
+                    break
+                writer.writerows(rows)
+                written += len(rows)
+                if progress:
+                    progress(title, written)
+            cursor.close()
+            if stopped:
+                break
+            counts[name] = written
+            writer.writerow([])
+    if stopped:
+        os.remove(path)
+        return None
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export CSV des statistiques et de l\'historique')
+    parser.add_argument('fichier', help='fichier de sortie (.csv ou .csv.gz)')
+    parser.add_argument('--debut', type=date.fromisoformat, help='date de début (YYYY-MM-DD)')
+    parser.add_argument('--fin', type=date.fromisoformat, help='date de fin (YYYY-MM-DD)')
+    parser.add_argument('--sections', nargs='+', choices=list(SECTIONS), help='sections exportées (toutes par défaut)')
+    args = parser.parse_args(argv)
+
+    init_db()
+
+    def progress(title, written):
+        print(f'\r{title} : {written} lignes', end='', flush=True)
+
+    counts = export_report(args.fichier, args.debut, args.fin, args.sections, progress=progress)
+    print()
+    for name, written in counts.items():
+        print(f'{SECTIONS[name][0]} : {written} lignes')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,179 @@
+"""Import of vehicles, employees and refuels from a CSV file.
+
+Accepts "Excel" CSV files (';' separator, decimal comma, UTF-8 with a BOM or
+Windows-1252). The file is streamed in batches, each inserted in its own
+transaction: memory use does not depend on the size of the file.
+
+    python -m src.importer vehicules flotte.csv
+    python -m src.importer ravitaillements pleins_2015_2025.csv --lot 5000
+"""
+import argparse
+import csv
+import itertools
+import os
+import sys
+import unicodedata
+
+# Allow running as a script, like main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.db import init_db
+from src.models import (add_vehicles_bulk, add_employees_bulk, add_refuels_bulk,
+                        find_employee_ids, find_vehicle_ids)
+
+BATCH_SIZE = 1000
+# Only the first errors are kept for the report; the others are just counted
+MAX_REPORTED_ERRORS = 200
+
+# Column header (normalized) -> field name
+HEADER_ALIASES = {
+    'immat': 'immatriculation',
+    'plaque': 'immatriculation',
+    'type': 'type_vehicule',
+    'km_initial': 'kilometrage_initial',
+    'km_actuel': 'kilometrage_actuel',
+    'chassis': 'numero_chassis',
+    'affectation': 'type_affectation',
+    'seuil_revision': 'seuil_revision_km',
+    'reservoir': 'capacite_reservoir',
+    'capacite': 'capacite_reservoir',
+    'permis': 'num_permis',
+    'validite_permis': 'date_validite_permis',
+    'autorise': 'autorise_conduire',
+    'litres': 'quantite_litres',
+    'quantite': 'quantite_litres',
+    'km': 'kilometrage',
+}
+
+
+def normalize_header(name):
+    name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode()
+    name = '_'.join(name.strip().lower().replace('-', ' ').replace('.', ' ').split())
+    return HEADER_ALIASES.get(name, name)
+
+
+def _encoding(path):
+    with open(path, 'rb') as f:
+        sample = f.read(65536)
+    try:
+        sample.decode('utf-8')
+        return 'utf-8-sig'
+    except UnicodeDecodeError as exc:
+        # A multi-byte character cut by the end of the sample is still UTF-8
+        if exc.start >= len(sample) - 3:
+            return 'utf-8-sig'
+        return 'cp1252'
+
+
+def read_rows(path):
+    """Yield one dict per data line, keyed by normalized field names."""
+    with open(path, newline='', encoding=_encoding(path)) as f:
+        sample = f.read(65536)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=';,\t')
+        except csv.Error:
+            dialect = csv.excel
+        reader = csv.reader(f, dialect)
+        header = [normalize_header(h) for h in next(reader, [])]
+        for values in reader:
+            if any(v.strip() for v in values):
+                yield dict(zip(header, values))
+
+
+def batched(rows, size):
+    iterator = iter(rows)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _vehicle_rows(batch):
+    for row in batch:
+        if 'service' in row and 'service_principal' not in row:
+            row['service_principal'] = row.pop('service')
+    return batch
+
+
+def _employee_rows(batch):
+    return batch
+
+
+def _refuel_rows(batch):
+    """Turn immatriculation/matricule columns into vehicule_id/employe_id,
+    looking up only the keys of this batch."""
+    immats = {(row.get('immatriculation') or '').strip() for row in batch if not row.get('vehicule_id')}
+    matricules = {(row.get('matricule') or '').strip() for row in batch if not row.get('employe_id')}
+    vehicles = find_vehicle_ids(immats - {''})
+    employees = find_employee_ids(matricules - {''})
+    for row in batch:
+        immat = (row.get('immatriculation') or '').strip()
+        if immat and not row.get('vehicule_id'):
+            row['vehicule_id'] = vehicles.get(immat)
+        matricule = (row.get('matricule') or '').strip()
+        if matricule and not row.get('employe_id'):
+            row['employe_id'] = employees.get(matricule)
+    return batch
+
+
+IMPORTERS = {
+    'vehicules': (add_vehicles_bulk, _vehicle_rows),
+    'employes': (add_employees_bulk, _employee_rows),
+    'ravitaillements': (add_refuels_bulk, _refuel_rows),
+}
+
+
+def import_rows(kind, rows, batch_size=BATCH_SIZE, progress=None):
+    """Import an iterable of dicts batch by batch.
+
+    Returns ``(inserted, error count, errors)`` where ``errors`` holds the
+    first MAX_REPORTED_ERRORS ``(row number, message)`` pairs, rows being
+    numbered from 1. ``progress(rows read, inserted)`` is called per batch.
+    """
+    bulk_add, prepare = IMPORTERS[kind]
+    inserted = 0
+    error_count = 0
+    errors = []
+    read = 0
+    for batch in batched(rows, batch_size):
+        added, batch_errors = bulk_add(prepare(batch))
+        inserted += added
+        error_count += len(batch_errors)
+        for index, message in batch_errors:
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append((read + index + 1, message))
+        read += len(batch)
+        if progress:
+            progress(read, inserted)
+    return inserted, error_count, errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Import CSV dans la base du parc automobile')
+    parser.add_argument('type', choices=sorted(IMPORTERS), help='nature des lignes importées')
+    parser.add_argument('fichier', help='fichier CSV (séparateur , ou ;)')
+    parser.add_argument('--lot', type=int, default=BATCH_SIZE, help='lignes par transaction')
+    args = parser.parse_args(argv)
+
+    init_db()
+
+    def progress(read, inserted):
+        print(f'\r{read} lignes lues, {inserted} importées', end='', flush=True)
+
+    inserted, error_count, errors = import_rows(
+        args.type, read_rows(args.fichier), args.lot, progress
+    )
+    print()
+    for line, message in errors:
+        # +1 for the header line
+        print(f'ligne {line + 1} : {message}')
+    if error_count > len(errors):
+        print(f'... et {error_count - len(errors)} autres erreurs')
+    print(f'{inserted} lignes importées, {error_count} rejetées')
+    return 1 if error_count else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,83 +1,541 @@
+import re
+import sqlite3
+
+from src.dates import parse_date
 from src.db import get_connection
+from src.rollups import record_refuels
+
+VEHICLE_STATUSES = ('disponible', 'en sortie', 'en maintenance', 'immobilisé', 'panne', 'à nettoyer')
+
+VEHICLE_SEARCH_COLUMNS = ('immatriculation', 'marque', 'modele', 'service_principal')
+EMPLOYEE_SEARCH_COLUMNS = ('matricule', 'nom', 'prenom', 'service')
+
+# The trigram tokenizer only indexes sequences of 3 characters or more
+FTS_MIN_LENGTH = 3
+
+
+def _has_table(conn, name):
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (name,)).fetchone()
+    return row is not None
+
+
+def _search_clause(conn, alias, fts_table, columns, text):
+    """Build the (join, where clause, params, order by) of a free-text search.
+
+    Uses the FTS5 trigram index created by init_db() when it exists and the
+    text is long enough, ranking results by relevance; falls back to LIKE.
+    """
+    if len(text) >= FTS_MIN_LENGTH and _has_table(conn, fts_table):
+        join = f' JOIN {fts_table} ON {fts_table}.rowid = {alias}.id'
+        phrase = '"' + text.replace('"', '""') + '"'
+        return join, f'{fts_table} MATCH ?', [phrase], f' ORDER BY {fts_table}.rank'
+    like = f'%{text}%'
+    clause = '(' + ' OR '.join(f'{alias}.{col} LIKE ?' for col in columns) + ')'
+    return '', clause, [like] * len(columns), ''
+
+
+# Sort keys accepted by find_vehicles/find_employees, mapped to the SQL
+# expression they sort on. Nullable columns sort as '' so that keyset
+# comparisons stay total; each expression has a matching index (migration 4).
+VEHICLE_SORT_KEYS = {
+    'immatriculation': 'v.immatriculation',
+    'marque': "COALESCE(v.marque, '')",
+    'modele': "COALESCE(v.modele, '')",
+    'type_vehicule': "COALESCE(v.type_vehicule, '')",
+    'annee': "COALESCE(v.annee, '')",
+    'statut': "COALESCE(v.statut, '')",
+    'service_principal': "COALESCE(v.service_principal, '')",
+}
+EMPLOYEE_SORT_KEYS = {
+    'matricule': 'e.matricule',
+    'nom': 'e.nom',
+    'prenom': 'e.prenom',
+    'service': "COALESCE(e.service, '')",
+}
+
+
+def page_cursor(row, order_by):
+    """Keyset cursor to pass as ``after`` to fetch the rows following ``row``."""
+    value = row.get(order_by)
+    return ('' if value is None else value, row['id'])
+
+
+def _paginate(query, params, alias, sort_keys, order_by, rank_order, limit, after, has_where):
+    if order_by:
+        if order_by not in sort_keys:
+            raise ValueError(f'Clé de tri inconnue : {order_by}')
+        expr = sort_keys[order_by]
+        if after is not None:
+            # Spelled out rather than as a row value so that SQLite seeks
+            # the expression indexes instead of scanning them.
+            query += (' AND ' if has_where else ' WHERE ') + \
+                f'{expr} >= ? AND ({expr} > ? OR {alias}.id > ?)'
+            params = list(params) + [after[0], after[0], after[1]]
+        query += f' ORDER BY {expr}, {alias}.id'
+    else:
+        if after is not None:
+            raise ValueError('after requiert order_by')
+        query += rank_order
+    if limit is not None:
+        query += ' LIMIT ?'
+        params = list(params) + [limit]
+    return query, params
+
+
+_INSERT_VEHICLE = '''INSERT INTO vehicules (
+    immatriculation, marque, modele, type_vehicule, annee, date_acquisition,
+    kilometrage_initial, kilometrage_actuel, carburant, puissance_fiscale, numero_chassis, photo_path,
+    type_affectation, statut, service_principal, seuil_revision_km, capacite_reservoir
+) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)'''
+
+_INSERT_EMPLOYEE = '''INSERT INTO employes (
+    matricule, nom, prenom, service, telephone, email, num_permis,
+    date_validite_permis, autorise_conduire, photo_path
+) VALUES (?,?,?,?,?,?,?,?,?,?)'''
+
+_INSERT_REFUEL = '''INSERT INTO ravitaillements (
+    vehicule_id, employe_id, date, quantite_litres, cout, station, kilometrage
+) VALUES (?,?,?,?,?,?,?)'''
+
 
 def add_vehicle(data):
     conn = get_connection()
     c = conn.cursor()
-    c.execute('''INSERT INTO vehicules (
-        immatriculation, marque, modele, type_vehicule, annee, date_acquisition,
-        kilometrage_initial, kilometrage_actuel, carburant, puissance_fiscale, numero_chassis, photo_path,
-        type_affectation, statut, service_principal, seuil_revision_km
-    ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)''', (
+    c.execute(_INSERT_VEHICLE, (
         data.get('immatriculation'), data.get('marque'), data.get('modele'), data.get('type_vehicule'),
-        data.get('annee'), data.get('date_acquisition'), data.get('kilometrage_initial',0), data.get('kilometrage_actuel',0), data.get('carburant'),
+        data.get('annee'), parse_date(data.get('date_acquisition'), 'date_acquisition'), data.get('kilometrage_initial',0), data.get('kilometrage_actuel',0), data.get('carburant'),
         data.get('puissance_fiscale'), data.get('numero_chassis'), data.get('photo_path'), data.get('type_affectation'),
-        data.get('statut','disponible'), data.get('service_principal'), data.get('seuil_revision_km')
+        data.get('statut','disponible'), data.get('service_principal'), data.get('seuil_revision_km'),
+        data.get('capacite_reservoir')
     ))
     conn.commit()
     conn.close()
 
-def find_vehicles(filter_text=None, filters=None):
-    conn = get_connection()
-    c = conn.cursor()
-    query = 'SELECT * FROM vehicules'
+
+def _vehicle_filters(conn, filter_text, filters):
+    join = ''
     clauses = []
     params = []
+    rank_order = ''
     if filter_text:
-        clauses.append('(immatriculation LIKE ? OR marque LIKE ? OR modele LIKE ? OR service_principal LIKE ?)')
-        like = f'%{filter_text}%'
-        params.extend([like, like, like, like])
+        join, clause, search_params, rank_order = _search_clause(
+            conn, 'v', 'vehicules_fts', VEHICLE_SEARCH_COLUMNS, filter_text
+        )
+        clauses.append(clause)
+        params.extend(search_params)
     if filters:
         if 'type_vehicule' in filters:
-            clauses.append('type_vehicule = ?')
+            clauses.append('v.type_vehicule = ?')
             params.append(filters['type_vehicule'])
         if 'statut' in filters:
-            clauses.append('statut = ?')
+            clauses.append('v.statut = ?')
             params.append(filters['statut'])
-    if clauses:
-        query += ' WHERE ' + ' AND '.join(clauses)
+    where = ' WHERE ' + ' AND '.join(clauses) if clauses else ''
+    return join, where, params, rank_order
+
+
+def find_vehicles(filter_text=None, filters=None, order_by=None, limit=None, after=None):
+    """Search vehicles; with ``order_by`` and ``limit`` returns one keyset page.
+
+    ``after`` is the ``page_cursor()`` of the last row of the previous page.
+    Without ``order_by``, text searches are ordered by relevance.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    join, where, params, rank_order = _vehicle_filters(conn, filter_text, filters)
+    query, params = _paginate(
+        'SELECT v.* FROM vehicules v' + join + where, params, 'v', VEHICLE_SORT_KEYS,
+        order_by, rank_order, limit, after, bool(where)
+    )
     c.execute(query, params)
     rows = c.fetchall()
     conn.close()
     return [dict(r) for r in rows]
 
+
+def count_vehicles(filter_text=None, filters=None):
+    conn = get_connection()
+    join, where, params, _ = _vehicle_filters(conn, filter_text, filters)
+    total = conn.execute('SELECT COUNT(*) FROM vehicules v' + join + where, params).fetchone()[0]
+    conn.close()
+    return total
+
 def add_employee(data):
     conn = get_connection()
     c = conn.cursor()
-    c.execute('''INSERT INTO employes (
-        matricule, nom, prenom, service, telephone, email, num_permis,
-        date_validite_permis, autorise_conduire, photo_path
-    ) VALUES (?,?,?,?,?,?,?,?,?,?)''', (
+    c.execute(_INSERT_EMPLOYEE, (
         data.get('matricule'), data.get('nom'), data.get('prenom'), data.get('service'),
-        data.get('telephone'), data.get('email'), data.get('num_permis'), data.get('date_validite_permis'),
+        data.get('telephone'), data.get('email'), data.get('num_permis'),
+        parse_date(data.get('date_validite_permis'), 'date_validite_permis'),
         1 if data.get('autorise_conduire') else 0, data.get('photo_path')
     ))
     conn.commit()
     conn.close()
 
-def find_employees(filter_text=None):
-    conn = get_connection()
-    c = conn.cursor()
-    query = 'SELECT * FROM employes'
+
+def _employee_filters(conn, filter_text, filters):
+    join = ''
+    clauses = []
     params = []
+    rank_order = ''
     if filter_text:
-        query += ' WHERE matricule LIKE ? OR nom LIKE ? OR prenom LIKE ? OR service LIKE ?'
-        like = f'%{filter_text}%'
-        params = [like, like, like, like]
+        join, clause, params, rank_order = _search_clause(
+            conn, 'e', 'employes_fts', EMPLOYEE_SEARCH_COLUMNS, filter_text
+        )
+        clauses.append(clause)
+    if filters and 'autorise_conduire' in filters:
+        clauses.append('e.autorise_conduire = ?' if filters['autorise_conduire']
+                       else 'COALESCE(e.autorise_conduire, 0) = ?')
+        params.append(1 if filters['autorise_conduire'] else 0)
+    where = ' WHERE ' + ' AND '.join(clauses) if clauses else ''
+    return join, where, params, rank_order
+
+
+def find_employees(filter_text=None, filters=None, order_by=None, limit=None, after=None):
+    """Search employees; paging works as in find_vehicles()."""
+    conn = get_connection()
+    c = conn.cursor()
+    join, where, params, rank_order = _employee_filters(conn, filter_text, filters)
+    query, params = _paginate(
+        'SELECT e.* FROM employes e' + join + where, params, 'e', EMPLOYEE_SORT_KEYS,
+        order_by, rank_order, limit, after, bool(where)
+    )
     c.execute(query, params)
     rows = c.fetchall()
     conn.close()
     return [dict(r) for r in rows]
 
+
+def count_employees(filter_text=None, filters=None):
+    conn = get_connection()
+    join, where, params, _ = _employee_filters(conn, filter_text, filters)
+    total = conn.execute('SELECT COUNT(*) FROM employes e' + join + where, params).fetchone()[0]
+    conn.close()
+    return total
+
+# Kept word for word in the partial indexes idx_sorties_actives*, which the
+# planner only uses when the query repeats their condition; with the
+# statistics of migration 16 it picks the one matching the filters
+_ACTIVE_TRIP = "sr.statut IN ('réservée', 'en sortie')"
+
+
+def find_active_rentals(vehicule_id=None, employe_id=None, limit=None):
+    """Open trips (booked or under way), earliest departure first, with the
+    vehicle and driver details ReturnWindow shows.
+
+    Each dict has the trip's ``id``, ``vehicule_id``, ``employe_id``,
+    ``statut``, ``motif``, ``destination``, ``km_depart``, ``date_sortie`` and
+    ``heure_sortie`` (actual, else planned), ``date_retour_prevue``,
+    ``heure_retour_prevue``, and the vehicle's ``immatriculation``,
+    ``marque``, ``modele`` and the employee's ``matricule``, ``nom``,
+    ``prenom``.
+    """
+    clauses, params = [_ACTIVE_TRIP], []
+    if vehicule_id is not None:
+        clauses.append('sr.vehicule_id = ?')
+        params.append(vehicule_id)
+    if employe_id is not None:
+        clauses.append('sr.employe_id = ?')
+        params.append(employe_id)
+    query = f'''
+        SELECT sr.id, sr.vehicule_id, sr.employe_id, sr.statut, sr.motif, sr.destination, sr.km_depart,
+               COALESCE(sr.date_sortie_reelle, sr.date_sortie_prevue) AS date_sortie,
+               COALESCE(sr.heure_sortie_reelle, sr.heure_sortie_prevue) AS heure_sortie,
+               sr.date_retour_prevue, sr.heure_retour_prevue,
+               v.immatriculation, v.marque, v.modele, e.matricule, e.nom, e.prenom
+        FROM sorties_reservations sr
+        JOIN vehicules v ON v.id = sr.vehicule_id
+        JOIN employes e ON e.id = sr.employe_id
+        WHERE {' AND '.join(clauses)}
+        ORDER BY sr.debut_prevu, sr.id'''
+    if limit is not None:
+        query += ' LIMIT ?'
+        params.append(limit)
+    conn = get_connection()
+    rows = conn.execute(query, params).fetchall()
+    conn.close()
+    return [dict(r) for r in rows]
+
+
+def find_active_rental_filters():
+    """Vehicles and employees that have open trips, for the filters of
+    ReturnWindow: ``(vehicles, employees)``, lists of dicts with the ``id``
+    and the columns the filters display."""
+    conn = get_connection()
+    vehicles = conn.execute(f'''
+        SELECT id, immatriculation, marque, modele FROM vehicules
+        WHERE id IN (SELECT sr.vehicule_id FROM sorties_reservations sr WHERE {_ACTIVE_TRIP})
+        ORDER BY immatriculation''').fetchall()
+    employees = conn.execute(f'''
+        SELECT id, matricule, nom, prenom FROM employes
+        WHERE id IN (SELECT sr.employe_id FROM sorties_reservations sr WHERE {_ACTIVE_TRIP})
+        ORDER BY nom, prenom''').fetchall()
+    conn.close()
+    return [dict(r) for r in vehicles], [dict(r) for r in employees]
+
+
+def get_status_breakdown():
+    """Vehicle counts for every status, overall and per service, in one read.
+
+    Reads the ``vehicle_status_counts`` summary kept up to date by triggers on
+    ``vehicules``. Vehicles without a status or service are counted under ''.
+    """
+    conn = get_connection()
+    rows = conn.execute('SELECT statut, service, nb FROM vehicle_status_counts WHERE nb > 0').fetchall()
+    conn.close()
+    by_status = dict.fromkeys(VEHICLE_STATUSES, 0)
+    by_service = {}
+    for statut, service, nb in rows:
+        by_status[statut] = by_status.get(statut, 0) + nb
+        per_service = by_service.setdefault(service, dict.fromkeys(VEHICLE_STATUSES, 0))
+        per_service[statut] = per_service.get(statut, 0) + nb
+    return {'total': sum(by_status.values()), 'by_status': by_status, 'by_service': by_service}
+
+
 def get_dashboard_counts():
+    breakdown = get_status_breakdown()
+    by_status = breakdown['by_status']
+    return {
+        'total': breakdown['total'],
+        'available': by_status['disponible'],
+        'in_use': by_status['en sortie'],
+        'maintenance': by_status['en maintenance'],
+        'by_status': by_status,
+    }
+
+
+# ==========================================================
+# IMPORT EN MASSE
+# ==========================================================
+# Largest number of host parameters used in one IN (...) lookup
+_LOOKUP_CHUNK = 500
+
+
+def _text(data, key, required=False):
+    value = data.get(key)
+    if value is not None:
+        value = str(value).strip() or None
+    if required and value is None:
+        raise ValueError(f'{key} obligatoire')
+    return value
+
+
+def _number(data, key, kind, default=None, minimum=None):
+    value = data.get(key)
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return default
+    try:
+        # Spreadsheet exports write decimals with a comma and group thousands with spaces
+        number = kind(re.sub(r'\s', '', str(value)).replace(',', '.'))
+    except ValueError:
+        raise ValueError(f'{key} invalide : {value!r}') from None
+    if minimum is not None and number < minimum:
+        raise ValueError(f'{key} doit être supérieur ou égal à {minimum}')
+    return number
+
+
+def _date(data, key, required=False):
+    return parse_date(data.get(key), key, required)
+
+
+def _vehicle_values(data):
+    statut = _text(data, 'statut') or 'disponible'
+    if statut not in VEHICLE_STATUSES:
+        raise ValueError(f'statut inconnu : {statut!r}')
+    return (
+        _text(data, 'immatriculation', required=True), _text(data, 'marque'), _text(data, 'modele'),
+        _text(data, 'type_vehicule'), _number(data, 'annee', int), _date(data, 'date_acquisition'),
+        _number(data, 'kilometrage_initial', int, 0, 0), _number(data, 'kilometrage_actuel', int, 0, 0),
+        _text(data, 'carburant'), _text(data, 'puissance_fiscale'), _text(data, 'numero_chassis'),
+        _text(data, 'photo_path'), _text(data, 'type_affectation'), statut,
+        _text(data, 'service_principal'), _number(data, 'seuil_revision_km', int, None, 0),
+        _number(data, 'capacite_reservoir', float, None, 0)
+    )
+
+
+def _employee_values(data):
+    autorise = data.get('autorise_conduire')
+    if isinstance(autorise, str):
+        autorise = autorise.strip().lower() in ('1', 'oui', 'o', 'yes', 'y', 'true', 'vrai', 'x')
+    return (
+        _text(data, 'matricule', required=True), _text(data, 'nom', required=True),
+        _text(data, 'prenom', required=True), _text(data, 'service'), _text(data, 'telephone'),
+        _text(data, 'email'), _text(data, 'num_permis'), _date(data, 'date_validite_permis'),
+        1 if autorise else 0, _text(data, 'photo_path')
+    )
+
+
+def _refuel_values(data):
+    vehicule_id = _number(data, 'vehicule_id', int)
+    if vehicule_id is None:
+        if data.get('immatriculation'):
+            raise ValueError(f"véhicule inconnu : {data['immatriculation']}")
+        raise ValueError('vehicule_id obligatoire')
+    return (
+        vehicule_id, _number(data, 'employe_id', int), _date(data, 'date', required=True),
+        _number(data, 'quantite_litres', float, 0.0, 0), _number(data, 'cout', float, 0.0, 0),
+        _text(data, 'station'), _number(data, 'kilometrage', int, 0, 0)
+    )
+
+
+def _existing(conn, table, column, values):
+    found = set()
+    values = list(values)
+    for i in range(0, len(values), _LOOKUP_CHUNK):
+        chunk = values[i:i + _LOOKUP_CHUNK]
+        marks = ','.join('?' * len(chunk))
+        rows = conn.execute(f'SELECT {column} FROM {table} WHERE {column} IN ({marks})', chunk)
+        found.update(r[0] for r in rows)
+    return found
+
+
+def _ids_by(table, column, values):
+    """``{value: id}`` of the rows of table whose column is one of values."""
+    ids = {}
+    values = list(values)
     conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT COUNT(*) as total FROM vehicules")
-    total = c.fetchone()['total']
-    c.execute("SELECT COUNT(*) as available FROM vehicules WHERE statut = 'disponible'")
-    available = c.fetchone()['available']
-    c.execute("SELECT COUNT(*) as in_use FROM vehicules WHERE statut = 'en sortie'")
-    in_use = c.fetchone()['in_use']
-    c.execute("SELECT COUNT(*) as maintenance FROM vehicules WHERE statut = 'en maintenance'")
-    maintenance = c.fetchone()['maintenance']
+    for i in range(0, len(values), _LOOKUP_CHUNK):
+        chunk = values[i:i + _LOOKUP_CHUNK]
+        marks = ','.join('?' * len(chunk))
+        ids.update(conn.execute(f'SELECT {column}, id FROM {table} WHERE {column} IN ({marks})', chunk))
     conn.close()
-    return {'total': total, 'available': available, 'in_use': in_use, 'maintenance': maintenance}
+    return ids
+
+
+def find_vehicle_ids(registrations):
+    """``{immatriculation: id}`` of the known vehicles among registrations."""
+    return _ids_by('vehicules', 'immatriculation', set(registrations))
+
+
+def find_employee_ids(matricules):
+    """``{matricule: id}`` of the known employees among matricules."""
+    return _ids_by('employes', 'matricule', set(matricules))
+
+
+def _bulk_insert(conn, sql, rows):
+    """executemany() the (index, values) rows in the caller's transaction,
+    which must be open: outside one, releasing the savepoint would commit.
+
+    If a constraint still rejects a row, the batch is rolled back to a
+    savepoint taken before it and inserted again row by row, skipping the
+    rejected rows; whatever the caller wrote earlier in the transaction is
+    kept. Returns (inserted, errors).
+    """
+    conn.execute('SAVEPOINT bulk_insert')
+    try:
+        try:
+            conn.executemany(sql, [values for _, values in rows])
+            return len(rows), []
+        except sqlite3.IntegrityError:
+            conn.execute('ROLLBACK TO bulk_insert')
+        inserted, errors = 0, []
+        for index, values in rows:
+            try:
+                conn.execute(sql, values)
+                inserted += 1
+            except sqlite3.IntegrityError as exc:
+                errors.append((index, str(exc)))
+        return inserted, errors
+    finally:
+        conn.execute('RELEASE bulk_insert')
+
+
+def _bulk_add(rows, to_values, key_table=None, key_column=None, sql=None):
+    errors = []
+    valid = []
+    seen = set()
+    for index, data in enumerate(rows):
+        try:
+            values = to_values(data)
+        except ValueError as exc:
+            errors.append((index, str(exc)))
+            continue
+        if key_column:
+            if values[0] in seen:
+                errors.append((index, f'{key_column} en double : {values[0]}'))
+                continue
+            seen.add(values[0])
+        valid.append((index, values))
+
+    conn = get_connection()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        if key_column:
+            existing = _existing(conn, key_table, key_column, seen)
+            for index, values in valid:
+                if values[0] in existing:
+                    errors.append((index, f'{key_column} déjà enregistré : {values[0]}'))
+            valid = [(index, values) for index, values in valid if values[0] not in existing]
+        inserted, insert_errors = _bulk_insert(conn, sql, valid)
+        conn.commit()
+    finally:
+        conn.close()
+    errors.extend(insert_errors)
+    errors.sort()
+    return inserted, errors
+
+
+def add_vehicles_bulk(rows):
+    """Insert many vehicles (dicts shaped like add_vehicle's) in one transaction.
+
+    Invalid rows do not abort the import: returns ``(inserted, errors)`` where
+    ``errors`` lists ``(row index, message)`` for every rejected row.
+    """
+    return _bulk_add(rows, _vehicle_values, 'vehicules', 'immatriculation', _INSERT_VEHICLE)
+
+
+def add_employees_bulk(rows):
+    """Insert many employees in one transaction; returns ``(inserted, errors)``."""
+    return _bulk_add(rows, _employee_values, 'employes', 'matricule', _INSERT_EMPLOYEE)
+
+
+def add_refuels_bulk(rows):
+    """Insert many refuels in one transaction; returns ``(inserted, errors)``.
+
+    Rows reference ``vehicule_id`` and optionally ``employe_id``. Vehicles'
+    ``kilometrage_actuel`` is raised to the highest mileage imported, as
+    FuelWindow does for a single refuel.
+    """
+    errors = []
+    valid = []
+    for index, data in enumerate(rows):
+        try:
+            valid.append((index, _refuel_values(data)))
+        except ValueError as exc:
+            errors.append((index, str(exc)))
+
+    conn = get_connection()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        known_vehicles = _existing(conn, 'vehicules', 'id', {v[0] for _, v in valid})
+        known_employees = _existing(conn, 'employes', 'id', {v[1] for _, v in valid if v[1] is not None})
+        kept = []
+        for index, values in valid:
+            if values[0] not in known_vehicles:
+                errors.append((index, f'véhicule inconnu : {values[0]}'))
+            elif values[1] is not None and values[1] not in known_employees:
+                errors.append((index, f'employé inconnu : {values[1]}'))
+            else:
+                kept.append((index, values))
+
+        # The write lock is held since BEGIN IMMEDIATE: every id after this
+        # one up to the last inserted row is one of ours
+        previous_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM ravitaillements').fetchone()[0]
+        inserted, insert_errors = _bulk_insert(conn, _INSERT_REFUEL, kept)
+        errors.extend(insert_errors)
+        if inserted:
+            last_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+            record_refuels(conn, previous_id + 1, last_id)
+
+        max_km = {}
+        for _, values in kept:
+            max_km[values[0]] = max(max_km.get(values[0], 0), values[6])
+        conn.executemany(
+            'UPDATE vehicules SET kilometrage_actuel = ? WHERE id = ? AND COALESCE(kilometrage_actuel, 0) < ?',
+            [(km, vehicule_id, km) for vehicule_id, km in max_km.items()]
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    errors.sort()
+    return inserted, errors
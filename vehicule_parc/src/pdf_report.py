@@ -0,0 +1,189 @@
+"""PDF fleet report built with reportlab, from compute_statistics() results.
+
+Tables flow across pages with their header repeated. They are cut into
+TABLE_CHUNK-row flowables, which keeps page layout linear in the number of
+rows: reportlab re-measures a table every time it splits one. Charts are drawn
+once with matplotlib's Agg canvas (no pyplot, so this runs in any thread) and
+kept as PNG files, reused as long as the charted figures are unchanged; only
+the CHART_CACHE_SIZE most recently used ones are kept.
+"""
+import hashlib
+import json
+import os
+import tempfile
+from datetime import datetime
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import cm
+from reportlab.platypus import Image, PageBreak, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+TABLE_CHUNK = 100
+TOP_N = 10
+CHART_DIR = os.path.join(tempfile.gettempdir(), 'parc_auto_charts')
+CHART_DPI = 150
+# Three charts per report: the last few dozen reports keep theirs
+CHART_CACHE_SIZE = 60
+
+_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#dde4ee')),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 8),
+    ('ALIGN', (1, 1), (-1, -1), 'RIGHT'),
+    ('GRID', (0, 0), (-1, -1), 0.25, colors.grey),
+    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f4f6f9')]),
+])
+
+
+def _number(value, digits=0):
+    if value is None:
+        return ''
+    return f'{value:,.{digits}f}'.replace(',', ' ')
+
+
+def _chart(kind, title, labels, values, width=16, height=8):
+    """Path of a PNG chart, drawn only if this exact chart was never drawn."""
+    spec = json.dumps([kind, title, labels, values, width, height], default=str)
+    path = os.path.join(CHART_DIR, hashlib.sha1(spec.encode('utf-8')).hexdigest() + '.png')
+    if os.path.exists(path):
+        try:
+            # Marks it as recently used for _prune_charts
+            os.utime(path)
+            return path
+        except FileNotFoundError:
+            pass
+
+    fig = Figure(figsize=(width / 2.54, height / 2.54), dpi=CHART_DPI)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    if not values:
+        ax.text(0.5, 0.5, 'Pas de données', ha='center')
+        ax.axis('off')
+    elif kind == 'pie':
+        ax.pie(values, labels=labels, autopct='%1.1f%%', textprops={'fontsize': 7})
+    else:
+        ax.bar(labels, values, color=kind)
+        ax.tick_params(axis='x', rotation=45, labelsize=7)
+        ax.tick_params(axis='y', labelsize=7)
+    ax.set_title(title, fontsize=9)
+    fig.tight_layout()
+
+    os.makedirs(CHART_DIR, exist_ok=True)
+    # Write under a temporary name so that a concurrent export never reads half a file
+    tmp = f'{path}.{os.getpid()}.tmp'
+    fig.savefig(tmp, format='png')
+    os.replace(tmp, path)
+    _prune_charts()
+    return path
+
+
+def _prune_charts():
+    """Delete the least recently used charts beyond CHART_CACHE_SIZE."""
+    entries = []
+    for entry in os.scandir(CHART_DIR):
+        try:
+            entries.append((entry.stat().st_mtime, entry.path))
+        except FileNotFoundError:
+            continue
+    entries.sort(reverse=True)
+    for _, path in entries[CHART_CACHE_SIZE:]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _tables(header, rows, col_widths):
+    """Flowables of at most TABLE_CHUNK rows, each repeating the header."""
+    for i in range(0, len(rows), TABLE_CHUNK):
+        table = Table([header] + rows[i:i + TABLE_CHUNK], colWidths=col_widths, repeatRows=1)
+        table.setStyle(_TABLE_STYLE)
+        yield table
+    if not rows:
+        yield Table([header], colWidths=col_widths, style=_TABLE_STYLE)
+
+
+def _driver_name(e):
+    name = f"{e.get('prenom') or ''} {e.get('nom') or ''}".strip()
+    return name or str(e['employe_id'])
+
+
+def _story(results, period):
+    styles = getSampleStyleSheet()
+    story = [
+        Paragraph('Rapport du parc automobile', styles['Title']),
+        Paragraph(f"Période : {period}" if period else 'Période : tout l\'historique', styles['Normal']),
+        Paragraph(f"Généré le {datetime.now():%Y-%m-%d %H:%M}", styles['Normal']),
+        Spacer(1, 0.5 * cm),
+    ]
+
+    costs = results['costs']
+    summary = [
+        ['Véhicules', _number(len(results['km_per_vehicle']))],
+        ['Kilométrage total', _number(results['total_km']) + ' km'],
+        ['Kilométrage de la période', _number(results['period_km']) + ' km'],
+        ['Coût carburant', _number(sum(c['fuel'] for c in costs), 2)],
+        ['Coût maintenance', _number(sum(c['maintenance'] for c in costs), 2)],
+    ]
+    story += [Table(summary, colWidths=[6 * cm, 5 * cm], style=_TABLE_STYLE), Spacer(1, 0.5 * cm)]
+
+    top_km = sorted(results['km_per_vehicle'], key=lambda v: v['km'], reverse=True)[:TOP_N]
+    top_costs = sorted(costs, key=lambda c: c['total'], reverse=True)[:TOP_N]
+    drivers = results['employees'][:8]
+    charts = [
+        _chart('tab:blue', f'Kilométrage par véhicule (top {TOP_N})',
+               [v['imm'] for v in top_km], [v['km'] for v in top_km]),
+        _chart('orange', f'Coût total par véhicule (top {TOP_N})',
+               [c['imm'] for c in top_costs], [c['total'] for c in top_costs]),
+        _chart('pie', 'Top employés par km',
+               [f"{_driver_name(e)} ({e['sorties']})" for e in drivers], [e['km'] or 0 for e in drivers]),
+    ]
+    for path in charts:
+        story += [Image(path, width=16 * cm, height=8 * cm), Spacer(1, 0.3 * cm)]
+
+    story += [PageBreak(), Paragraph('Consommation par véhicule', styles['Heading2'])]
+    story += _tables(
+        ['Immatriculation', 'Type', 'Litres', 'Km', 'L/100km'],
+        [[r['imm'], r['type'] or '', _number(r['liters'], 1), _number(r['km']), _number(r['l_per_100km'], 2)]
+         for r in results['consumption']],
+        [4 * cm, 3.5 * cm, 3 * cm, 3 * cm, 3 * cm],
+    )
+
+    story += [PageBreak(), Paragraph('Coûts par véhicule', styles['Heading2'])]
+    story += _tables(
+        ['Immatriculation', 'Carburant', 'Maintenance', 'Total'],
+        [[c['imm'], _number(c['fuel'], 2), _number(c['maintenance'], 2), _number(c['total'], 2)]
+         for c in costs],
+        [4 * cm, 4 * cm, 4 * cm, 4 * cm],
+    )
+
+    story += [Spacer(1, 0.5 * cm), Paragraph('Conducteurs les plus actifs', styles['Heading2'])]
+    story += _tables(
+        ['Employé', 'Sorties', 'Km'],
+        [[_driver_name(e), _number(e['sorties']), _number(e['km'])] for e in results['employees']],
+        [8 * cm, 3 * cm, 4 * cm],
+    )
+    return story
+
+
+def _footer(canvas, doc):
+    canvas.saveState()
+    canvas.setFont('Helvetica', 8)
+    canvas.drawRightString(A4[0] - 1.5 * cm, 1 * cm, f'Page {doc.page}')
+    canvas.restoreState()
+
+
+def build_pdf(path, results, period=None):
+    """Write the report for ``results`` (see reporting.compute_statistics) to ``path``.
+
+    ``period`` is the text shown under the title.
+    """
+    doc = SimpleDocTemplate(
+        path, pagesize=A4, pageCompression=1,
+        leftMargin=1.5 * cm, rightMargin=1.5 * cm, topMargin=1.5 * cm, bottomMargin=1.5 * cm,
+        title='Rapport du parc automobile',
+    )
+    doc.build(_story(results, period), onFirstPage=_footer, onLaterPages=_footer)
@@ -0,0 +1,254 @@
+"""Fleet statistics, computed in SQL without any Tk dependency.
+
+Every query of a report runs inside one read transaction, so the figures are
+consistent with each other even if a return or a refuel is saved meanwhile.
+
+    python -m src.reporting --debut 2025-01-01 --fin 2025-06-30
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import date
+
+# Allow running as a script, like main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.db import get_connection, init_db, read_transaction
+from src.cache import memoize
+from src.rollups import day_bounds
+
+TOP_EMPLOYEES = 10
+
+# Distance covered by a closed trip; open trips have no km_retour yet
+_TRIP_KM = 'CASE WHEN s.km_retour IS NOT NULL THEN s.km_retour - COALESCE(s.km_depart, 0) ELSE 0 END'
+
+_KM_PER_VEHICLE = '''
+    SELECT id, immatriculation AS imm,
+           COALESCE(kilometrage_actuel, 0) - COALESCE(kilometrage_initial, 0) AS km,
+           type_vehicule AS type
+    FROM vehicules
+    ORDER BY id
+'''
+
+_TOTAL_KM = '''
+    SELECT COALESCE(SUM(COALESCE(kilometrage_actuel, 0) - COALESCE(kilometrage_initial, 0)), 0)
+    FROM vehicules
+'''
+
+_COSTS = '''
+    WITH fuel AS (
+        SELECT vehicule_id, SUM(cout) AS cout FROM ravitaillements GROUP BY vehicule_id
+    ), maint AS (
+        SELECT vehicule_id, SUM(cout) AS cout FROM maintenances GROUP BY vehicule_id
+    )
+    SELECT v.immatriculation AS imm,
+           COALESCE(f.cout, 0) AS fuel,
+           COALESCE(m.cout, 0) AS maintenance,
+           COALESCE(f.cout, 0) + COALESCE(m.cout, 0) AS total
+    FROM vehicules v
+    LEFT JOIN fuel f ON f.vehicule_id = v.id
+    LEFT JOIN maint m ON m.vehicule_id = v.id
+    ORDER BY v.id
+'''
+
+_CONSUMPTION = f'''
+    WITH fuel AS (
+        SELECT vehicule_id, SUM(quantite_litres) AS litres FROM ravitaillements GROUP BY vehicule_id
+    ), trips AS (
+        SELECT s.vehicule_id, SUM({_TRIP_KM}) AS km FROM sorties_reservations s GROUP BY s.vehicule_id
+    )
+    SELECT v.immatriculation AS imm,
+           COALESCE(f.litres, 0) AS liters,
+           COALESCE(t.km, 0) AS km,
+           CASE WHEN t.km > 0 THEN COALESCE(f.litres, 0) * 100.0 / t.km END AS l_per_100km,
+           v.type_vehicule AS type
+    FROM vehicules v
+    LEFT JOIN fuel f ON f.vehicule_id = v.id
+    LEFT JOIN trips t ON t.vehicule_id = v.id
+    ORDER BY v.id
+'''
+
+
+# Date-range figures read the daily rollups (see rollups.py) only
+_PERIOD_ROLLUP = '''
+    WITH r AS (
+        SELECT vehicule_id, SUM(km) AS km, SUM(litres) AS litres,
+               SUM(cout_carburant) AS fuel, SUM(cout_maintenance) AS maint
+        FROM rollup_vehicule_jour
+        WHERE jour BETWEEN ? AND ?
+        GROUP BY vehicule_id
+    )
+'''
+
+_PERIOD_COSTS = _PERIOD_ROLLUP + '''
+    SELECT v.immatriculation AS imm,
+           COALESCE(r.fuel, 0) AS fuel,
+           COALESCE(r.maint, 0) AS maintenance,
+           COALESCE(r.fuel, 0) + COALESCE(r.maint, 0) AS total
+    FROM vehicules v
+    LEFT JOIN r ON r.vehicule_id = v.id
+    ORDER BY v.id
+'''
+
+_PERIOD_CONSUMPTION = _PERIOD_ROLLUP + '''
+    SELECT v.immatriculation AS imm,
+           COALESCE(r.litres, 0) AS liters,
+           COALESCE(r.km, 0) AS km,
+           CASE WHEN r.km > 0 THEN COALESCE(r.litres, 0) * 100.0 / r.km END AS l_per_100km,
+           v.type_vehicule AS type
+    FROM vehicules v
+    LEFT JOIN r ON r.vehicule_id = v.id
+    ORDER BY v.id
+'''
+
+_PERIOD_KM = 'SELECT COALESCE(SUM(km), 0) FROM rollup_vehicule_jour WHERE jour BETWEEN ? AND ?'
+
+_PERIOD_EMPLOYEES = '''
+    WITH r AS (
+        SELECT employe_id, SUM(nb_sorties) AS sorties, SUM(km) AS km
+        FROM rollup_employe_jour
+        WHERE jour BETWEEN ? AND ?
+        GROUP BY employe_id
+        HAVING SUM(nb_sorties) > 0
+        ORDER BY sorties DESC
+        LIMIT ?
+    )
+    SELECT r.employe_id, r.sorties, r.km, e.nom, e.prenom
+    FROM r
+    LEFT JOIN employes e ON e.id = r.employe_id
+    ORDER BY r.sorties DESC
+'''
+
+_ALL_EMPLOYEES = f'''
+    WITH r AS (
+        SELECT s.employe_id, COUNT(*) AS sorties, SUM({_TRIP_KM}) AS km
+        FROM sorties_reservations s
+        GROUP BY s.employe_id
+        ORDER BY sorties DESC
+        LIMIT ?
+    )
+    SELECT r.employe_id, r.sorties, r.km, e.nom, e.prenom
+    FROM r
+    LEFT JOIN employes e ON e.id = r.employe_id
+    ORDER BY r.sorties DESC
+'''
+
+
+# Bucket of a rollup day (YYYY-MM-DD), as text that sorts chronologically
+TREND_PERIODS = {
+    'week': "strftime('%Y-%m-%d', jour, '-6 days', 'weekday 1')",
+    'month': "strftime('%Y-%m', jour)",
+    'quarter': "strftime('%Y', jour) || '-T' || ((CAST(strftime('%m', jour) AS INTEGER) + 2) / 3)",
+    'year': "strftime('%Y', jour)",
+}
+
+# Series of a trend: (rollup table, label of a rollup row)
+TREND_GROUPS = {
+    'fleet': ('rollup_vehicule_jour r', "''"),
+    'vehicle': ('rollup_vehicule_jour r LEFT JOIN vehicules v ON v.id = r.vehicule_id',
+                "COALESCE(v.immatriculation, r.vehicule_id)"),
+    'type': ('rollup_vehicule_jour r LEFT JOIN vehicules v ON v.id = r.vehicule_id',
+             "COALESCE(v.type_vehicule, '')"),
+    'service': ('rollup_service_jour r', 'r.service'),
+}
+
+_TREND = '''
+    SELECT {bucket} AS periode, {label} AS groupe,
+           SUM(r.km) AS km, SUM(r.litres) AS litres, SUM(r.cout_carburant) AS cout_carburant,
+           SUM(r.cout_maintenance) AS cout_maintenance, SUM(r.nb_sorties) AS nb_sorties
+    FROM {source}
+    WHERE r.jour BETWEEN ? AND ?
+    GROUP BY periode, groupe
+    ORDER BY periode, groupe
+'''
+
+
+def trend_query(period='month', group='fleet', start=None, end=None):
+    """(sql, params) of the totals per period bucket and per series."""
+    if period not in TREND_PERIODS:
+        raise ValueError(f'période inconnue : {period}')
+    if group not in TREND_GROUPS:
+        raise ValueError(f'regroupement inconnu : {group}')
+    source, label = TREND_GROUPS[group]
+    bucket = TREND_PERIODS[period].replace('jour', 'r.jour')
+    return _TREND.format(bucket=bucket, label=label, source=source), day_bounds(start, end)
+
+
+@memoize
+def compute_trends(period='month', group='fleet', start=None, end=None):
+    """km, litres, fuel and maintenance cost and trip count per ``period``
+    ('week' starting on Monday, 'month', 'quarter' or 'year') and per vehicle,
+    vehicle type or service (``group``), from the daily rollups in one query.
+
+    Returns dicts with ``periode``, ``groupe`` and the measures, ordered by
+    period; cached until the database changes.
+    """
+    conn = get_connection()
+    return [dict(r) for r in conn.execute(*trend_query(period, group, start, end))]
+
+
+def statistics_queries(start=None, end=None, top_employees=TOP_EMPLOYEES):
+    """``{name: (sql, params)}`` of the lists making up compute_statistics().
+
+    ``top_employees`` limits the drivers list; -1 returns every driver.
+    """
+    if start or end:
+        bounds = day_bounds(start, end)
+        return {
+            'km_per_vehicle': (_KM_PER_VEHICLE, ()),
+            'costs': (_PERIOD_COSTS, bounds),
+            'employees': (_PERIOD_EMPLOYEES, bounds + (top_employees,)),
+            'consumption': (_PERIOD_CONSUMPTION, bounds),
+        }
+    return {
+        'km_per_vehicle': (_KM_PER_VEHICLE, ()),
+        'costs': (_COSTS, ()),
+        'employees': (_ALL_EMPLOYEES, (top_employees,)),
+        'consumption': (_CONSUMPTION, ()),
+    }
+
+
+@memoize
+def compute_statistics(start=None, end=None):
+    """KPIs of the fleet; with ``start``/``end`` (dates) the costs, drivers and
+    consumption cover that period only and are read from the daily rollups.
+
+    Returns a dict with ``km_per_vehicle``, ``total_km``, ``period_km``,
+    ``costs``, ``employees`` (most active drivers) and ``consumption``.
+    Results are cached until the database changes (see cache.py).
+    """
+    conn = get_connection()
+    with read_transaction(conn):
+        results = {
+            name: [dict(r) for r in conn.execute(sql, params)]
+            for name, (sql, params) in statistics_queries(start, end).items()
+        }
+        results['total_km'] = conn.execute(_TOTAL_KM).fetchone()[0]
+        results['period_km'] = (
+            conn.execute(_PERIOD_KM, day_bounds(start, end)).fetchone()[0] if start or end else 0
+        )
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Statistiques du parc automobile (JSON)')
+    parser.add_argument('--debut', type=date.fromisoformat, help='date de début (YYYY-MM-DD)')
+    parser.add_argument('--fin', type=date.fromisoformat, help='date de fin (YYYY-MM-DD)')
+    parser.add_argument('--tendance', choices=list(TREND_PERIODS),
+                        help='totaux par semaine, mois, trimestre ou année au lieu des statistiques')
+    parser.add_argument('--par', choices=list(TREND_GROUPS), default='fleet',
+                        help='séries de la tendance : parc, véhicule, type ou service')
+    args = parser.parse_args(argv)
+    init_db()
+    if args.tendance:
+        results = compute_trends(args.tendance, args.par, args.debut, args.fin)
+    else:
+        results = compute_statistics(args.debut, args.fin)
+    json.dump(results, sys.stdout, ensure_ascii=False, indent=2)
+    print()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
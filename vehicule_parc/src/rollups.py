@@ -0,0 +1,156 @@
+"""Daily rollups of trips, refuels and maintenances.
+
+Three tables hold per-day totals (km, litres, fuel and maintenance cost, trip
+count, hours in use): ``rollup_vehicule_jour``, ``rollup_employe_jour`` and
+``rollup_service_jour`` (the vehicle's service_principal, '' when unset).
+They are updated by the record_* functions, which the code writing a closed
+trip, a refuel or a maintenance calls in the same transaction, so that
+date-range reports never have to scan the raw history.
+
+A trip counts on its departure day, once closed (km_retour known). Rows whose
+date is not a valid YYYY-MM-DD are left out. ``rebuild()`` recomputes the
+tables from the raw rows, e.g. after editing history by hand:
+
+    python -m src.rollups
+    python -m src.rollups --debut 2024-01-01 --fin 2024-12-31
+"""
+import argparse
+import os
+import sys
+from datetime import date
+
+# Allow running as a script, like main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.db import get_connection, init_db
+
+# (table, key column); the key is a column of the _SOURCES selects
+ROLLUP_TABLES = [
+    ('rollup_vehicule_jour', 'vehicule_id'),
+    ('rollup_employe_jour', 'employe_id'),
+    ('rollup_service_jour', 'service'),
+]
+
+_MEASURES = ('km', 'litres', 'cout_carburant', 'cout_maintenance', 'nb_sorties', 'heures_utilisation')
+
+
+def _moment(day, time):
+    return f"julianday({day} || COALESCE(' ' || {time}, ''))"
+
+
+# One select per kind of event, all with the same columns; {where} selects
+# the rows to add.
+_SOURCES = {
+    'trips': f'''
+        SELECT date(COALESCE(s.date_sortie_reelle, s.date_sortie_prevue)) AS jour,
+               s.vehicule_id, s.employe_id, COALESCE(v.service_principal, '') AS service,
+               MAX(s.km_retour - COALESCE(s.km_depart, 0), 0) AS km,
+               0 AS litres, 0 AS cout_carburant, 0 AS cout_maintenance, 1 AS nb_sorties,
+               MAX(COALESCE(24 * ({_moment('s.date_retour_reelle', 's.heure_retour_reelle')}
+                   - {_moment('COALESCE(s.date_sortie_reelle, s.date_sortie_prevue)',
+                              'COALESCE(s.heure_sortie_reelle, s.heure_sortie_prevue)')}), 0), 0)
+                   AS heures_utilisation
+        FROM sorties_reservations s
+        LEFT JOIN vehicules v ON v.id = s.vehicule_id
+        WHERE s.km_retour IS NOT NULL AND {{where}}
+    ''',
+    'refuels': '''
+        SELECT date(r.date) AS jour,
+               r.vehicule_id, r.employe_id, COALESCE(v.service_principal, '') AS service,
+               0 AS km, COALESCE(r.quantite_litres, 0) AS litres, COALESCE(r.cout, 0) AS cout_carburant,
+               0 AS cout_maintenance, 0 AS nb_sorties, 0 AS heures_utilisation
+        FROM ravitaillements r
+        LEFT JOIN vehicules v ON v.id = r.vehicule_id
+        WHERE {where}
+    ''',
+    'maintenances': '''
+        SELECT date(m.date) AS jour,
+               m.vehicule_id, NULL AS employe_id, COALESCE(v.service_principal, '') AS service,
+               0 AS km, 0 AS litres, 0 AS cout_carburant, COALESCE(m.cout, 0) AS cout_maintenance,
+               0 AS nb_sorties, 0 AS heures_utilisation
+        FROM maintenances m
+        LEFT JOIN vehicules v ON v.id = m.vehicule_id
+        WHERE {where}
+    ''',
+}
+
+_UPSERT = '''
+    INSERT INTO {table} (jour, {key}, {measures})
+    SELECT jour, {key}, {sums}
+    FROM ({source})
+    WHERE jour IS NOT NULL AND {key} IS NOT NULL AND jour BETWEEN ? AND ?
+    GROUP BY jour, {key}
+    ON CONFLICT (jour, {key}) DO UPDATE SET {updates}
+'''
+
+
+def _upsert_sql(table, key, source):
+    return _UPSERT.format(
+        table=table, key=key, source=source,
+        measures=', '.join(_MEASURES),
+        sums=', '.join(f'SUM({m})' for m in _MEASURES),
+        updates=', '.join(f'{m} = {m} + excluded.{m}' for m in _MEASURES),
+    )
+
+
+def day_bounds(start, end):
+    """(first, last) day as text for ``jour BETWEEN ? AND ?``; None means unbounded."""
+    return (start.isoformat() if start else '0000-00-00',
+            end.isoformat() if end else '9999-12-31')
+
+
+def _add(conn, kind, where, params, start=None, end=None):
+    source = _SOURCES[kind].format(where=where)
+    for table, key in ROLLUP_TABLES:
+        conn.execute(_upsert_sql(table, key, source), list(params) + list(day_bounds(start, end)))
+
+
+def record_trip(conn, trip_id):
+    """Add a trip just closed (km_retour set) to the rollups."""
+    _add(conn, 'trips', 's.id = ?', (trip_id,))
+
+
+def record_refuels(conn, first_id, last_id=None):
+    """Add the refuels with ids from first_id to last_id (inclusive)."""
+    _add(conn, 'refuels', 'r.id BETWEEN ? AND ?', (first_id, first_id if last_id is None else last_id))
+
+
+def record_maintenance(conn, maintenance_id):
+    _add(conn, 'maintenances', 'm.id = ?', (maintenance_id,))
+
+
+def rebuild(conn, start=None, end=None):
+    """Recompute the rollups of the days from start to end (all days by default).
+
+    Runs in the caller's transaction.
+    """
+    low, high = day_bounds(start, end)
+    for table, _ in ROLLUP_TABLES:
+        conn.execute(f'DELETE FROM {table} WHERE jour BETWEEN ? AND ?', (low, high))
+    for kind in _SOURCES:
+        _add(conn, kind, '1', (), start, end)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Recalcul des agrégats journaliers')
+    parser.add_argument('--debut', type=date.fromisoformat, help='premier jour recalculé (YYYY-MM-DD)')
+    parser.add_argument('--fin', type=date.fromisoformat, help='dernier jour recalculé (YYYY-MM-DD)')
+    args = parser.parse_args(argv)
+
+    init_db()
+    conn = get_connection()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        rebuild(conn, args.debut, args.fin)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    for table, _ in ROLLUP_TABLES:
+        count = conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+        print(f'{table} : {count} lignes')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""Vehicle bookings over time: availability and overlap checks.
+
+Open trips (statut 'réservée' or 'en sortie') keep their planned interval in
+the ``sorties_intervalles`` R*Tree (migration 11), in minutes since 1970, so
+that "which vehicles are free between T1 and T2" and "does this booking
+overlap another one" are index lookups whatever the number of bookings.
+Without the R*Tree module the same queries read the partial index
+``idx_sorties_actives``.
+
+A trip still open after its planned return (booked or under way, never
+closed in ReturnWindow) blocks every booking of its vehicle until it is
+closed; those are found through ``idx_sorties_ouvertes_fin``. Times are ``YYYY-MM-DD HH:MM`` texts (dates.DATETIME_FORMAT).
+"""
+import time
+
+from src.dates import DATETIME_FORMAT
+from src.db import get_connection
+
+# Vehicle flags that keep a vehicle from being booked
+OUT_OF_SERVICE = ('en maintenance', 'immobilisé', 'panne')
+
+
+class ConflictError(ValueError):
+    """A write lost against a concurrent one (vehicle taken, trip already
+    closed, database kept busy by other workstations)."""
+
+
+class ReservationConflict(ConflictError):
+    """The requested interval overlaps open trips of the vehicle, listed in
+    ``conflicts``."""
+
+    def __init__(self, vehicule_id, conflicts):
+        self.vehicule_id = vehicule_id
+        self.conflicts = conflicts
+        lines = [f"n°{c['id']} : {c['debut'] or '…'} – {c['fin'] or '…'} ({c['statut']})" for c in conflicts]
+        super().__init__('Véhicule déjà réservé sur cette période :\n' + '\n'.join(lines))
+
+
+def _minutes(param):
+    return f"CAST(strftime('%s', :{param}) AS INTEGER) / 60"
+
+
+# Ids of the open trips overlapping [:debut, :fin); {vehicle} restricts them
+# to one vehicle (:vehicule) or is empty
+_OVERLAPS_RTREE = f'''
+    SELECT id FROM sorties_intervalles
+    WHERE debut < {_minutes('fin')} AND fin > {_minutes('debut')} {{vehicle}}
+'''
+_RTREE_VEHICLE = 'AND vehicule_min <= :vehicule AND vehicule_max >= :vehicule'
+
+_OVERLAPS_INDEX = '''
+    SELECT id FROM sorties_reservations
+    WHERE statut IN ('réservée', 'en sortie')
+      AND COALESCE(debut_reel, debut_prevu, '') < :fin
+      AND COALESCE(fin_prevue, '9999-12-31 23:59') > :debut {vehicle}
+'''
+
+# Open trips whose planned return has passed
+_OVERDUE = '''
+    SELECT id FROM sorties_reservations
+    WHERE statut IN ('réservée', 'en sortie')
+      AND fin_prevue <= strftime('%Y-%m-%d %H:%M', 'now', 'localtime') {vehicle}
+'''
+_TRIP_VEHICLE = 'AND vehicule_id = :vehicule'
+
+
+def _busy_trips(conn, per_vehicle):
+    """SQL of the ids of the trips making vehicles unavailable over [:debut, :fin)."""
+    rtree = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sorties_intervalles'").fetchone()
+    if rtree:
+        overlaps = _OVERLAPS_RTREE.format(vehicle=_RTREE_VEHICLE if per_vehicle else '')
+    else:
+        overlaps = _OVERLAPS_INDEX.format(vehicle=_TRIP_VEHICLE if per_vehicle else '')
+    return f"{overlaps} UNION {_OVERDUE.format(vehicle=_TRIP_VEHICLE if per_vehicle else '')}"
+
+
+def find_conflicts(conn, vehicule_id, start, end, exclude_id=None):
+    """Open trips of the vehicle overlapping [start, end), as dicts with
+    ``id``, ``employe_id``, ``debut``, ``fin`` and ``statut``."""
+    rows = conn.execute(f'''
+        SELECT id, employe_id, COALESCE(debut_reel, debut_prevu) AS debut, fin_prevue AS fin, statut
+        FROM sorties_reservations
+        WHERE id IN ({_busy_trips(conn, True)}) AND id IS NOT :exclude
+        ORDER BY debut
+    ''', {'vehicule': vehicule_id, 'debut': start, 'fin': end, 'exclude': exclude_id}).fetchall()
+    return [dict(r) for r in rows]
+
+
+def check_available(conn, vehicule_id, start, end, exclude_id=None):
+    """Raise ReservationConflict if the vehicle cannot be booked from start to end."""
+    if end <= start:
+        raise ValueError('Le retour doit être postérieur à la sortie')
+    conflicts = find_conflicts(conn, vehicule_id, start, end, exclude_id)
+    if conflicts:
+        raise ReservationConflict(vehicule_id, conflicts)
+
+
+def available_vehicles(start, end, conn=None, now=None):
+    """Vehicles in service with no open trip overlapping [start, end), by
+    registration.
+
+    A period starting by ``now`` only offers ``disponible`` vehicles, the
+    ones services.reserve_vehicle lets leave at once.
+    """
+    conn = conn or get_connection()
+    now = now or time.strftime(DATETIME_FORMAT)
+    statuses = ', '.join("'" + s.replace("'", "''") + "'" for s in OUT_OF_SERVICE)
+    departure = " AND COALESCE(statut, 'disponible') = 'disponible'" if start <= now else ''
+    rows = conn.execute(f'''
+        SELECT * FROM vehicules
+        WHERE COALESCE(statut, '') NOT IN ({statuses}){departure}
+          AND id NOT IN (SELECT vehicule_id FROM sorties_reservations
+                         WHERE id IN ({_busy_trips(conn, False)}) AND vehicule_id IS NOT NULL)
+        ORDER BY immatriculation
+    ''', {'debut': start, 'fin': end}).fetchall()
+    return [dict(r) for r in rows]
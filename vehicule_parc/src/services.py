@@ -0,0 +1,136 @@
+"""Reservation and return transactions, safe with several workstations on
+one database file.
+
+Each operation runs in its own ``BEGIN IMMEDIATE`` transaction: the write
+lock is taken before anything is read, so availability is checked against
+the committed state and no other desk can write between the check and the
+insert. Updates are conditional on the state that was checked (a vehicle
+still ``disponible``, a trip still open); losing a race raises
+ConflictError instead of overwriting the winner. When the database stays
+locked longer than the busy timeout the transaction is retried RETRIES
+times with a growing, jittered delay.
+"""
+import random
+import sqlite3
+import time
+
+from src.dates import DATETIME_FORMAT, to_datetime
+from src.db import get_connection
+from src.rollups import record_trip
+from src.scheduling import OUT_OF_SERVICE, ConflictError, check_available
+
+RETRIES = 5
+BACKOFF_S = 0.05
+
+OPEN_STATUSES = ('réservée', 'en sortie')
+CLOSED_STATUS = 'clôturée'
+
+
+def _is_busy(exc):
+    code = getattr(exc, 'sqlite_errorcode', None)
+    if code is not None:
+        # Extended codes (SQLITE_BUSY_SNAPSHOT...) keep SQLITE_BUSY in the low byte
+        return code & 0xff == sqlite3.SQLITE_BUSY
+    return 'locked' in str(exc)
+
+
+def _write(work, *args):
+    """Run ``work(conn, *args)`` in a write transaction and return its result,
+    retrying while the database is busy."""
+    conn = get_connection()
+    for attempt in range(RETRIES):
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            result = work(conn, *args)
+            conn.commit()
+            return result
+        except sqlite3.OperationalError as exc:
+            if conn.in_transaction:
+                conn.rollback()
+            if not _is_busy(exc):
+                raise
+            time.sleep(BACKOFF_S * 2 ** attempt * random.uniform(0.5, 1.5))
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+    raise ConflictError('Base de données occupée par un autre poste, réessayez')
+
+
+def _reserve(conn, vehicule_id, employe_id, schedule, km_depart, motif, destination, now):
+    row = conn.execute('SELECT immatriculation, statut FROM vehicules WHERE id = ?', (vehicule_id,)).fetchone()
+    if row is None:
+        raise ValueError(f'Véhicule inconnu : {vehicule_id}')
+    if row['statut'] in OUT_OF_SERVICE:
+        raise ConflictError(f"Véhicule {row['immatriculation']} indisponible ({row['statut']})")
+    start = to_datetime(*schedule[:2]).strftime(DATETIME_FORMAT)
+    end = to_datetime(*schedule[2:]).strftime(DATETIME_FORMAT)
+    check_available(conn, vehicule_id, start, end)
+
+    # Only a departure now takes the vehicle out; later bookings leave its status alone
+    if start <= now and conn.execute(
+            "UPDATE vehicules SET statut = 'en sortie' WHERE id = ? AND COALESCE(statut, 'disponible') = 'disponible'",
+            (vehicule_id,)).rowcount == 0:
+        raise ConflictError(f"Véhicule {row['immatriculation']} non disponible au départ ({row['statut']})")
+    cursor = conn.execute('''INSERT INTO sorties_reservations (
+            vehicule_id, employe_id, date_sortie_prevue, heure_sortie_prevue,
+            date_retour_prevue, heure_retour_prevue, km_depart, motif, destination, statut
+        ) VALUES (?,?,?,?,?,?,?,?,?,?)''',
+        (vehicule_id, employe_id, *schedule, km_depart, motif, destination, 'réservée'))
+    return cursor.lastrowid
+
+
+def reserve_vehicle(vehicule_id, employe_id, schedule, km_depart, motif, destination, now=None):
+    """Book the vehicle for ``schedule`` (stored departure date and time,
+    return date and time) and return the new trip id.
+
+    Raises ReservationConflict if the period overlaps an open trip of the
+    vehicle, ConflictError if the vehicle cannot leave now.
+    """
+    now = now or time.strftime(DATETIME_FORMAT)
+    return _write(_reserve, vehicule_id, employe_id, schedule, km_depart, motif, destination, now)
+
+
+def _start_departures(conn, now):
+    return conn.execute(f'''
+        UPDATE vehicules SET statut = 'en sortie'
+        WHERE COALESCE(statut, 'disponible') = 'disponible'
+          AND id IN (SELECT vehicule_id FROM sorties_reservations
+                     WHERE statut IN ({', '.join('?' * len(OPEN_STATUSES))}) AND debut_prevu <= ?)''',
+        (*OPEN_STATUSES, now)).rowcount
+
+
+def start_departures(now=None):
+    """Take out the vehicles whose booked trip has begun, as _reserve does for
+    a departure booked now, and return how many were.
+
+    Only ``disponible`` vehicles change: a vehicle flagged otherwise keeps
+    its flag until it is dealt with. Runs at every refresh of the dashboard
+    and every cycle of alertd.
+    """
+    now = now or time.strftime(DATETIME_FORMAT)
+    return _write(_start_departures, now)
+
+
+def _close(conn, trip_id, km_retour, etat, niveau_carburant, vehicle_status, day, hour):
+    closed = conn.execute(f'''
+        UPDATE sorties_reservations
+        SET date_retour_reelle = ?, heure_retour_reelle = ?, km_retour = ?,
+            etat_retour = ?, niveau_carburant_retour = ?, statut = ?
+        WHERE id = ? AND statut IN ({', '.join('?' * len(OPEN_STATUSES))})''',
+        (day, hour, km_retour, etat, niveau_carburant, CLOSED_STATUS, trip_id, *OPEN_STATUSES)).rowcount
+    if not closed:
+        raise ConflictError(f'La sortie n°{trip_id} a déjà été clôturée')
+    conn.execute('''UPDATE vehicules SET kilometrage_actuel = ?, statut = ?
+                    WHERE id = (SELECT vehicule_id FROM sorties_reservations WHERE id = ?)''',
+                 (km_retour, vehicle_status, trip_id))
+    record_trip(conn, trip_id)
+
+
+def close_return(trip_id, km_retour, etat, niveau_carburant, vehicle_status, day, hour):
+    """Close an open trip, returned on ``day`` at ``hour`` (stored forms), and
+    give its vehicle ``vehicle_status``.
+
+    Raises ConflictError if the trip is no longer open.
+    """
+    _write(_close, trip_id, km_retour, etat, niveau_carburant, vehicle_status, day, hour)
@@ -0,0 +1,297 @@
+"""SQL tracing and slow-query log.
+
+Enabled by setting the environment variable PARC_SQL_TRACE=1 before starting
+the application; db.get_connection() then hands out TracedConnection objects.
+When the variable is unset this module is not even imported.
+
+- PARC_SQL_SLOW_MS: slow-query threshold in milliseconds (default 100)
+- PARC_SQL_LOG: path of the rotating log file of slow queries (default
+  ``sql_lent.log`` in the application folder), or ``logs`` to write them to
+  the ``logs`` table (action 'slow_query') instead. Those writes commit
+  through a second connection, which moves db.data_generation() and empties
+  the memoized caches: the traced application then queries more than usual.
+
+Per query shape (the statement with its literals replaced by ``?``) it keeps
+the number of calls, total time, p50/p95 and rows; see ``report()``. The
+summary is printed on stderr when the process exits.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+
+from .db import PooledConnection
+
+SLOW_MS = float(os.environ.get('PARC_SQL_SLOW_MS', '100'))
+# Writing to the table is opt-in: see the module docstring
+LOG_TABLE = 'logs'
+LOG_FILE = os.environ.get('PARC_SQL_LOG') or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sql_lent.log')
+LOG_MAX_BYTES = 1_000_000
+LOG_BACKUPS = 3
+# Slow-query entries go through their own connection, which gives up quickly
+# when another writer holds the database; at most MAX_PENDING are kept meanwhile
+LOG_TIMEOUT = 0.1
+MAX_PENDING = 1000
+# Durations kept per shape for the percentiles
+SAMPLE_SIZE = 1000
+
+_lock = threading.Lock()
+_stats = {}
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_NULL = re.compile(r'\bNULL\b', re.IGNORECASE)
+_SPACES = re.compile(r'\s+')
+
+
+def query_shape(sql):
+    """Normalize a statement so that executions differing only by values group together."""
+    shape = _STRING.sub('?', sql)
+    shape = _NUMBER.sub('?', shape)
+    shape = _NULL.sub('?', shape)
+    shape = _IN_LIST.sub('(?, ...)', shape)
+    return _SPACES.sub(' ', shape).strip()
+
+
+class _QueryStats:
+    __slots__ = ('calls', 'statements', 'total', 'rows', 'samples')
+
+    def __init__(self):
+        self.calls = 0
+        self.statements = 0
+        self.total = 0.0
+        self.rows = 0
+        self.samples = []
+
+    def add(self, duration, rows):
+        self.calls += 1
+        self.total += duration
+        self.rows += rows
+        if len(self.samples) >= SAMPLE_SIZE:
+            self.samples[self.calls % SAMPLE_SIZE] = duration
+        else:
+            self.samples.append(duration)
+
+
+def _stats_for(shape):
+    stats = _stats.get(shape)
+    if stats is None:
+        stats = _stats[shape] = _QueryStats()
+    return stats
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def report():
+    """Per-shape counters, most expensive first; times in milliseconds."""
+    with _lock:
+        items = list(_stats.items())
+    result = []
+    for shape, stats in items:
+        samples = stats.samples or [0.0]
+        result.append({
+            'query': shape,
+            'calls': stats.calls,
+            'statements': stats.statements,
+            'total_ms': stats.total * 1000,
+            'p50_ms': _percentile(samples, 0.50) * 1000,
+            'p95_ms': _percentile(samples, 0.95) * 1000,
+            'rows': stats.rows,
+        })
+    result.sort(key=lambda r: r['total_ms'], reverse=True)
+    return result
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+def _print_report():
+    rows = report()
+    if not rows:
+        return
+    out = sys.stderr
+    out.write('\n-- SQL trace: calls | statements | total ms | p50 ms | p95 ms | rows | query\n')
+    for r in rows[:30]:
+        out.write(f"{r['calls']:6d} | {r['statements']:6d} | {r['total_ms']:9.1f} | {r['p50_ms']:7.2f} | "
+                  f"{r['p95_ms']:7.2f} | {r['rows']:7d} | {r['query'][:120]}\n")
+
+
+atexit.register(_print_report)
+
+_file_logger = None
+if LOG_FILE != LOG_TABLE:
+    _file_logger = logging.getLogger('parc.sql')
+    _file_logger.propagate = False
+    _file_logger.setLevel(logging.INFO)
+    _handler = logging.handlers.RotatingFileHandler(
+        LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding='utf-8'
+    )
+    _handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+    _file_logger.addHandler(_handler)
+
+
+class _TracedCursor(sqlite3.Cursor):
+    """Measures each statement from execute() until its rows are consumed."""
+
+    _pending = None
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        started = time.perf_counter()
+        super().execute(sql, parameters)
+        self._start(sql, started)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        started = time.perf_counter()
+        super().executemany(sql, seq_of_parameters)
+        self._start(sql, started)
+        return self
+
+    def _start(self, sql, started):
+        elapsed = time.perf_counter() - started
+        if self.description is None:
+            # No result set: the statement is complete
+            self.connection._record(sql, elapsed, max(self.rowcount, 0))
+        else:
+            self._pending = [sql, elapsed, 0]
+
+    def _finish(self):
+        pending, self._pending = self._pending, None
+        if pending is not None:
+            self.connection._record(*pending)
+
+    def _fetched(self, started, rows, exhausted):
+        if self._pending is not None:
+            self._pending[1] += time.perf_counter() - started
+            self._pending[2] += rows
+            if exhausted:
+                self._finish()
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(started, row is not None, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(started, len(rows), not rows)
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(started, len(rows), True)
+        return rows
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+
+class TracedConnection(PooledConnection):
+    """Pooled connection that times every statement run through its cursors."""
+
+    def __init__(self, database, *args, **kwargs):
+        super().__init__(database, *args, **kwargs)
+        self._path = database
+        self._log_conn = None
+        self._slow = []
+        self.set_trace_callback(self._on_statement)
+
+    def _on_statement(self, sql):
+        # Called by SQLite for every statement it runs, including those of
+        # executescript() and triggers, which the cursors cannot time.
+        with _lock:
+            _stats_for(query_shape(sql)).statements += 1
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or _TracedCursor)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def _really_close(self):
+        if self._log_conn is not None:
+            self._log_conn.close()
+        super()._really_close()
+
+    def commit(self):
+        super().commit()
+        self._flush_slow()
+
+    def rollback(self):
+        super().rollback()
+        self._flush_slow()
+
+    def _record(self, sql, duration, rows):
+        with _lock:
+            _stats_for(query_shape(sql)).add(duration, rows)
+        if duration * 1000 >= SLOW_MS:
+            self._slow.append({
+                'query': sql.strip(),
+                'ms': round(duration * 1000, 2),
+                'rows': rows,
+                'at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            })
+            self._flush_slow()
+
+    def _flush_slow(self):
+        if not self._slow:
+            return
+        if _file_logger is not None:
+            for entry in self._slow:
+                _file_logger.info(json.dumps(entry, ensure_ascii=False))
+            self._slow = []
+            return
+        # While this connection holds a transaction, a write from the log
+        # connection could only wait for it: keep the entries until commit.
+        if self.in_transaction:
+            return
+        try:
+            if self._log_conn is None:
+                self._log_conn = sqlite3.connect(self._path, timeout=LOG_TIMEOUT, isolation_level=None)
+            self._log_conn.executemany(
+                "INSERT INTO logs (user_id, action, date_action, details) VALUES (NULL, 'slow_query', ?, ?)",
+                [(e['at'], json.dumps(e, ensure_ascii=False)) for e in self._slow]
+            )
+        except sqlite3.Error:
+            # Another workstation is writing: retry at the next flush
+            del self._slow[:-MAX_PENDING]
+            return
+        self._slow = []
@@ -1,2 +1,9 @@
 # Package UI
-from .statistics import StatisticsWindow
+
+
+def __getattr__(name):
+    # Imported on demand: statistics loads matplotlib
+    if name == 'StatisticsWindow':
+        from .statistics import StatisticsWindow
+        return StatisticsWindow
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
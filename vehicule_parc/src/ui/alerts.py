@@ -1,7 +1,7 @@
 import tkinter as tk
-from tkinter import ttk
-from datetime import datetime
-from ..db import get_connection
+from tkinter import ttk, messagebox
+from ..alerts import HORIZON_DAYS, fetch_alerts
+from .background import get_executor
 
 
 class AlertsWindow:
@@ -13,13 +13,24 @@ class AlertsWindow:
         self.load_alerts()
 
     def build_ui(self):
+        control = ttk.Frame(self.root)
+        control.pack(fill='x', padx=10, pady=(6, 0))
+        ttk.Label(control, text='Horizon (jours) :').pack(side='left')
+        self.horizon = tk.Spinbox(control, from_=0, to=3650, increment=30, width=6)
+        self.horizon.delete(0, 'end')
+        self.horizon.insert(0, HORIZON_DAYS)
+        self.horizon.pack(side='left', padx=4)
+        ttk.Button(control, text='Actualiser', command=self.load_alerts).pack(side='left', padx=4)
+        self.status_label = ttk.Label(control, foreground='gray')
+        self.status_label.pack(side='left', padx=10)
+
         frame = ttk.Frame(self.root, padding=10)
         frame.pack(fill='both', expand=True)
 
         columns = ('type', 'immatriculation', 'description', 'date_echeance', 'jours_restants')
         self.tree = ttk.Treeview(frame, columns=columns, show='headings')
-        for col in columns:
-            self.tree.heading(col, text=col.capitalize())
+        for col, text in zip(columns, ('Type', 'Objet', 'Description', 'Échéance', 'Jours restants')):
+            self.tree.heading(col, text=text)
             self.tree.column(col, width=170)
 
         vsb = ttk.Scrollbar(frame, orient='vertical', command=self.tree.yview)
@@ -32,45 +43,22 @@ class AlertsWindow:
         self.tree.tag_configure('ok', background='#e6ffea')
 
     def load_alerts(self):
-        self.tree.delete(*self.tree.get_children())
-        today = datetime.today().date()
-        conn = get_connection()
-        c = conn.cursor()
+        try:
+            horizon = int(self.horizon.get())
+        except ValueError:
+            messagebox.showerror('Erreur', 'Horizon invalide')
+            return
+        self.status_label.config(text='Chargement…')
+        get_executor(self.root).submit(
+            fetch_alerts, None, horizon, on_done=self.show_alerts, on_error=self.show_error, owner=self.root
+        )
 
-        # maintenances with next due
-        c.execute('''SELECT m.id, v.immatriculation, m.type_intervention, m.date_prochaine_echeance
-                     FROM maintenances m
-                     LEFT JOIN vehicules v ON v.id = m.vehicule_id
-                     WHERE m.date_prochaine_echeance IS NOT NULL''')
-        for mid, immat, typ, due in c.fetchall():
-            try:
-                d = datetime.strptime(due, '%Y-%m-%d').date()
-            except Exception:
-                continue
-            days = (d - today).days
-            tag = 'ok'
-            if days < 0:
-                tag = 'overdue'
-            elif days <= 30:
-                tag = 'soon'
-            self.tree.insert('', 'end', values=('Maintenance', immat or '', typ or '', due, days), tags=(tag,))
-
-        # documents with due dates
-        c.execute('''SELECT d.id, v.immatriculation, d.type_document, d.date_echeance
-                     FROM documents d
-                     LEFT JOIN vehicules v ON v.id = d.vehicule_id
-                     WHERE d.date_echeance IS NOT NULL''')
-        for did, immat, doc_type, due in c.fetchall():
-            try:
-                d = datetime.strptime(due, '%Y-%m-%d').date()
-            except Exception:
-                continue
-            days = (d - today).days
-            tag = 'ok'
-            if days < 0:
-                tag = 'overdue'
-            elif days <= 30:
-                tag = 'soon'
-            self.tree.insert('', 'end', values=('Document', immat or '', doc_type or '', due, days), tags=(tag,))
+    def show_alerts(self, alerts):
+        self.status_label.config(text=f'{len(alerts)} échéance(s)')
+        self.tree.delete(*self.tree.get_children())
+        for values, tag in alerts:
+            self.tree.insert('', 'end', values=values, tags=(tag,))
 
-        conn.close()
+    def show_error(self, exc):
+        self.status_label.config(text='')
+        messagebox.showerror('Erreur', str(exc))
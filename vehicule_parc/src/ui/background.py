@@ -0,0 +1,108 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_WORKERS = 2
+POLL_MS = 50
+
+
+class Task:
+    """Handle on work submitted to a BackgroundExecutor."""
+
+    def __init__(self, executor, owner, on_done, on_error, on_progress):
+        self._executor = executor
+        self._cancelled = threading.Event()
+        self.owner = owner
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.future = None
+
+    def cancel(self):
+        """Discard the result; long jobs may also poll ``is_cancelled()`` to stop early."""
+        self._cancelled.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def is_cancelled(self):
+        return self._cancelled.is_set()
+
+    def report_progress(self, *args):
+        """Called from the worker thread; ``on_progress(*args)`` runs on the Tk thread."""
+        self._executor._results.put((self, 'progress', args))
+
+
+class BackgroundExecutor:
+    """Run database and analytics work off the Tk thread.
+
+    Workers never touch widgets: they post their outcome to a queue that the
+    Tk thread drains with ``after()`` polling, and the callbacks run there.
+    Each worker thread gets its own connection from ``db.get_connection()``.
+    """
+
+    def __init__(self, root, max_workers=MAX_WORKERS, poll_ms=POLL_MS):
+        self.root = root
+        self.poll_ms = poll_ms
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='parc-bg')
+        self._results = queue.Queue()
+        self._active = set()
+        self._polling = False
+
+    def submit(self, fn, *args, on_done=None, on_error=None, on_progress=None,
+               owner=None, with_task=False, **kwargs):
+        """Run ``fn(*args, **kwargs)`` in a worker thread and return its Task.
+
+        With ``with_task=True`` the Task is passed as first argument, for jobs
+        that report progress or check for cancellation. Callbacks are skipped
+        once the task is cancelled or ``owner`` (a widget) has been destroyed.
+        """
+        task = Task(self, owner, on_done, on_error, on_progress)
+        call_args = (task,) + args if with_task else args
+        task.future = self._pool.submit(self._run, task, fn, call_args, kwargs)
+        self._active.add(task)
+        if not self._polling:
+            self._polling = True
+            self.root.after(self.poll_ms, self._poll)
+        return task
+
+    def _run(self, task, fn, args, kwargs):
+        if task.is_cancelled():
+            return
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as exc:
+            self._results.put((task, 'error', exc))
+        else:
+            self._results.put((task, 'done', result))
+
+    def _poll(self):
+        while True:
+            try:
+                task, kind, payload = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if task.is_cancelled() or (task.owner is not None and not task.owner.winfo_exists()):
+                continue
+            if kind == 'progress':
+                if task.on_progress:
+                    task.on_progress(*payload)
+            elif kind == 'done':
+                if task.on_done:
+                    task.on_done(payload)
+            elif task.on_error:
+                task.on_error(payload)
+
+        self._active = {task for task in self._active if not task.future.done()}
+        if self._active or not self._results.empty():
+            self.root.after(self.poll_ms, self._poll)
+        else:
+            self._polling = False
+
+
+def get_executor(widget):
+    """The application's shared executor, bound to the Tk root of ``widget``."""
+    root = widget._root()
+    executor = getattr(root, '_background_executor', None)
+    if executor is None:
+        executor = root._background_executor = BackgroundExecutor(root)
+    return executor
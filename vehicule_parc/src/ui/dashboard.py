@@ -1,14 +1,8 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
-from ..models import get_dashboard_counts, find_vehicles
-from .vehicles import VehicleListWindow
-from .employees import EmployeeListWindow
-from .reservations import ReservationWindow
-from .returns import ReturnWindow
-from .maintenance import MaintenanceWindow
-from .fuel import FuelWindow
-from .alerts import AlertsWindow
-from .statistics import StatisticsWindow
+from ..models import get_dashboard_counts, find_vehicles, page_cursor
+from ..services import start_departures
+from .paging import PagedTreeLoader
 
 
 STATUS_COLORS = {
@@ -57,11 +51,13 @@ class DashboardApp:
         self.lbl_available = ttk.Label(self.top, font=('Arial', 11, 'bold'))
         self.lbl_in_use = ttk.Label(self.top, font=('Arial', 11, 'bold'))
         self.lbl_maintenance = ttk.Label(self.top, font=('Arial', 11, 'bold'))
+        self.lbl_other = ttk.Label(self.top, font=('Arial', 10))
 
         self.lbl_total.pack(side='left', padx=15)
         self.lbl_available.pack(side='left', padx=15)
         self.lbl_in_use.pack(side='left', padx=15)
         self.lbl_maintenance.pack(side='left', padx=15)
+        self.lbl_other.pack(side='left', padx=15)
 
         ttk.Button(
             self.top,
@@ -100,8 +96,11 @@ class DashboardApp:
             self.tree.heading(col, text=col.capitalize())
             self.tree.column(col, width=160)
 
+        for status, color in STATUS_COLORS.items():
+            self.tree.tag_configure(status, background=color)
+
         scrollbar = ttk.Scrollbar(tree_frame, orient='vertical', command=self.tree.yview)
-        self.tree.configure(yscroll=scrollbar.set)
+        self.pager = PagedTreeLoader(self.tree, self.fetch_vehicles, self.insert_vehicle, scrollbar=scrollbar)
 
         self.tree.pack(side='left', fill='both', expand=True)
         scrollbar.pack(side='right', fill='y')
@@ -111,6 +110,8 @@ class DashboardApp:
     # ======================================================
     def refresh_dashboard(self):
         """Recharge TOUT le dashboard"""
+        # Bookings that began since the last refresh take their vehicle out
+        start_departures()
         self.refresh_counts()
         self.load_vehicles()
 
@@ -121,6 +122,11 @@ class DashboardApp:
         self.lbl_available.config(text=f"Disponibles : {counts['available']}")
         self.lbl_in_use.config(text=f"En sortie : {counts['in_use']}")
         self.lbl_maintenance.config(text=f"En maintenance : {counts['maintenance']}")
+        by_status = counts['by_status']
+        self.lbl_other.config(
+            text=f"Immobilisés : {by_status['immobilisé']} | En panne : {by_status['panne']}"
+                 f" | À nettoyer : {by_status['à nettoyer']}"
+        )
 
         if counts['total'] > 0 and counts['available'] == 0:
             self.alert_label.config(
@@ -133,51 +139,65 @@ class DashboardApp:
     # VEHICLES LIST
     # ======================================================
     def load_vehicles(self):
-        self.tree.delete(*self.tree.get_children())
-
-        for row in find_vehicles():
-            status = row.get('statut') or 'disponible'
-            self.tree.insert(
-                '',
-                'end',
-                values=(
-                    row.get('immatriculation'),
-                    row.get('marque'),
-                    row.get('modele'),
-                    status,
-                    row.get('service_principal')
-                ),
-                tags=(status,)
-            )
+        self.pager.reset()
 
-        for status, color in STATUS_COLORS.items():
-            self.tree.tag_configure(status, background=color)
+    def fetch_vehicles(self, last_row, limit):
+        return find_vehicles(
+            order_by='immatriculation',
+            limit=limit,
+            after=page_cursor(last_row, 'immatriculation') if last_row else None
+        )
+
+    def insert_vehicle(self, row):
+        status = row.get('statut') or 'disponible'
+        self.tree.insert(
+            '',
+            'end',
+            values=(
+                row.get('immatriculation'),
+                row.get('marque'),
+                row.get('modele'),
+                status,
+                row.get('service_principal')
+            ),
+            tags=(status,)
+        )
 
     # ======================================================
     # NAVIGATION
     # ======================================================
+    # Window modules are imported on first use, so that starting the
+    # application does not pay for matplotlib and reportlab.
     def open_vehicles(self):
+        from .vehicles import VehicleListWindow
         VehicleListWindow(self.root)
 
     def open_employees(self):
+        from .employees import EmployeeListWindow
         EmployeeListWindow(self.root)
 
     def open_reservations(self):
+        from .reservations import ReservationWindow
         ReservationWindow(self.root)
 
     def open_returns(self):
+        from .returns import ReturnWindow
         ReturnWindow(self.root)
 
     def open_maintenance(self):
+        from .maintenance import MaintenanceWindow
         MaintenanceWindow(self.root)
 
     def open_fuel(self):
+        from .fuel import FuelWindow
         FuelWindow(self.root)
 
     def open_alerts(self):
+        from .alerts import AlertsWindow
         AlertsWindow(self.root)
 
     def open_statistics(self):
+        from .statistics import StatisticsWindow
         StatisticsWindow(self.root)
 
     # ======================================================
@@ -1,7 +1,11 @@
+import sqlite3
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 from datetime import datetime, timedelta
-from ..models import add_employee, find_employees
+from ..dates import parse_date, to_date
+from ..models import add_employee, find_employees, count_employees, page_cursor, EMPLOYEE_SEARCH_COLUMNS
+from .paging import PagedTreeLoader
+from .search import SearchController, text_matches
 from ..db import get_connection as db_connection
 
 # Couleurs statut permis
@@ -11,6 +15,17 @@ LICENSE_COLORS = {
     'expired': '#FF6347'
 }
 
+# (clé de tri, titre) des colonnes de la liste ; None = colonne non triable
+LIST_COLUMNS = [
+    ('matricule', 'Matricule'),
+    ('nom', 'Nom'),
+    ('prenom', 'Prénom'),
+    ('service', 'Service'),
+    (None, 'Téléphone'),
+    (None, 'Autorisé'),
+    (None, 'Permis'),
+]
+
 
 class EmployeeListWindow:
     def __init__(self, parent=None):
@@ -27,7 +42,12 @@ class EmployeeListWindow:
 
         ttk.Label(search_frame, text='Recherche:').grid(row=0, column=0, padx=5)
         self.search_var = tk.StringVar()
-        self.search_var.trace_add('write', lambda *_: self.load_employees())
+        self.search = SearchController(
+            self.root, self.search_var,
+            on_search=lambda text: self.load_employees(),
+            on_narrow=self.narrow_employees,
+            filters=self.current_filters
+        )
         ttk.Entry(search_frame, textvariable=self.search_var, width=30).grid(row=0, column=1)
 
         ttk.Label(search_frame, text='Autorisé à conduire:').grid(row=0, column=2, padx=5)
@@ -39,6 +59,7 @@ class EmployeeListWindow:
             state='readonly',
             width=10
         ).grid(row=0, column=3)
+        self.auth_var.trace_add('write', lambda *_: self.search.refresh())
 
         ttk.Button(search_frame, text='Ajouter', command=self.open_add_employee).grid(row=0, column=4, padx=5)
         ttk.Button(search_frame, text='Modifier', command=self.open_edit_employee).grid(row=0, column=5, padx=5)
@@ -47,69 +68,100 @@ class EmployeeListWindow:
         self.alert_label = ttk.Label(self.root, foreground='red')
         self.alert_label.pack(fill='x', padx=10)
 
-        columns = ('Matricule', 'Nom', 'Prénom', 'Service', 'Téléphone', 'Autorisé', 'Permis')
-        self.tree = ttk.Treeview(self.root, columns=columns, show='headings')
+        tree_frame = ttk.Frame(self.root)
+        tree_frame.pack(fill='both', expand=True, padx=10, pady=5)
+
+        columns = [label for _, label in LIST_COLUMNS]
+        self.tree = ttk.Treeview(tree_frame, columns=columns, show='headings')
 
-        for col in columns:
-            self.tree.heading(col, text=col)
-            self.tree.column(col, width=120)
+        for key, label in LIST_COLUMNS:
+            if key:
+                self.tree.heading(label, text=label, command=lambda k=key: self.sort_by(k))
+            else:
+                self.tree.heading(label, text=label)
+            self.tree.column(label, width=120)
+
+        for tag, color in LICENSE_COLORS.items():
+            self.tree.tag_configure(tag, background=color)
 
-        self.tree.pack(fill='both', expand=True, padx=10, pady=5)
+        self.order_by = 'nom'
+        self.pager = PagedTreeLoader(self.tree, self.fetch_page, self.insert_employee)
+        self.tree.pack(side='left', fill='both', expand=True)
+        self.pager.scrollbar.pack(side='right', fill='y')
 
         self.status_bar = ttk.Label(self.root, relief='sunken')
         self.status_bar.pack(fill='x')
 
     # ================= DATA =================
-    def load_employees(self):
-        self.tree.delete(*self.tree.get_children())
-
-        employees = find_employees(filter_text=self.search_var.get() or None)
-
+    def current_filters(self):
         if self.auth_var.get() == 'Oui':
-            employees = [e for e in employees if e['autorise_conduire']]
-        elif self.auth_var.get() == 'Non':
-            employees = [e for e in employees if not e['autorise_conduire']]
+            return {'autorise_conduire': True}
+        if self.auth_var.get() == 'Non':
+            return {'autorise_conduire': False}
+        return {}
 
+    def load_employees(self):
+        # Pages fetched later while scrolling must match this first one,
+        # whatever is typed in the meantime.
+        self.query_text = self.search_var.get() or None
+        self.alerts = []
+        self.alert_label.config(text='')
+        self.pager.reset()
+        total = count_employees(self.query_text, self.current_filters())
+        self.status_bar.config(text=f'Total employés : {total}')
+
+    def narrow_employees(self, text):
+        self.alerts = []
+        self.alert_label.config(text='')
+        if not self.pager.narrow(lambda e: text_matches(e, EMPLOYEE_SEARCH_COLUMNS, text)):
+            return False
+        self.query_text = text or None
+        self.status_bar.config(text=f'Total employés : {len(self.pager.rows)}')
+        return True
+
+    def fetch_page(self, last_row, limit):
+        return find_employees(
+            filter_text=self.query_text,
+            filters=self.current_filters() or None,
+            order_by=self.order_by,
+            limit=limit,
+            after=page_cursor(last_row, self.order_by) if last_row else None
+        )
+
+    def insert_employee(self, emp):
         today = datetime.now().date()
         warning = today + timedelta(days=30)
-        alerts = []
-
-        for emp in employees:
-            tag = 'valid'
-            permit = emp.get('date_validite_permis')
-
-            if permit:
-                try:
-                    exp = datetime.strptime(permit, '%Y-%m-%d').date()
-                    if exp < today:
-                        tag = 'expired'
-                        alerts.append(f"{emp['nom']} {emp['prenom']} : permis expiré")
-                    elif exp <= warning:
-                        tag = 'warning'
-                except:
-                    pass
-
-            self.tree.insert(
-                '',
-                'end',
-                iid=str(emp['id']),  # ID BDD
-                values=(
-                    emp['matricule'],
-                    emp['nom'],
-                    emp['prenom'],
-                    emp['service'],
-                    emp['telephone'],
-                    'Oui' if emp['autorise_conduire'] else 'Non',
-                    permit or 'N/A'
-                ),
-                tags=(tag,)
-            )
-
-        for tag, color in LICENSE_COLORS.items():
-            self.tree.tag_configure(tag, background=color)
-
-        self.alert_label.config(text=' | '.join(alerts[:3]))
-        self.status_bar.config(text=f'Total employés : {len(employees)}')
+        tag = 'valid'
+        permit = emp.get('date_validite_permis')
+        exp = to_date(permit)
+
+        if exp:
+            if exp < today:
+                tag = 'expired'
+                self.alerts.append(f"{emp['nom']} {emp['prenom']} : permis expiré")
+                self.alert_label.config(text=' | '.join(self.alerts[:3]))
+            elif exp <= warning:
+                tag = 'warning'
+
+        self.tree.insert(
+            '',
+            'end',
+            iid=str(emp['id']),  # ID BDD
+            values=(
+                emp['matricule'],
+                emp['nom'],
+                emp['prenom'],
+                emp['service'],
+                emp['telephone'],
+                'Oui' if emp['autorise_conduire'] else 'Non',
+                permit or 'N/A'
+            ),
+            tags=(tag,)
+        )
+
+    def sort_by(self, key):
+        self.order_by = key
+        self.load_employees()
 
     # ================= SELECTION =================
     def get_selected_employee(self):
@@ -149,8 +201,16 @@ class EmployeeListWindow:
         ):
             conn = db_connection()
             c = conn.cursor()
-            c.execute('DELETE FROM employes WHERE id = ?', (emp['id'],))
-            conn.commit()
+            try:
+                c.execute('DELETE FROM employes WHERE id = ?', (emp['id'],))
+                conn.commit()
+            except sqlite3.IntegrityError:
+                conn.close()
+                messagebox.showerror(
+                    'Suppression impossible',
+                    'Cet employé est référencé par des sorties ou des ravitaillements'
+                )
+                return
             conn.close()
             self.load_employees()
             messagebox.showinfo('Succès', 'Employé supprimé')
@@ -208,6 +268,11 @@ class AddEditEmployeeWindow:
     def save(self):
         data = {k: e.get() or None for k, e in self.entries.items()}
         data['autorise_conduire'] = self.auth_var.get()
+        try:
+            data['date_validite_permis'] = parse_date(data.get('date_validite_permis'), 'Validité permis')
+        except ValueError as e:
+            messagebox.showerror('Erreur', str(e))
+            return
 
         conn = db_connection()
         c = conn.cursor()
@@ -1,7 +1,10 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
+from ..dates import parse_date, today
 from ..db import get_connection
 from ..models import find_vehicles, find_employees
+from ..anomalies import ANOMALY_LABELS, check_refuel
+from ..rollups import record_refuels
 
 
 class FuelWindow:
@@ -68,7 +71,11 @@ class FuelWindow:
             return
         veh_id = self.veh_map[veh_sel]
         emp_id = self.emp_map.get(emp_sel)
-        date = self.entry_date.get().strip()
+        try:
+            date = parse_date(self.entry_date.get()) or today()
+        except ValueError as e:
+            messagebox.showerror('Erreur', str(e))
+            return
         try:
             qty = float(self.entry_qty.get().strip() or 0.0)
         except ValueError:
@@ -90,20 +97,19 @@ class FuelWindow:
         c = conn.cursor()
         c.execute('''INSERT INTO ravitaillements (vehicule_id, employe_id, date, quantite_litres, cout, station, kilometrage)
                      VALUES (?,?,?,?,?,?,?)''', (veh_id, emp_id, date, qty, cost, station, km))
-
-        # compute consumption average since last refill if possible
-        c.execute('SELECT kilometrage FROM ravitaillements WHERE vehicule_id = ? ORDER BY id DESC LIMIT 2', (veh_id,))
-        rows = c.fetchall()
+        refuel_id = c.lastrowid
+        record_refuels(conn, refuel_id)
+
+        # consumption since the previous fill in odometer order
+        c.execute('''SELECT kilometrage FROM ravitaillements
+                     WHERE vehicule_id = ? AND id <> ? AND kilometrage < ?
+                     ORDER BY kilometrage DESC LIMIT 1''', (veh_id, refuel_id, km))
+        row = c.fetchone()
         avg_msg = ''
-        if len(rows) >= 2:
-            try:
-                last_km = rows[1][0]
-                distance = km - last_km
-                if distance > 0:
-                    cons = (qty / distance) * 100
-                    avg_msg = f'Consommation moyenne calculée: {cons:.2f} L/100 km'
-            except Exception:
-                avg_msg = ''
+        if row and qty > 0:
+            cons = (qty / (km - row[0])) * 100
+            avg_msg = f'Consommation moyenne calculée: {cons:.2f} L/100 km'
+        warnings = check_refuel(conn, refuel_id)
 
         # update vehicle kilometrage if greater
         c.execute('SELECT kilometrage_actuel FROM vehicules WHERE id = ?', (veh_id,))
@@ -113,5 +119,10 @@ class FuelWindow:
 
         conn.commit()
         conn.close()
-        messagebox.showinfo('Succès', 'Ravitaillement enregistré' + ('\n' + avg_msg if avg_msg else ''))
+        msg = 'Ravitaillement enregistré' + ('\n' + avg_msg if avg_msg else '')
+        if warnings:
+            lines = [ANOMALY_LABELS[kind] + (f' : {details}' if details else '') for kind, details in warnings]
+            messagebox.showwarning('Anomalies', msg + '\n\n' + '\n'.join(lines))
+        else:
+            messagebox.showinfo('Succès', msg)
         self.root.destroy()
@@ -1,9 +1,11 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
+from ..dates import parse_date, today
 from ..db import get_connection
 from ..models import find_vehicles
+from ..rollups import record_maintenance
 
-INTERVENTION_TYPES = ['Vidange', 'Pneus', 'Freins', 'Réparation', 'Contrôle technique', 'Autre']
+INTERVENTION_TYPES = ['Vidange', 'Révision', 'Pneus', 'Freins', 'Réparation', 'Contrôle technique', 'Autre']
 
 
 class MaintenanceWindow:
@@ -73,7 +75,12 @@ class MaintenanceWindow:
             return
         veh_id = self.vehicles[sel]
         type_int = self.cmb_type.get() or 'Autre'
-        date = self.entry_date.get().strip()
+        try:
+            date = parse_date(self.entry_date.get()) or today()
+            next_due = parse_date(self.entry_next.get(), 'Prochaine échéance')
+        except ValueError as e:
+            messagebox.showerror('Erreur', str(e))
+            return
         try:
             km = int(self.entry_km.get().strip() or 0)
         except ValueError:
@@ -86,12 +93,12 @@ class MaintenanceWindow:
             return
         prest = self.entry_prest.get().strip()
         remarques = self.txt_rem.get('1.0', 'end').strip()
-        next_due = self.entry_next.get().strip() or None
 
         conn = get_connection()
         c = conn.cursor()
         c.execute('''INSERT INTO maintenances (vehicule_id, date, type_intervention, kilometrage, cout, prestataire, remarques, date_prochaine_echeance)
                      VALUES (?,?,?,?,?,?,?,?)''', (veh_id, date, type_int, km, cost, prest, remarques, next_due))
+        record_maintenance(conn, c.lastrowid)
         if self.mark_maintenance_var.get():
             c.execute('UPDATE vehicules SET statut = ? WHERE id = ?', ('en maintenance', veh_id))
         conn.commit()
@@ -0,0 +1,68 @@
+from tkinter import ttk
+
+PAGE_SIZE = 200
+# Fetch the next page once the visible part of the list gets this close to the end
+PREFETCH_THRESHOLD = 0.9
+
+
+class PagedTreeLoader:
+    """Fill a Treeview page by page as the user scrolls down.
+
+    ``fetch_page(last_row, limit)`` returns the rows following ``last_row``
+    (None for the first page); ``insert_row(row)`` adds one row to the tree.
+    Rows already loaded are kept in ``rows``; ``complete`` tells whether the
+    last page has been reached.
+    """
+
+    def __init__(self, tree, fetch_page, insert_row, scrollbar=None, page_size=PAGE_SIZE):
+        self.tree = tree
+        self.fetch_page = fetch_page
+        self.insert_row = insert_row
+        self.page_size = page_size
+        self.rows = []
+        self.complete = False
+        self._loading = False
+
+        if scrollbar is None:
+            scrollbar = ttk.Scrollbar(tree.master, orient='vertical', command=tree.yview)
+        self.scrollbar = scrollbar
+        tree.configure(yscrollcommand=self._on_scroll)
+
+    def reset(self):
+        """Clear the tree and load the first page."""
+        self.tree.delete(*self.tree.get_children())
+        self.rows = []
+        self.complete = False
+        self.load_more()
+
+    def load_more(self):
+        if self.complete or self._loading:
+            return
+        self._loading = True
+        try:
+            last = self.rows[-1] if self.rows else None
+            page = self.fetch_page(last, self.page_size)
+            for row in page:
+                self.insert_row(row)
+            self.rows.extend(page)
+            self.complete = len(page) < self.page_size
+        finally:
+            self._loading = False
+
+    def narrow(self, predicate):
+        """Keep only the loaded rows matching ``predicate``, without querying.
+
+        Returns False (and changes nothing) when not every row is loaded yet.
+        """
+        if not self.complete:
+            return False
+        self.rows = [row for row in self.rows if predicate(row)]
+        self.tree.delete(*self.tree.get_children())
+        for row in self.rows:
+            self.insert_row(row)
+        return True
+
+    def _on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        if not self.complete and float(last) >= PREFETCH_THRESHOLD:
+            self.tree.after_idle(self.load_more)
@@ -1,8 +1,10 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 from datetime import datetime, timedelta
-from ..models import find_vehicles, find_employees, get_connection
-from ..db import get_connection as db_connection
+from ..dates import DATETIME_FORMAT, parse_date, parse_time, to_datetime
+from ..models import find_employees
+from ..scheduling import ConflictError, available_vehicles
+from ..services import reserve_vehicle
 
 MOTIFS = [
     'Déplacement professionnel',
@@ -45,7 +47,6 @@ class ReservationWindow:
                                           state='readonly', width=70)
         self.vehicle_combo.pack(fill='x', pady=5)
         self.vehicle_combo.bind('<<ComboboxSelected>>', self.on_vehicle_selected)
-        self.load_available_vehicles()
 
         # Vehicle details
         ttk.Label(vehicle_frame, text='Détails:').pack(anchor='w', pady=5)
@@ -84,10 +85,10 @@ class ReservationWindow:
         date_time_frame = ttk.Frame(trip_frame)
         date_time_frame.grid(row=2, column=1, sticky='ew', pady=5)
         self.date_sortie_var = tk.StringVar(value=datetime.now().strftime('%Y-%m-%d'))
-        ttk.Entry(date_time_frame, textvariable=self.date_sortie_var, width=15).pack(side='left', padx=5)
+        self._period_entry(date_time_frame, self.date_sortie_var, 15)
         ttk.Label(date_time_frame, text='Heure:').pack(side='left', padx=5)
         self.time_sortie_var = tk.StringVar(value=datetime.now().strftime('%H:%M'))
-        ttk.Entry(date_time_frame, textvariable=self.time_sortie_var, width=10).pack(side='left', padx=5)
+        self._period_entry(date_time_frame, self.time_sortie_var, 10)
 
         # Expected return date and time
         ttk.Label(trip_frame, text='Date retour prévue *').grid(row=3, column=0, sticky='w', pady=5)
@@ -95,10 +96,10 @@ class ReservationWindow:
         date_time_frame2.grid(row=3, column=1, sticky='ew', pady=5)
         tomorrow = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d')
         self.date_retour_var = tk.StringVar(value=tomorrow)
-        ttk.Entry(date_time_frame2, textvariable=self.date_retour_var, width=15).pack(side='left', padx=5)
+        self._period_entry(date_time_frame2, self.date_retour_var, 15)
         ttk.Label(date_time_frame2, text='Heure:').pack(side='left', padx=5)
         self.time_retour_var = tk.StringVar(value='18:00')
-        ttk.Entry(date_time_frame2, textvariable=self.time_retour_var, width=10).pack(side='left', padx=5)
+        self._period_entry(date_time_frame2, self.time_retour_var, 10)
 
         # Initial mileage
         ttk.Label(trip_frame, text='Kilométrage au départ *').grid(row=4, column=0, sticky='w', pady=5)
@@ -118,11 +119,35 @@ class ReservationWindow:
         ttk.Button(button_frame, text='Réserver et Sortir', command=self.save_reservation).pack(side='left', padx=5)
         ttk.Button(button_frame, text='Annuler', command=self.window.destroy).pack(side='left', padx=5)
 
-    def load_available_vehicles(self):
-        """Load only available vehicles"""
-        vehicles = find_vehicles()
-        available = [v for v in vehicles if v.get('statut') == 'disponible']
-        
+        # The vehicle list depends on the period, entered above it
+        self.load_available_vehicles(warn=True)
+
+    def _period_entry(self, parent, variable, width):
+        entry = ttk.Entry(parent, textvariable=variable, width=width)
+        entry.pack(side='left', padx=5)
+        entry.bind('<FocusOut>', lambda e: self.load_available_vehicles())
+
+    def _period(self):
+        """(start, end) entered, as stored datetimes; ValueError if unreadable."""
+        start = to_datetime(parse_date(self.date_sortie_var.get(), required=True),
+                            parse_time(self.time_sortie_var.get(), required=True))
+        end = to_datetime(parse_date(self.date_retour_var.get(), required=True),
+                          parse_time(self.time_retour_var.get(), required=True))
+        return start.strftime(DATETIME_FORMAT), end.strftime(DATETIME_FORMAT)
+
+    def load_available_vehicles(self, warn=False):
+        """Load the vehicles free over the period entered"""
+        try:
+            start, end = self._period()
+        except ValueError:
+            return
+        if end <= start:
+            return
+        if (start, end) == getattr(self, 'loaded_period', None):
+            return
+        self.loaded_period = (start, end)
+        available = available_vehicles(start, end)
+
         display_list = []
         self.vehicle_map = {}
         
@@ -132,9 +157,12 @@ class ReservationWindow:
             self.vehicle_map[display] = v
         
         self.vehicle_combo['values'] = display_list
-        
-        if not display_list:
-            messagebox.showwarning('Aucun véhicule', 'Aucun véhicule disponible actuellement')
+        if self.vehicle_var.get() not in self.vehicle_map:
+            self.vehicle_var.set('')
+            self.vehicle_details.config(text='')
+
+        if warn and not display_list:
+            messagebox.showwarning('Aucun véhicule', 'Aucun véhicule disponible sur cette période')
 
     def load_authorized_employees(self):
         """Load only authorized employees"""
@@ -182,14 +210,19 @@ class ReservationWindow:
             messagebox.showerror('Erreur', 'Veuillez entrer le kilométrage au départ')
             return False
         
-        # Validate dates
+        # Validate dates, kept in stored form for save_reservation
         try:
-            datetime.strptime(self.date_sortie_var.get(), '%Y-%m-%d')
-            datetime.strptime(self.date_retour_var.get(), '%Y-%m-%d')
-            datetime.strptime(self.time_sortie_var.get(), '%H:%M')
-            datetime.strptime(self.time_retour_var.get(), '%H:%M')
-        except ValueError:
-            messagebox.showerror('Erreur', 'Format de date/heure invalide (YYYY-MM-DD et HH:MM)')
+            self.schedule = (
+                parse_date(self.date_sortie_var.get(), 'Date de sortie', required=True),
+                parse_time(self.time_sortie_var.get(), 'Heure de sortie', required=True),
+                parse_date(self.date_retour_var.get(), 'Date de retour', required=True),
+                parse_time(self.time_retour_var.get(), 'Heure de retour', required=True),
+            )
+        except ValueError as e:
+            messagebox.showerror('Erreur', str(e))
+            return False
+        if to_datetime(*self.schedule[2:]) <= to_datetime(*self.schedule[:2]):
+            messagebox.showerror('Erreur', 'Le retour doit être postérieur à la sortie')
             return False
         
         # Validate mileage is numeric
@@ -210,40 +243,19 @@ class ReservationWindow:
             vehicle = self.vehicle_map[self.vehicle_var.get()]
             employee = self.employee_map[self.employee_var.get()]
             
-            conn = db_connection()
-            c = conn.cursor()
-            
-            # Insert reservation
-            date_sortie_prevue = f"{self.date_sortie_var.get()} {self.time_sortie_var.get()}:00"
-            date_retour_prevue = f"{self.date_retour_var.get()} {self.time_retour_var.get()}:00"
-            
-            c.execute('''INSERT INTO sorties_reservations (
-                vehicule_id, employe_id, date_sortie_prevue, heure_sortie_prevue,
-                date_retour_prevue, heure_retour_prevue, km_depart, motif, destination,
-                statut
-            ) VALUES (?,?,?,?,?,?,?,?,?,?)''', (
-                vehicle.get('id'),
-                employee.get('id'),
-                self.date_sortie_var.get(),
-                self.time_sortie_var.get(),
-                self.date_retour_var.get(),
-                self.time_retour_var.get(),
-                int(self.km_depart_var.get()),
-                self.motif_var.get(),
-                self.destination_var.get(),
-                'réservée'
-            ))
-            
-            # Update vehicle status to 'en sortie'
-            c.execute('UPDATE vehicules SET statut = ? WHERE id = ?', 
-                     ('en sortie', vehicle.get('id')))
-            
-            conn.commit()
-            conn.close()
-            
+            # Availability is checked again when writing: another desk may
+            # have booked the vehicle since the list was loaded
+            reserve_vehicle(vehicle.get('id'), employee.get('id'), self.schedule,
+                            int(self.km_depart_var.get()), self.motif_var.get(),
+                            self.destination_var.get())
+
             messagebox.showinfo('Succès', 
                 f'Réservation créée!\nVéhicule {vehicle.get("immatriculation")} réservé pour {employee.get("nom")} {employee.get("prenom")}')
             self.window.destroy()
-            
+
+        except ConflictError as e:
+            messagebox.showerror('Véhicule indisponible', str(e))
+            self.loaded_period = None
+            self.load_available_vehicles()
         except Exception as e:
             messagebox.showerror('Erreur', f'Erreur lors de la réservation: {str(e)}')
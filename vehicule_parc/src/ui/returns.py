@@ -1,14 +1,26 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 from datetime import datetime
-from ..models import find_vehicles, find_employees, get_connection
-from ..db import get_connection as db_connection
+from ..dates import now_time, to_datetime, today
+from ..models import find_active_rental_filters, find_active_rentals
+from ..scheduling import ConflictError
+from ..services import close_return
+from .background import get_executor
 
 FUEL_LEVELS = ['Réserve', 'Faible (1/4)', 'Moyen (1/2)', 'Bon (3/4)', 'Plein']
 VEHICLE_CONDITIONS = ['Propre', 'Légèrement sale', 'Très sale']
 VEHICLE_STATUS = ['disponible', 'à nettoyer', 'en maintenance']
 
 
+# Rows shown at most; the filters narrow the list down
+RENTALS_LIMIT = 500
+
+
+def fetch_active_rentals(employee_id, vehicle_id):
+    """Open trips matching the filters (ids or None); runs in a worker thread"""
+    return find_active_rentals(vehicle_id, employee_id, RENTALS_LIMIT + 1)
+
+
 class ReturnWindow:
     """Window for vehicle return/check-in"""
     def __init__(self, parent=None):
@@ -16,6 +28,11 @@ class ReturnWindow:
         self.window.title('Retour de Véhicule')
         self.window.geometry('900x750')
         self.selected_return = None
+        self.rentals_task = None
+        self.rentals = {}
+        # Filled by load_filter_options once the query is back
+        self.employee_filter_ids = {}
+        self.vehicle_filter_ids = {}
         self.build_ui()
         self.load_active_rentals()
 
@@ -53,7 +70,7 @@ class ReturnWindow:
         self.load_filter_options()
 
         # Active rentals list
-        list_frame = ttk.LabelFrame(main_frame, text='Sorties en Cours', padding=10)
+        self.list_frame = list_frame = ttk.LabelFrame(main_frame, text='Sorties en Cours', padding=10)
         list_frame.pack(fill='both', expand=True, pady=10)
 
         columns = ('Immatriculation', 'Employé', 'Motif', 'Date Départ', 'Destination')
@@ -155,57 +172,54 @@ class ReturnWindow:
         ttk.Button(button_frame, text='Annuler', command=self.window.destroy).pack(side='left', padx=5)
 
     def load_filter_options(self):
-        """Load employee and vehicle options for filters"""
-        employees = find_employees()
-        employee_list = [''] + [f"{e.get('matricule')} - {e.get('nom')} {e.get('prenom')}" for e in employees]
-        self.employee_filter_combo['values'] = employee_list
-
-        vehicles = find_vehicles()
-        vehicle_list = [''] + [f"{v.get('immatriculation')} - {v.get('marque')} {v.get('modele')}" for v in vehicles]
-        self.vehicle_filter_combo['values'] = vehicle_list
+        """Load the employees and vehicles that have open trips in the background"""
+        get_executor(self.window).submit(
+            find_active_rental_filters,
+            on_done=self.show_filter_options, on_error=self.show_error, owner=self.window
+        )
+
+    def show_filter_options(self, options):
+        vehicles, employees = options
+        self.employee_filter_ids = {
+            f"{e.get('matricule')} - {e.get('nom')} {e.get('prenom')}": e['id'] for e in employees
+        }
+        self.employee_filter_combo['values'] = [''] + list(self.employee_filter_ids)
+
+        self.vehicle_filter_ids = {
+            f"{v.get('immatriculation')} - {v.get('marque')} {v.get('modele')}": v['id'] for v in vehicles
+        }
+        self.vehicle_filter_combo['values'] = [''] + list(self.vehicle_filter_ids)
 
     def load_active_rentals(self):
-        """Load active rentals (status 'en sortie' or 'réservée')"""
+        """Load active rentals (status 'en sortie' or 'réservée') in the background"""
+        if self.rentals_task:
+            self.rentals_task.cancel()
+        self.rentals_task = get_executor(self.window).submit(
+            fetch_active_rentals,
+            self.employee_filter_ids.get(self.employee_filter_var.get()),
+            self.vehicle_filter_ids.get(self.vehicle_filter_var.get()),
+            on_done=self.show_active_rentals, on_error=self.show_error, owner=self.window
+        )
+
+    def show_active_rentals(self, rentals):
+        self.rentals_task = None
         for item in self.tree.get_children():
             self.tree.delete(item)
-
-        conn = db_connection()
-        c = conn.cursor()
-
-        c.execute('''SELECT sr.id, sr.vehicule_id, sr.employe_id, sr.motif, sr.destination,
-                            COALESCE(sr.date_sortie_reelle, sr.date_sortie_prevue) as date_out,
-                            COALESCE(sr.heure_sortie_reelle, sr.heure_sortie_prevue) as time_out,
-                            sr.km_depart,
-                            v.immatriculation, v.marque, v.modele, e.nom, e.prenom
-                     FROM sorties_reservations sr
-                     JOIN vehicules v ON sr.vehicule_id = v.id
-                     JOIN employes e ON sr.employe_id = e.id
-                     WHERE sr.statut IN ('en sortie', 'réservée')
-                     ORDER BY sr.date_sortie_prevue DESC''')
-
-        rentals = c.fetchall()
-        employee_filter = self.employee_filter_var.get()
-        vehicle_filter = self.vehicle_filter_var.get()
-
+        truncated = len(rentals) > RENTALS_LIMIT
+        rentals = rentals[:RENTALS_LIMIT]
+        # Kept for on_rental_selected, which then needs no query
+        self.rentals = {str(r['id']): r for r in rentals}
         for rental in rentals:
-            rental_id, veh_id, emp_id, motif, destination, date_out, time_out, km_out, immat, marque, modele, nom, prenom = rental
-
-            # Apply employee filter
-            if employee_filter and employee_filter.strip() != '':
-                display_emp = f"{nom} {prenom}"
-                if employee_filter not in display_emp and employee_filter not in str(emp_id):
-                    continue
-
-            # Apply vehicle filter
-            if vehicle_filter and vehicle_filter.strip() != '':
-                if vehicle_filter not in immat:
-                    continue
-
-            date_str = date_out if date_out else 'N/A'
+            values = (rental['immatriculation'], f"{rental['nom']} {rental['prenom']}", rental['motif'],
+                      rental['date_sortie'] or 'N/A', rental['destination'])
             # Use rental id as tree iid so we can retrieve it reliably later
-            self.tree.insert('', 'end', iid=str(rental_id), values=(immat, f"{nom} {prenom}", motif, date_str, destination))
+            self.tree.insert('', 'end', iid=str(rental['id']), values=values)
+        self.list_frame.config(text=f'Sorties en Cours ({RENTALS_LIMIT} premières, filtrer pour affiner)'
+                               if truncated else 'Sorties en Cours')
 
-        conn.close()
+    def show_error(self, exc):
+        self.rentals_task = None
+        messagebox.showerror('Erreur', f'Erreur lors du chargement des sorties: {exc}')
 
     def on_rental_selected(self, event=None):
         """Load selected rental details"""
@@ -213,31 +227,15 @@ class ReturnWindow:
         if not selection:
             return
 
-        rental_iid = selection[0]
-
-        conn = db_connection()
-        c = conn.cursor()
-
-        c.execute('''SELECT sr.id, sr.vehicule_id, sr.employe_id, sr.motif,
-                            COALESCE(sr.date_sortie_reelle, sr.date_sortie_prevue) as date_out,
-                            COALESCE(sr.heure_sortie_reelle, sr.heure_sortie_prevue) as time_out,
-                            sr.km_depart, sr.destination,
-                            v.immatriculation, v.marque, v.modele, e.nom, e.prenom
-                     FROM sorties_reservations sr
-                     JOIN vehicules v ON sr.vehicule_id = v.id
-                     JOIN employes e ON sr.employe_id = e.id
-                     WHERE sr.id = ? AND sr.statut IN ('en sortie', 'réservée')
-                     LIMIT 1''', (int(rental_iid),))
-
-        rental = c.fetchone()
-        conn.close()
-
+        rental = self.rentals.get(selection[0])
         if rental:
-            rental_id, veh_id, emp_id, motif, date_out, time_out, km_out, destination, immat, marque, modele, nom, prenom = rental
+            immat, marque, modele = rental['immatriculation'], rental['marque'], rental['modele']
+            nom, prenom, motif = rental['nom'], rental['prenom'], rental['motif']
+            date_out, time_out, km_out = rental['date_sortie'], rental['heure_sortie'], rental['km_depart']
             self.selected_return = {
-                'id': rental_id,
-                'vehicle_id': veh_id,
-                'employee_id': emp_id,
+                'id': rental['id'],
+                'vehicle_id': rental['vehicule_id'],
+                'employee_id': rental['employe_id'],
                 'immatriculation': immat,
                 'marque': marque,
                 'modele': modele,
@@ -246,7 +244,7 @@ class ReturnWindow:
                 'date_sortie': date_out,
                 'time_sortie': time_out,
                 'km_depart': km_out,
-                'destination': destination
+                'destination': rental['destination']
             }
 
             # Display rental info
@@ -280,20 +278,16 @@ class ReturnWindow:
             date_out = self.selected_return['date_sortie']
             time_out = self.selected_return['time_sortie']
             
-            if date_out and time_out:
-                try:
-                    departure = datetime.strptime(f"{date_out} {time_out}", '%Y-%m-%d %H:%M')
-                    now = datetime.now()
-                    delta = now - departure
-                    hours = delta.total_seconds() / 3600
-                    days = delta.days
-                    if days > 0:
-                        duration_str = f"{days}j {int(hours % 24)}h"
-                    else:
-                        duration_str = f"{int(hours)}h {int((hours % 1) * 60)}min"
-                    self.duration_label.config(text=duration_str)
-                except:
-                    pass
+            departure = to_datetime(date_out, time_out)
+            if departure:
+                delta = datetime.now() - departure
+                hours = delta.total_seconds() / 3600
+                days = delta.days
+                if days > 0:
+                    duration_str = f"{days}j {int(hours % 24)}h"
+                else:
+                    duration_str = f"{int(hours)}h {int((hours % 1) * 60)}min"
+                self.duration_label.config(text=duration_str)
         except ValueError:
             self.distance_label.config(text='Km invalide')
 
@@ -352,50 +346,28 @@ class ReturnWindow:
             return
 
         try:
-            conn = db_connection()
-            c = conn.cursor()
-
-            # Update rental record
-            now = datetime.now()
-            km_retour = int(self.km_retour_var.get())
-            
-            c.execute('''UPDATE sorties_reservations 
-                        SET date_retour_reelle = ?,
-                            heure_retour_reelle = ?,
-                            km_retour = ?,
-                            etat_retour = ?,
-                            niveau_carburant_retour = ?,
-                            statut = ?
-                        WHERE id = ?''', (
-                now.strftime('%Y-%m-%d'),
-                now.strftime('%H:%M:%S'),
-                km_retour,
+            close_return(
+                self.selected_return['id'],
+                int(self.km_retour_var.get()),
                 self.condition_var.get(),
                 self.fuel_var.get(),
-                'clôturée',
-                self.selected_return['id']
-            ))
-
-            # Update vehicle mileage and status
-            c.execute('''UPDATE vehicules 
-                        SET kilometrage_actuel = ?,
-                            statut = ?
-                        WHERE id = ?''', (
-                km_retour,
                 self.new_status_var.get(),
-                self.selected_return['vehicle_id']
-            ))
-
-            conn.commit()
-            conn.close()
+                today(),
+                now_time()
+            )
 
             messagebox.showinfo('Succès', 
                 f'Retour clôturé!\nVéhicule {self.selected_return["immatriculation"]} - Nouveau statut: {self.new_status_var.get()}')
             
             # Refresh list
             self.load_active_rentals()
+            self.load_filter_options()
+            self.selected_return = None
+
+        except ConflictError as e:
+            messagebox.showerror('Retour impossible', str(e))
+            self.load_active_rentals()
             self.selected_return = None
-            
         except Exception as e:
             import traceback
             traceback.print_exc()
@@ -0,0 +1,56 @@
+SEARCH_DELAY_MS = 300
+
+
+def text_matches(row, columns, text):
+    """In-memory equivalent of the models' search: case-insensitive substring."""
+    needle = text.casefold()
+    return any(needle in str(row.get(col) or '').casefold() for col in columns)
+
+
+class SearchController:
+    """Run a list window's search once typing pauses, not on every keystroke.
+
+    ``on_search(text)`` queries the database. ``on_narrow(text)`` filters the
+    rows already displayed and returns False when it cannot (e.g. the list
+    was not fully loaded). It is tried first whenever the new text contains
+    the previous one and ``filters()`` (the window's other criteria, such as
+    its comboboxes) returns what it did for the previous search, since the
+    new results are then a subset of the current ones.
+    """
+
+    def __init__(self, widget, var, on_search, on_narrow=None, filters=None, delay_ms=SEARCH_DELAY_MS):
+        self.widget = widget
+        self.var = var
+        self.on_search = on_search
+        self.on_narrow = on_narrow
+        self.filters = filters or (lambda: None)
+        self.delay_ms = delay_ms
+        self.last_text = None
+        self.last_filters = None
+        self._after_id = None
+        var.trace_add('write', self._on_change)
+
+    def _on_change(self, *_):
+        if self._after_id is not None:
+            self.widget.after_cancel(self._after_id)
+        self._after_id = self.widget.after(self.delay_ms, self._fire)
+
+    def _fire(self):
+        self._after_id = None
+        text, filters = self.var.get(), self.filters()
+        if (text, filters) == (self.last_text, self.last_filters):
+            return
+
+        previous, previous_filters = self.last_text, self.last_filters
+        self.last_text, self.last_filters = text, filters
+        if (self.on_narrow and previous is not None and filters == previous_filters
+                and previous.casefold() in text.casefold() and self.on_narrow(text)):
+            return
+        self.on_search(text)
+
+    def refresh(self):
+        """Re-run the current search against the database (after an edit, a filter change...)."""
+        if self._after_id is not None:
+            self.widget.after_cancel(self._after_id)
+        self.last_text = None
+        self._fire()
@@ -1,24 +1,35 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-import sqlite3
-from ..db import get_connection
-from matplotlib.figure import Figure
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from matplotlib.backends.backend_pdf import PdfPages
-import matplotlib.pyplot as plt
-import csv
-import datetime
+from ..dates import parse_date, to_date
+from ..reporting import compute_statistics, compute_trends
+from ..analytics import fleet_summary
+from ..export import export_report
+from .background import get_executor
+import math
 
 
 def _parse_date(s):
-    if not s:
-        return None
     try:
-        return datetime.datetime.strptime(s, '%Y-%m-%d').date()
-    except Exception:
+        return to_date(parse_date(s))
+    except ValueError:
         return None
 
 
+# Trend choices: label -> key of reporting.TREND_PERIODS / TREND_GROUPS / measure column
+TREND_PERIODS = {'Semaine': 'week', 'Mois': 'month', 'Trimestre': 'quarter', 'Année': 'year'}
+TREND_GROUPS = {'Parc': 'fleet', 'Véhicule': 'vehicle', 'Type': 'type', 'Service': 'service'}
+TREND_MEASURES = {
+    'Coût carburant': 'cout_carburant', 'Coût maintenance': 'cout_maintenance',
+    'Kilométrage': 'km', 'Litres': 'litres', 'Sorties': 'nb_sorties',
+}
+# Series drawn on a trend chart; the others are summed into 'Autres'
+TREND_SERIES = 8
+
+
+def _export_csv(task, path, start, end):
+    return export_report(path, start, end, progress=task.report_progress, cancelled=task.is_cancelled)
+
+
 class StatisticsWindow(tk.Toplevel):
     """Fenêtre de statistiques et rapports"""
     def __init__(self, master=None):
@@ -38,20 +49,30 @@ class StatisticsWindow(tk.Toplevel):
         self.end_entry = ttk.Entry(control, width=12)
         self.end_entry.pack(side='left', padx=4)
 
-        ttk.Button(control, text='Calculer', command=self.calculate).pack(side='left', padx=8)
+        self.btn_calculate = ttk.Button(control, text='Calculer', command=self.calculate)
+        self.btn_calculate.pack(side='left', padx=8)
         ttk.Button(control, text='Exporter CSV', command=self.export_csv).pack(side='left')
         ttk.Button(control, text='Exporter PDF', command=self.export_pdf).pack(side='left', padx=6)
 
+        self.status_label = ttk.Label(control, foreground='gray')
+        self.status_label.pack(side='left', padx=8)
+
         # Notebook for charts / tables
         self.nb = ttk.Notebook(self)
         self.nb.pack(fill='both', expand=True, padx=10, pady=8)
 
         self.frame_charts = ttk.Frame(self.nb)
         self.frame_tables = ttk.Frame(self.nb)
+        self.frame_analysis = ttk.Frame(self.nb)
         self.nb.add(self.frame_charts, text='Graphiques')
         self.nb.add(self.frame_tables, text='Données')
+        self.nb.add(self.frame_analysis, text='Analyse')
+        self.frame_trends = ttk.Frame(self.nb)
+        self.nb.add(self.frame_trends, text='Tendances')
 
-        # Chart canvas
+        # Chart canvas; matplotlib is only loaded once this window opens
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
         self.fig = Figure(figsize=(8, 5), dpi=100)
         self.canvas = FigureCanvasTkAgg(self.fig, master=self.frame_charts)
         self.canvas.get_tk_widget().pack(fill='both', expand=True)
@@ -60,108 +81,123 @@ class StatisticsWindow(tk.Toplevel):
         self.tree = ttk.Treeview(self.frame_tables, columns=('a','b','c','d'), show='headings')
         self.tree.pack(fill='both', expand=True)
 
+        # Per-vehicle indicators and their spread across the fleet
+        self.analysis_label = ttk.Label(self.frame_analysis, justify='left')
+        self.analysis_label.pack(fill='x', padx=6, pady=6)
+        columns = ('imm', 'km', 'l_per_100km', 'cost_per_km')
+        self.analysis_tree = ttk.Treeview(self.frame_analysis, columns=columns, show='headings')
+        for col, text in zip(columns, ('Immatriculation', 'Km', 'L/100km', 'Coût/km')):
+            self.analysis_tree.heading(col, text=text)
+            self.analysis_tree.column(col, width=150)
+        self.analysis_tree.pack(fill='both', expand=True)
+
+        # Time series of the rollups, for the dates above
+        trend_controls = ttk.Frame(self.frame_trends)
+        trend_controls.pack(fill='x', padx=6, pady=6)
+        self.trend_combos = {}
+        for label, choices in (('Par', TREND_PERIODS), ('Séries', TREND_GROUPS), ('Mesure', TREND_MEASURES)):
+            ttk.Label(trend_controls, text=label).pack(side='left')
+            combo = ttk.Combobox(trend_controls, state='readonly', width=16, values=list(choices))
+            combo.current(1 if choices is TREND_PERIODS else 0)
+            combo.pack(side='left', padx=(4, 10))
+            self.trend_combos[label] = combo
+        self.btn_trends = ttk.Button(trend_controls, text='Afficher', command=self.show_trends)
+        self.btn_trends.pack(side='left')
+        self.trend_fig = Figure(figsize=(8, 4.5), dpi=100)
+        self.trend_canvas = FigureCanvasTkAgg(self.trend_fig, master=self.frame_trends)
+        self.trend_canvas.get_tk_widget().pack(fill='both', expand=True)
+
         # store last results
         self.last_results = {}
-
-    # ------------------ Data queries ------------------
-    def _date_clause(self, field, start, end):
-        clauses = []
-        params = []
-        if start:
-            clauses.append(f"{field} >= ?")
-            params.append(start.isoformat())
-        if end:
-            clauses.append(f"{field} <= ?")
-            params.append(end.isoformat())
-        if clauses:
-            return ' AND '.join(clauses), params
-        return '', []
+        self.last_analysis = None
+        self.last_period = None
+        self.task = None
 
     def calculate(self):
         start = _parse_date(self.start_entry.get())
         end = _parse_date(self.end_entry.get())
-        try:
-            conn = get_connection()
-            c = conn.cursor()
-
-            # Total kilometrage (current - initial)
-            c.execute('SELECT id, immatriculation, kilometrage_initial, kilometrage_actuel, type_vehicule FROM vehicules')
-            vehs = [dict(r) for r in c.fetchall()]
-            km_per_vehicle = []
-            total_km = 0
-            for v in vehs:
-                km = (v.get('kilometrage_actuel') or 0) - (v.get('kilometrage_initial') or 0)
-                km_per_vehicle.append({'id': v['id'], 'imm': v['immatriculation'], 'km': km, 'type': v.get('type_vehicule')})
-                total_km += km
-
-            # Period kms from sorties_reservations (if date range provided)
-            period_km = 0
-            if start or end:
-                clause, params = self._date_clause('date_sortie_reelle', start, end)
-                q = 'SELECT km_retour, km_depart FROM sorties_reservations'
-                if clause:
-                    q += ' WHERE ' + clause
-                c.execute(q, params)
-                for r in c.fetchall():
-                    km_r = (r['km_retour'] or 0) - (r['km_depart'] or 0)
-                    period_km += max(km_r, 0)
-
-            # Costs per vehicle
-            c.execute('SELECT v.id, v.immatriculation, IFNULL(SUM(r.cout),0) as fuel_cost FROM vehicules v LEFT JOIN ravitaillements r ON r.vehicule_id = v.id GROUP BY v.id')
-            fuel = {r['id']: r['fuel_cost'] for r in c.fetchall()}
-            c.execute('SELECT v.id, IFNULL(SUM(m.cout),0) as maint_cost FROM vehicules v LEFT JOIN maintenances m ON m.vehicule_id = v.id GROUP BY v.id')
-            maint = {r['id']: r['maint_cost'] for r in c.fetchall()}
-
-            costs = []
-            for v in km_per_vehicle:
-                vid = v['id']
-                f = fuel.get(vid, 0) or 0
-                m = maint.get(vid, 0) or 0
-                total = f + m
-                costs.append({'imm': v['imm'], 'fuel': f, 'maintenance': m, 'total': total})
-
-            # Most active employees
-            clause2, params2 = self._date_clause('date_sortie_reelle', start, end)
-            q2 = 'SELECT employe_id, COUNT(*) as sorties, SUM(COALESCE(km_retour,0)-COALESCE(km_depart,0)) as km FROM sorties_reservations'
-            if clause2:
-                q2 += ' WHERE ' + clause2
-            q2 += ' GROUP BY employe_id ORDER BY sorties DESC LIMIT 10'
-            c.execute(q2, params2)
-            employees = [dict(r) for r in c.fetchall()]
-
-            # Consumption per vehicle
-            c.execute('SELECT vehicule_id, IFNULL(SUM(quantite_litres),0) as liters FROM ravitaillements GROUP BY vehicule_id')
-            liters = {r['vehicule_id']: r['liters'] for r in c.fetchall()}
-            c.execute('SELECT vehicule_id, SUM(COALESCE(km_retour,0)-COALESCE(km_depart,0)) as km FROM sorties_reservations GROUP BY vehicule_id')
-            kms_from_trips = {r['vehicule_id']: r['km'] for r in c.fetchall()}
-            consumption = []
-            for v in vehs:
-                vid = v['id']
-                lit = liters.get(vid, 0) or 0
-                km = kms_from_trips.get(vid, 0) or 0
-                if km > 0:
-                    cons_100 = (lit / km) * 100
-                else:
-                    cons_100 = None
-                consumption.append({'imm': v['immatriculation'], 'liters': lit, 'km': km, 'l_per_100km': cons_100, 'type': v.get('type_vehicule')})
-
-            conn.close()
-
-            self.last_results = {
-                'km_per_vehicle': km_per_vehicle,
-                'total_km': total_km,
-                'period_km': period_km,
-                'costs': costs,
-                'employees': employees,
-                'consumption': consumption
-            }
-
-            self._render_results()
-
-        except Exception as e:
-            messagebox.showerror('Erreur', str(e))
+        if self.task:
+            self.task.cancel()
+        self.set_loading('Calcul en cours…')
+        self.task = get_executor(self).submit(
+            self.compute, start, end,
+            on_done=lambda results: self._on_results(results, (start, end)),
+            on_error=self._on_error, owner=self
+        )
+
+    def set_loading(self, message=None):
+        self.status_label.config(text=message or '')
+        self.btn_calculate.config(state='disabled' if message else 'normal')
+
+    def _on_results(self, results, period):
+        self.task = None
+        self.set_loading()
+        self.last_results, self.last_analysis = results
+        self.last_period = period
+        self._render_results()
+        self._render_analysis()
+
+    def _on_error(self, exc):
+        self.task = None
+        self.set_loading()
+        messagebox.showerror('Erreur', str(exc))
+
+    def compute(self, start, end):
+        """Called in a worker thread, so no Tk here."""
+        return compute_statistics(start, end), fleet_summary(start, end)
+
+    def show_trends(self):
+        start = _parse_date(self.start_entry.get())
+        end = _parse_date(self.end_entry.get())
+        period = TREND_PERIODS[self.trend_combos['Par'].get()]
+        group = TREND_GROUPS[self.trend_combos['Séries'].get()]
+        measure = self.trend_combos['Mesure'].get()
+        self.btn_trends.config(state='disabled')
+        get_executor(self).submit(
+            compute_trends, period, group, start, end,
+            on_done=lambda rows: self._render_trends(rows, measure),
+            on_error=self._on_trends_error, owner=self
+        )
+
+    def _on_trends_error(self, exc):
+        self.btn_trends.config(state='normal')
+        messagebox.showerror('Erreur', str(exc))
 
     # ------------------ Rendering ------------------
+    def _render_trends(self, rows, measure):
+        self.btn_trends.config(state='normal')
+        column = TREND_MEASURES[measure]
+        periods = sorted({r['periode'] for r in rows})
+        index = {p: i for i, p in enumerate(periods)}
+        series = {}
+        for r in rows:
+            series.setdefault(r['groupe'] or '(aucun)', [0] * len(periods))[index[r['periode']]] += r[column] or 0
+
+        # Largest series first; the tail is summed so that the chart stays readable
+        ranked = sorted(series.items(), key=lambda item: sum(item[1]), reverse=True)
+        if len(ranked) > TREND_SERIES:
+            others = [sum(values) for values in zip(*(v for _, v in ranked[TREND_SERIES - 1:]))]
+            ranked = ranked[:TREND_SERIES - 1] + [('Autres', others)]
+
+        self.trend_fig.clf()
+        ax = self.trend_fig.add_subplot(111)
+        if not periods:
+            ax.text(0.5, 0.5, 'Pas de données', ha='center')
+            ax.axis('off')
+        else:
+            for name, values in ranked:
+                ax.plot(periods, values, marker='o', markersize=3, label=name if len(ranked) > 1 else None)
+            if len(ranked) > 1:
+                ax.legend(fontsize=7)
+            ax.set_title(f"{measure} par {self.trend_combos['Par'].get().lower()}")
+            # Label at most ~12 periods on the x axis
+            step = max(1, len(periods) // 12)
+            ax.set_xticks(range(0, len(periods), step))
+            ax.set_xticklabels(periods[::step], rotation=45, fontsize=7)
+        self.trend_fig.tight_layout()
+        self.trend_canvas.draw()
+
+
     def _render_results(self):
         self.fig.clf()
         ax1 = self.fig.add_subplot(221)
@@ -187,7 +223,7 @@ class StatisticsWindow(tk.Toplevel):
         # top employees pie
         emp = self.last_results['employees'][:8]
         if emp:
-            labels3 = [str(e['employe_id']) + ' (' + str(e['sorties']) + ')' for e in emp]
+            labels3 = [f"{e['prenom'] or ''} {e['nom'] or e['employe_id']} ({e['sorties']})".strip() for e in emp]
             vals3 = [e['km'] or 0 for e in emp]
             ax3.pie(vals3, labels=labels3, autopct='%1.1f%%')
             ax3.set_title('Top employés par km (période)')
@@ -207,22 +243,49 @@ class StatisticsWindow(tk.Toplevel):
             lpk = f"{row['l_per_100km']:.2f}" if row['l_per_100km'] is not None else ''
             self.tree.insert('', 'end', values=(row['imm'], row['liters'], row['km'], lpk))
 
+    def _render_analysis(self):
+        analysis = self.last_analysis
+        lines = []
+        for key, title in (('l_per_100km', 'L/100km par véhicule'),
+                           ('fill_l_per_100km', 'L/100km par plein'),
+                           ('cost_per_km', 'Coût/km par véhicule')):
+            values = ', '.join(f'P{q}: {v:.2f}' for q, v in analysis[key].items() if not math.isnan(v))
+            lines.append(f"{title} — {values or 'pas de données'}")
+        self.analysis_label.config(text='\n'.join(lines))
+
+        self.analysis_tree.delete(*self.analysis_tree.get_children())
+        # Most expensive vehicles per km first, those without km last
+        for v in sorted(analysis['vehicles'], key=lambda v: -(v['cost_per_km'] or -1)):
+            self.analysis_tree.insert('', 'end', values=(
+                v['imm'], f"{v['km']:.0f}",
+                f"{v['l_per_100km']:.2f}" if v['l_per_100km'] is not None else '',
+                f"{v['cost_per_km']:.3f}" if v['cost_per_km'] is not None else '',
+            ))
+
     # ------------------ Exports ------------------
     def export_csv(self):
-        if not self.last_results:
-            messagebox.showinfo('Info', 'Aucune donnée à exporter. Cliquez sur Calculer d\u00e9abord.')
-            return
-        path = filedialog.asksaveasfilename(defaultextension='.csv', filetypes=[('CSV','*.csv')])
+        start = _parse_date(self.start_entry.get())
+        end = _parse_date(self.end_entry.get())
+        path = filedialog.asksaveasfilename(
+            defaultextension='.csv',
+            filetypes=[('CSV', '*.csv'), ('CSV compressé', '*.csv.gz')]
+        )
         if not path:
             return
-        # Export consumption table
-        with open(path, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow(['Immatriculation','Litres','Km','L/100km'])
-            for r in self.last_results['consumption']:
-                lpk = f"{r['l_per_100km']:.2f}" if r['l_per_100km'] is not None else ''
-                writer.writerow([r['imm'], r['liters'], r['km'], lpk])
-        messagebox.showinfo('Export', f'Export CSV enregistré: {path}')
+        self.status_label.config(text='Export CSV en cours…')
+        get_executor(self).submit(
+            _export_csv, path, start, end, with_task=True,
+            on_progress=self._on_export_progress,
+            on_done=lambda _: self._on_exported(f'Export CSV enregistré: {path}'),
+            on_error=self._on_error, owner=self
+        )
+
+    def _on_export_progress(self, title, written):
+        self.status_label.config(text=f'Export CSV : {title} ({written} lignes)…')
+
+    def _on_exported(self, message):
+        self.status_label.config(text='')
+        messagebox.showinfo('Export', message)
 
     def export_pdf(self):
         if not self.last_results:
@@ -231,43 +294,12 @@ class StatisticsWindow(tk.Toplevel):
         path = filedialog.asksaveasfilename(defaultextension='.pdf', filetypes=[('PDF','*.pdf')])
         if not path:
             return
-        # Create PDF with the three figures
-        pp = PdfPages(path)
-        # recreate same plots as in UI
-        fig1 = plt.figure(figsize=(8, 6))
-        ax = fig1.add_subplot(111)
-        km_data = sorted(self.last_results['km_per_vehicle'], key=lambda x: x['km'], reverse=True)[:10]
-        labels = [v['imm'] for v in km_data]
-        vals = [v['km'] for v in km_data]
-        ax.bar(labels, vals)
-        ax.set_title('Kilométrage par véhicule (top 10)')
-        ax.tick_params(axis='x', rotation=45)
-        fig1.tight_layout()
-        pp.savefig(fig1)
-        plt.close(fig1)
-
-        fig2 = plt.figure(figsize=(8, 6))
-        ax2 = fig2.add_subplot(111)
-        costs_data = sorted(self.last_results['costs'], key=lambda x: x['total'], reverse=True)[:10]
-        labels2 = [c['imm'] for c in costs_data]
-        vals2 = [c['total'] for c in costs_data]
-        ax2.bar(labels2, vals2, color='orange')
-        ax2.set_title('Coût total par véhicule (top 10)')
-        ax2.tick_params(axis='x', rotation=45)
-        fig2.tight_layout()
-        pp.savefig(fig2)
-        plt.close(fig2)
-
-        # Add a simple table page for consumption
-        fig3 = plt.figure(figsize=(8.27, 11.69))
-        ax3 = fig3.add_subplot(111)
-        ax3.axis('off')
-        table_data = [[r['imm'], r['liters'], r['km'], f"{r['l_per_100km']:.2f}" if r['l_per_100km'] is not None else ''] for r in self.last_results['consumption']]
-        col_labels = ['Immatriculation','Litres','Km','L/100km']
-        ax3.table(cellText=table_data, colLabels=col_labels, loc='center')
-        fig3.tight_layout()
-        pp.savefig(fig3)
-        plt.close(fig3)
-
-        pp.close()
-        messagebox.showinfo('Export', f'Export PDF enregistré: {path}')
+        start, end = self.last_period
+        period = f"{start or '…'} – {end or '…'}" if start or end else None
+        self.status_label.config(text='Export PDF en cours…')
+        from ..pdf_report import build_pdf
+        get_executor(self).submit(
+            build_pdf, path, self.last_results, period,
+            on_done=lambda _: self._on_exported(f'Export PDF enregistré: {path}'),
+            on_error=self._on_error, owner=self
+        )
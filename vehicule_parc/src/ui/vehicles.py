@@ -1,6 +1,10 @@
+import sqlite3
 import tkinter as tk
 from tkinter import ttk, messagebox
-from ..models import add_vehicle, find_vehicles
+from ..dates import parse_date
+from ..models import add_vehicle, find_vehicles, count_vehicles, page_cursor, VEHICLE_SEARCH_COLUMNS
+from .paging import PagedTreeLoader
+from .search import SearchController, text_matches
 from ..db import get_connection as db_connection
 
 
@@ -20,6 +24,17 @@ VEHICLE_TYPES = ['Voiture', 'Utilitaire', 'Camionnette', 'Fourgon', 'Bus']
 FUEL_TYPES = ['Essence', 'Diesel', 'Électrique', 'Hybride']
 AFFECTATION_TYPES = ['Mutualisé', 'Voiture de fonction']
 
+# (clé de tri, titre) des colonnes de la liste
+LIST_COLUMNS = [
+    ('immatriculation', 'Immatriculation'),
+    ('marque', 'Marque'),
+    ('modele', 'Modèle'),
+    ('type_vehicule', 'Type'),
+    ('annee', 'Année'),
+    ('statut', 'Statut'),
+    ('service_principal', 'Service'),
+]
+
 
 # ==========================================================
 # LISTE DES VEHICULES (DASHBOARD)
@@ -38,7 +53,12 @@ class VehicleListWindow:
 
         ttk.Label(search, text='Recherche').grid(row=0, column=0)
         self.search_var = tk.StringVar()
-        self.search_var.trace_add('write', lambda *_: self.load_vehicles())
+        self.search = SearchController(
+            self.root, self.search_var,
+            on_search=lambda text: self.load_vehicles(),
+            on_narrow=self.narrow_vehicles,
+            filters=self.current_filters
+        )
         ttk.Entry(search, textvariable=self.search_var, width=25).grid(row=0, column=1)
 
         ttk.Label(search, text='Type').grid(row=0, column=2)
@@ -60,6 +80,8 @@ class VehicleListWindow:
             state='readonly',
             width=15
         ).grid(row=0, column=5)
+        for var in (self.type_var, self.status_var):
+            var.trace_add('write', lambda *_: self.search.refresh())
 
         ttk.Button(search, text='Ajouter', command=self.open_add_vehicle).grid(row=0, column=6, padx=5)
         ttk.Button(search, text='Modifier', command=self.open_edit_vehicle).grid(row=0, column=7, padx=5)
@@ -68,14 +90,22 @@ class VehicleListWindow:
         self.alert_label = ttk.Label(self.root, foreground='red', font=('Arial', 11, 'bold'))
         self.alert_label.pack(fill='x', padx=10)
 
-        columns = ('Immatriculation', 'Marque', 'Modèle', 'Type', 'Année', 'Statut', 'Service')
-        self.tree = ttk.Treeview(self.root, columns=columns, show='headings')
+        tree_frame = ttk.Frame(self.root)
+        tree_frame.pack(fill='both', expand=True, padx=10, pady=5)
+
+        self.tree = ttk.Treeview(tree_frame, columns=[key for key, _ in LIST_COLUMNS], show='headings')
 
-        for col in columns:
-            self.tree.heading(col, text=col)
-            self.tree.column(col, width=120)
+        for key, label in LIST_COLUMNS:
+            self.tree.heading(key, text=label, command=lambda k=key: self.sort_by(k))
+            self.tree.column(key, width=120)
+
+        for status, color in STATUS_COLORS.items():
+            self.tree.tag_configure(status, background=color)
 
-        self.tree.pack(fill='both', expand=True, padx=10, pady=5)
+        self.order_by = 'immatriculation'
+        self.pager = PagedTreeLoader(self.tree, self.fetch_page, self.insert_vehicle)
+        self.tree.pack(side='left', fill='both', expand=True)
+        self.pager.scrollbar.pack(side='right', fill='y')
 
         self.status_bar = ttk.Label(self.root, relief='sunken')
         self.status_bar.pack(fill='x')
@@ -83,48 +113,70 @@ class VehicleListWindow:
     # ======================================================
     # CHARGEMENT
     # ======================================================
-    def load_vehicles(self):
-        self.tree.delete(*self.tree.get_children())
-
+    def current_filters(self):
         filters = {}
         if self.type_var.get():
             filters['type_vehicule'] = self.type_var.get()
         if self.status_var.get():
             filters['statut'] = self.status_var.get()
+        return filters
 
-        vehicles = find_vehicles(
-            filter_text=self.search_var.get() or None,
-            filters=filters or None
-        )
-
-        total = len(vehicles)
-        available = sum(1 for v in vehicles if v['statut'] == 'disponible')
-
+    def load_vehicles(self):
+        # Pages fetched later while scrolling must match this first one,
+        # whatever is typed in the meantime.
+        self.query_text = self.search_var.get() or None
+        filters = self.current_filters()
+
+        self.pager.reset()
+
+        total = count_vehicles(self.query_text, filters)
+        available = count_vehicles(self.query_text, dict(filters, statut='disponible')) \
+            if filters.get('statut', 'disponible') == 'disponible' else 0
+        self.show_totals(total, available)
+
+    def narrow_vehicles(self, text):
+        if not self.pager.narrow(lambda v: text_matches(v, VEHICLE_SEARCH_COLUMNS, text)):
+            return False
+        self.query_text = text or None
+        rows = self.pager.rows
+        self.show_totals(len(rows), sum(1 for v in rows if v['statut'] == 'disponible'))
+        return True
+
+    def show_totals(self, total, available):
         self.alert_label.config(
             text="Aucun véhicule disponible" if total and not available else ''
         )
+        self.status_bar.config(text=f"Total : {total} | Disponibles : {available}")
 
-        for v in vehicles:
-            self.tree.insert(
-                '',
-                'end',
-                iid=str(v['id']),   # 🔑 ID BDD = clé unique
-                values=(
-                    v['immatriculation'],
-                    v['marque'],
-                    v['modele'],
-                    v['type_vehicule'],
-                    v['annee'],
-                    v['statut'],
-                    v['service_principal']
-                ),
-                tags=(v['statut'],)
-            )
+    def fetch_page(self, last_row, limit):
+        return find_vehicles(
+            filter_text=self.query_text,
+            filters=self.current_filters() or None,
+            order_by=self.order_by,
+            limit=limit,
+            after=page_cursor(last_row, self.order_by) if last_row else None
+        )
 
-        for status, color in STATUS_COLORS.items():
-            self.tree.tag_configure(status, background=color)
+    def insert_vehicle(self, v):
+        self.tree.insert(
+            '',
+            'end',
+            iid=str(v['id']),   # 🔑 ID BDD = clé unique
+            values=(
+                v['immatriculation'],
+                v['marque'],
+                v['modele'],
+                v['type_vehicule'],
+                v['annee'],
+                v['statut'],
+                v['service_principal']
+            ),
+            tags=(v['statut'],)
+        )
 
-        self.status_bar.config(text=f"Total : {total} | Disponibles : {available}")
+    def sort_by(self, key):
+        self.order_by = key
+        self.load_vehicles()
 
     # ======================================================
     # SELECTION
@@ -170,8 +222,16 @@ class VehicleListWindow:
 
         conn = db_connection()
         c = conn.cursor()
-        c.execute('DELETE FROM vehicules WHERE id = ?', (v['id'],))
-        conn.commit()
+        try:
+            c.execute('DELETE FROM vehicules WHERE id = ?', (v['id'],))
+            conn.commit()
+        except sqlite3.IntegrityError:
+            conn.close()
+            messagebox.showerror(
+                'Suppression impossible',
+                'Ce véhicule est référencé par des sorties, maintenances ou documents'
+            )
+            return
         conn.close()
 
         self.load_vehicles()
@@ -215,6 +275,7 @@ class AddEditVehicleWindow:
             ('Kilométrage Initial (km)', 'kilometrage_initial', 'entry'),
             ('Kilométrage Actuel (km)', 'kilometrage_actuel', 'entry'),
             ('Seuil Révision (km)', 'seuil_revision_km', 'entry'),
+            ('Capacité réservoir (L)', 'capacite_reservoir', 'entry'),
         ]
 
         for i, field in enumerate(fields):
@@ -250,6 +311,11 @@ class AddEditVehicleWindow:
 
     def save(self):
         data = {k: w.get() or None for k, w in self.entries.items()}
+        try:
+            data['date_acquisition'] = parse_date(data.get('date_acquisition'), 'Date d\'acquisition')
+        except ValueError as e:
+            messagebox.showerror('Erreur', str(e))
+            return
 
         conn = db_connection()
         c = conn.cursor()